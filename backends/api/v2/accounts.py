@@ -12,14 +12,16 @@ from backends.api.v2.forms.accounts import SignInForm, SignUpForm, SimpleEmailFo
 from backends.api.v2.responses.users import UserLoginResponse, AccountResponse
 from libs.auth.backends import custom_auth
 from libs.aws.utils import compair_push_token, edit_profile_image_by_url, temporary_password_send_email
-from libs.elasticsearch.reviews import elasticsearch_reviews
 from libs.oauth2.permissions import CustomIsAuthenticated
 from libs.utils import get_client_ip, make_temporary_password, local_now
 from models.messages import MessageBox, MessageCategory
 from models.reviews import Review
 from models.social import SocialAccount
 from models.users import User
-from services.reviews import service as review_service
+from services.product_scores import service as product_score_service
+from services.tags import service as tag_service
+from tasks.products import request_update_product_info
+from tasks.reviews import request_review_index
 from cash_db.redis_utils import period_zrem
 
 class SignInView(APIView):
@@ -1038,11 +1040,13 @@ class AccountInactiveView(APIView):
 
             # 작성한 리뷰 비전시 처리
             reviews = Review.objects.filter(user=user)
+            product_ids = set(reviews.filter(is_display=True).values_list('product_id', flat=True))
             reviews.update(is_display=False, when_seceded=True)
-            for review in reviews:
-                review_service.delete_tags(review.id)
-                body = {"doc": {'isDisplay': 0}}
-                elasticsearch_reviews.update(_id=review.id, body=body)
+            for product_id in product_score_service.products_changed(product_ids):
+                request_update_product_info(product_id)
+            review_ids = list(reviews.values_list('id', flat=True))
+            tag_service.remove_reviews_tags(review_ids)
+            request_review_index(*review_ids)
 
             user.is_active = False
             user.save()
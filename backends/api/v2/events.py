@@ -11,11 +11,12 @@ from backends.common.exceptions import FailedPreconditionException,ConflictExcep
 from libs.aws.dynamodb import aws_dynamodb_etc_list, aws_dynamodb_event_participants, aws_dynamodb_events
 from libs.oauth2.permissions import CustomIsAuthenticated
 from libs.shortcuts import get_object_or_raise_404, get_object_or_raise_404
-from libs.utils import get_image_ratio, get_client_ip, local_now
+from libs.utils import get_client_ip, local_now
 from models.events import Event, EventParticipants, EventComment
 from models.users import User
 from services.events import service as event_service
 from services.event_comments import service as event_comment_service
+from services.images import service as image_service
 from .forms.events import EventListForm, EventCommentListForm, EventCommentForm
 from .responses.events import EventsResponse, EventRespose, EventCommentsResonse, EventCommentJoin
 from .responses.common import SuccessMessageResponse
@@ -127,7 +128,7 @@ class EventView(viewsets.ViewSet):
         except:
             setattr(event, 'brand_name', event.brand.name)
             setattr(event, 'comments_count', event.users.count())
-            setattr(event, 'ratio', get_image_ratio(path=event.event_image, is_url=True))
+            setattr(event, 'ratio', image_service.get_ratio(event.event_image))
             response['event'] = event
         try:
             response['checked'] = self.check(request, pk=pk).data
@@ -1,6 +1,7 @@
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 
+from libs.pagination import decode_cursor
 from .brands import BrandCategoryFilterMixin
 from .paging import BasicListFormMixin
 from .products import CategoryFilterMixin, CommerceFilterMixin
@@ -10,6 +11,11 @@ from .users import UserFilterMixin
 class ReviewsListFormMixin(BasicListFormMixin):
     RATING_CHOICES = ('all', '1', '2', '3', '4', '5')
 
+    cursor = serializers.CharField(
+        default=None,
+        help_text=_("다음 페이지 cursor 값 (응답의 paging.next 값)")
+    )
+
     order = serializers.ChoiceField(
         default='create_date_desc',
         choices=('create_date_desc', 'create_date_asc', 'like_desc', 'like_asc'),
@@ -36,6 +42,14 @@ class ReviewsListFormMixin(BasicListFormMixin):
         )
     )
 
+    def validate_cursor(self, value):
+        if value:
+            try:
+                decode_cursor(value)
+            except ValueError:
+                raise serializers.ValidationError('this field is invalid')
+        return value
+
     def validate_rating(self, value):
         if value:
             for rating in value.split(','):
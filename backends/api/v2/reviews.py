@@ -1,6 +1,5 @@
 import json
 from collections import OrderedDict
-from datetime import datetime
 from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import routers
@@ -10,31 +9,30 @@ from rest_framework.decorators import detail_route, list_route
 from rest_framework.response import Response
 
 from backends.api.exceptions import ConflictException, InvalidParameterException
-from libs.aws.utils import send_push_message
-from libs.elasticsearch.reviews import elasticsearch_reviews
 from libs.oauth2.permissions import CustomIsAuthenticated
 from libs.shortcuts import get_object_or_404
 from libs.utils import get_client_ip, extract_tags, local_now,\
-    format_round_datetime, iso8601
+    format_round_datetime
 from cash_db.redis_utils import get_review_is_written, set_review_is_written, \
-    period_zincrby, period_zrem, period_hset
+    period_hset
 from libs.utils import utc_now
-from django.db.utils import IntegrityError
 from models.blinded_reviews import BlindedReview
 from models.common_codes import CommonCode
 from models.events import EventPrizeMapping
 from models.messages import MessageBox, MessageCategory
-from models.product_goods import ProductGoods
 from models.products import Product
 from models.reviews import Review
 from models.reviews import Reviewlike
-from models.reviews import Review_first_log
-from models.tags import Tag, TagObject
 from models.users import User
 from services.blinded_reviews import service as blinded_review_service
+from services.product_scores import service as product_score_service
+from services.first_reviews import service as first_review_service
+from services.rank_ledger import service as rank_ledger_service
 from services.reviews import service as review_service
+from services.tags import service as tag_service
 from services.users import service as users_service
-from tasks.products import update_product_info
+from tasks.products import request_update_product_info
+from tasks.reviews import request_review_index, request_like_notification
 from .forms.reviews import ReviewsForm, ReviewCheckForm, ReviewWriteForm, ReviewUpdateForm, ReviewReportForm
 from .responses.common import SuccessMessageResponse
 from .responses.reviews import ReviewsResponse, ReivewCheckResponse, ReviewWriteResponse, ReportTypesResponse, ReivewCheckRankRangeResponse
@@ -260,8 +258,6 @@ class ReviewView(viewsets.ViewSet):
         cuid = int(request.META.get('HTTP_IDREGISTER') or 0)
         user = get_object_or_404(User, id=cuid)
 
-        review_service.reset_rank(cuid)
-        
         params = ReviewWriteForm(data=request.data)
         params.is_valid(raise_exception=True)
 
@@ -298,102 +294,31 @@ class ReviewView(viewsets.ViewSet):
             review.save()
 
             # user info update
+            previous_review_count = user.review_count
             user.review_count += 1
             user.score += 1
             user.save()
 
             # product info update
-            update_product_info.delay(product_id)
+            for _product_id in product_score_service.review_created(review, user, previous_review_count):
+                transaction.on_commit(lambda _id=_product_id: request_update_product_info(_id))
 
             # tag update
             tags = extract_tags(contents)
-            for tag_name in tags:
-                tag, created = Tag.objects.get_or_create(name=tag_name)
-                if created:
-                    TagObject(type='review', object_id=review.id, tag=tag).save()
-                    tag.create_date = now
-                    tag.save()
-                else:
-                    if not TagObject.objects.filter(type='review', object_id=review.id, tag=tag).exists():
-                        TagObject(type='review', object_id=review.id, tag=tag).save()
-                        tag.count += 1
-                        tag.modified_date = now
-                        tag.save()
+            tag_service.set_review_tags(review.id, tags)
 
             review.tag = ",".join(tags)
             review.save()
 
             # elastic update
-            body = dict()
-            # review
-            body['idreviewcomment'] = review.id
-            body['reviewText'] = contents
-            body['rating'] = rating
-            body['likeCount'] = 0
-            body['isDisplay'] = 1
-            body['isEvaluation'] = 0
-            body['create_date'] = now
-            body['tag'] = ",".join(tags)
-
-            # user
-            body['idRegister'] = user.id
-            body['nickName'] = user.nickname
-            body['birthYear'] = user.birth_year
-            body['skinType'] = user._skin_type
-            body['gender'] = user._gender
-            body['registerScore'] = user.score
-            body['registerRank'] = user.rank
-            body['isBlind'] = user.is_blinded
-            body['registerFileDir'] = user.file_dir
-            body['registerFileSaveName'] = user.file_name_save
-
-            # product
-            body['idProduct'] = product.id
-            body['productTitle'] = product.name
-            body['idBrand'] = product.brand_id
-            body['productFileDir'] = product.file_dir
-            body['productFileSaveName'] = product.file_name
-            body['brandTitle'] = product.brand.name
-            body['productIsDisplay'] = int(product.is_display)
-
-            categories = product.categories.all().values('id', 'main_category_id')
-            body['firstCategoryList'] = ""
-            body['secondCategoryList'] = ""
-            for category in categories:
-                body['firstCategoryList'] += "[" + str(category['main_category_id']) + "]"
-                body['secondCategoryList'] += "[" + str(category['id']) + "]"
-
-            try:
-                goods_info = ProductGoods.objects.get(product_id=product_id, goods_count__gt=0)
-                body['goods_info'] = {
-                    "goods_count": goods_info.goods_count,
-                    "min_price": goods_info.min_price,
-                    "max_price": goods_info.max_price
-                }
-            except ProductGoods.DoesNotExist:
-                pass
+            transaction.on_commit(lambda: request_review_index(review.id))
 
-            elasticsearch_reviews.add(body=body, _id=review.id)
-            
-            is_first = not Review.objects.filter(product=product_id).exists()
-            
         response = dict()
         response['review_count'] = user.review_set.count()
 
-        # redis 에 update 하는 쿼리
-        # 첫 번째 리뷰인지 확인한다.
-        
-        
-        # 첫 리뷰시에 첫 리뷰 관리 테이블에 넣는다.
-        if (is_first):
-            try:
-                Review_first_log(id=product_id, user=user,
-                             timestamp=kst_now().strftime("%Y%m%d%H%M%S")
-                             ).save(force_insert=True)
-            except IntegrityError :
-                # 테이블에 접근하는 순간 이미 product 가 존재해서 에러를 띄운다면 처음이 아님으로 is_first 를 False 로 변경한다.
-                is_first = False
-                
+        # 첫 번째 리뷰인지 확인하고 첫 리뷰 관리 테이블에 넣는다.
+        is_first = first_review_service.review_created(review)
+
         review_create_cash = {
             'is_first':is_first,
             'written':True
@@ -429,6 +354,9 @@ class ReviewView(viewsets.ViewSet):
         review = get_object_or_404(Review, id=pk, user=user, is_display=True)
         product = review.product
 
+        old_rating = review.rating
+        old_state = review.state
+
         with transaction.atomic():
             # review update
             # 블라인드 상태인 리뷰는 사용자가 수정시 검수중 상태로 변경된다.
@@ -443,34 +371,12 @@ class ReviewView(viewsets.ViewSet):
             review.save()
 
             # product info update
-            update_product_info.delay(product.id)
+            for _product_id in product_score_service.review_updated(review, user, old_rating, old_state):
+                transaction.on_commit(lambda _id=_product_id: request_update_product_info(_id))
 
             # tag update
             tags = extract_tags(contents)
-            now = local_now().strftime('%Y%m%d%H%M%S')
-
-            object_tags = TagObject.objects.filter(type='review', object_id=review.id)
-            # tag count update
-            for _obj in object_tags:
-                _obj.tag.count -= 1
-                _obj.tag.modified_date = now
-                _obj.tag.save()
-            # delete tag mapping
-            if object_tags.exists():
-                object_tags.delete()
-
-            for tag_name in tags:
-                tag, created = Tag.objects.get_or_create(name=tag_name)
-                if created:
-                    TagObject(type='review', object_id=review.id, tag=tag).save()
-                    tag.create_date = now
-                    tag.save()
-                else:
-                    if not TagObject.objects.filter(type='review', object_id=review.id, tag=tag).exists():
-                        TagObject(type='review', object_id=review.id, tag=tag).save()
-                        tag.count += 1
-                        tag.modified_date = now
-                        tag.save()
+            tag_service.set_review_tags(review.id, tags)
 
             review.tag = ",".join(tags)
 
@@ -478,12 +384,7 @@ class ReviewView(viewsets.ViewSet):
             review.save()
 
             # elastic update
-            body = {
-                "doc": {'rating': new_rating,
-                        'reviewText': contents,
-                        'tag': ",".join(tags)}
-            }
-            elasticsearch_reviews.update(_id=review.id, body=body)
+            transaction.on_commit(lambda: request_review_index(review.id))
 
         return Response({}, status=status.HTTP_200_OK)
 
@@ -500,8 +401,6 @@ class ReviewView(viewsets.ViewSet):
         user = get_object_or_404(User, id=cuid)
 
         try:
-            review_service.reset_rank(cuid)
-            
             review = get_object_or_404(Review, id=pk, user=user,
                                        is_display=True)
             product = review.product
@@ -511,7 +410,7 @@ class ReviewView(viewsets.ViewSet):
                 BlindedReview.objects.filter(review_id=pk).delete()
             
                 # 좋아요 삭제
-                Reviewlike.objects.filter(writer=user, product=product).delete()
+                deleted_likes, _ = Reviewlike.objects.filter(writer=user, product=product).delete()
             
                 # 좋아요 알림 메세지 삭제
                 MessageBox.objects.filter(
@@ -522,63 +421,31 @@ class ReviewView(viewsets.ViewSet):
                 review.delete()
             
                 # user info update
+                previous_review_count = user.review_count
                 user.review_count -= 1
                 user.score -= 1
                 user.save()
+                review_service.likes_removed(user.id, deleted_likes)
             
                 # product info update
-                update_product_info.delay(product.id)
+                for _product_id in product_score_service.review_deleted(review, user, previous_review_count):
+                    transaction.on_commit(lambda _id=_product_id: request_update_product_info(_id))
             
                 # tag update
-                object_tags = TagObject.objects.filter(type='review', object_id=pk)
-                now = local_now().strftime('%Y%m%d%H%M%S')
-                # tag count update
-                for _obj in object_tags:
-                    _obj.tag.count -= 1
-                    _obj.tag.modified_date = now
-                    _obj.tag.save()
-                # delete tag mapping
-                if object_tags.exists():
-                    object_tags.delete()
+                tag_service.remove_reviews_tags([int(pk)])
             
                 # elastic delete
-                elasticsearch_reviews.delete(_id=pk)
+                transaction.on_commit(lambda: request_review_index(int(pk)))
             
-                # 레디스와 연동하기
-                # 처음 리뷰 찾기
-                first_review = Review_first_log.objects.filter(
-                        id=product.id, user=user).all()[:1]
-                
-                is_first = len(first_review) > 0
                 # 리뷰 포인트 가져오기
                 review_points = review_service.get_review_points()
                 user_review_count = review_service.get_review_count(user.id)
                 this_week_user_review_count = \
                     review_service.get_this_week_review_count(user.id)
-                
-                score = review_points['review_point'] + \
-                        ((user_review_count % 3 == 0) * \
-                         review_points['multiple_bonus_point']) + \
-                        (is_first * review_points['first_bonus_point'])
-            
-                
-            
-                # 처음 기존 리뷰 삭제
-                if is_first is True:
-                    first_review[0].delete()
-            
-                    # 처음 리뷰 검색후 넣어주기
-                    new_first_reviews = Review.objects.filter(
-                        product=product).order_by('_created_at').all()[:2]
-            
-                    # 최초 하나는 내 리뷰임으로 두번째 것을 넣어준다.
-                    if len(new_first_reviews) > 1:
-                        # 넣어준다
-                        Review_first_log(
-                            id=product.id, user=new_first_reviews[1].user,
-                            timestamp=new_first_reviews[1]._created_at).save()
-            
-                        
+
+            # 처음 리뷰였다면 다음으로 먼저 쓴 리뷰에 넘긴다.
+            is_first, next_first = first_review_service.review_deleted(product.id, int(pk), user.id)
+
             # 레디스는 automic 이 적용되지 않음으로 rdb 에서 동작을 마무리한 후 redis 에
             # 적용한다.
             # 삭제로 리뷰가 0개가 되는 순간 배치에서 감지하지 않음으로 주의해야 한다.
@@ -586,35 +453,15 @@ class ReviewView(viewsets.ViewSet):
             # 레디스에 스코어 값 감소시키기
             # 리뷰가 정상이면
             if review.state == "N" and review.when_seceded == 0 and review.is_display == True and review.user.is_active == 1 and review.user.is_blinded == 0 and review.user.is_black == 0  :
-                # 리뷰가 마지막이었다면
-                if user_review_count == 1:
-                    # rank 에서 삭제
-                    period_zrem('all', user.id)
-                else:
-                    # 아니면 감소
-                    period_zincrby('all', user.id, -score)
-                
-                # review 에 _created_at 은 kst 가 기준이기 떄문에 kst 로 비교한다
-                if iso8601(datetime.strptime(
-                        review._created_at, "%Y%m%d%H%M%S")) > \
-                        iso8601(kst_last_week_friday_18_00()):
-                    # 이번주 리뷰가 마지막이었다면
-                    if  this_week_user_review_count == 1:
-                        # 삭제한다
-                        period_zrem('this_week', user.id)
-                    else:
-                        # 아니면 감소
-                        period_zincrby('this_week', user.id, -score)
+                rank_ledger_service.review_deleted(
+                    review, int(pk), user.id, review_points, user_review_count, this_week_user_review_count, is_first)
+
                 # 처음 리뷰가 맞고 다른 사람이 쓴 것이 있으면
-                if is_first is True and len(new_first_reviews) > 1:
+                if is_first is True and next_first:
                     # 처음 리뷰로 등록된 유저 보너스 점수 레디스에 등록하기
-                    period_zincrby('all', new_first_reviews[1].user.id,
-                                   review_points['first_bonus_point'])
-                    if review._created_at > \
-                            iso8601(kst_last_week_friday_18_00()):
-                        period_zincrby('this_week',
-                                   new_first_reviews[1].user.id,
-                                   review_points['first_bonus_point'])
+                    _, next_user_id, next_created_at = next_first
+                    rank_ledger_service.first_bonus_transferred(
+                        next_user_id, product.id, review_points, next_created_at)
         except:
             raise
 
@@ -709,42 +556,14 @@ class ReviewView(viewsets.ViewSet):
                 create_date=create_date
             ).save()
 
-            # writer info update
-            user_updated_info = users_service.get_user_score_info(writer.id)
-            writer.review_count = user_updated_info.get('review_count')
-            writer.like_count = user_updated_info.get('like_count')
-            writer.score = user_updated_info.get('score')
-            writer.save()
-
-            # review like count update
-            review.like_count = Reviewlike.objects.using('default').filter(writer=writer, product=product).count()
-            review.save()
+            # writer, review like count update
+            review_service.like_added(review)
 
             # elastic update
-            body = {
-                "doc": {'likeCount': review.like_count}
-            }
-            elasticsearch_reviews.update(_id=review.id, body=body)
-
-        # 알림함
-        try:
-            review_service.make_like_message(review.id, register.id, created_at)
-        except:
-            pass
+            transaction.on_commit(lambda: request_review_index(review.id))
 
-        # send push message
-        push_text = "{} 님이 내 리뷰를 좋아합니다.\n{} - {}".format(
-            register.nickname, product.brand.name, product.name
-        )
-        try:
-            send_push_message(
-                push_text,
-                link_type=17,
-                link_code=product.id,
-                target_id=writer.id,
-            )
-        except:
-            pass
+            # 알림함, push message
+            transaction.on_commit(lambda: request_like_notification(review.id, register.id, created_at))
 
         response['is_success'] = True
         response['message'] = _("좋아요 되었습니다.")
@@ -0,0 +1,84 @@
+from django.test import SimpleTestCase
+
+from libs.aws.dynamodb_writer import DynamoDBUpdateBuffer
+
+
+class FakeTable:
+    """
+    UpdateItem 만 흉내내는 DynamoDB 테이블
+    fail_keys 의 키는 남은 실패 횟수만큼 예외를 낸다.
+    """
+
+    def __init__(self, fail_keys=None):
+        self.items = dict()
+        self.calls = list()
+        self.fail_keys = dict(fail_keys or {})
+
+    def update(self, key, attr_update):
+        self.calls.append(key)
+        if self.fail_keys.get(key, 0) > 0:
+            self.fail_keys[key] -= 1
+            raise Exception('ProvisionedThroughputExceededException')
+        self.items.setdefault(key, dict()).update(attr_update)
+
+
+class TestDynamoDBUpdateBuffer(SimpleTestCase):
+    def make_buffer(self, table, **kwargs):
+        kwargs.setdefault('retry_delay', 0)
+        return DynamoDBUpdateBuffer(table.update, **kwargs)
+
+    def test_merge_same_key(self):
+        table = FakeTable()
+        buffer = self.make_buffer(table)
+
+        buffer.add(1, {'review_count': 1, 'rating_avg': 3.0})
+        buffer.add(1, {'review_count': 2})
+
+        self.assertEqual(buffer.flush(), {'written': 1, 'failed': 0})
+        self.assertEqual(table.items[1], {'review_count': 2, 'rating_avg': 3.0})
+        self.assertEqual(table.calls, [1])
+
+    def test_retry(self):
+        table = FakeTable(fail_keys={1: 2})
+        buffer = self.make_buffer(table, max_retries=3)
+
+        buffer.add(1, {'review_count': 1})
+
+        self.assertEqual(buffer.flush(), {'written': 1, 'failed': 0})
+        self.assertEqual(table.calls, [1, 1, 1])
+        self.assertEqual(len(buffer), 0)
+
+    def test_requeue(self):
+        table = FakeTable(fail_keys={1: 2})
+        buffer = self.make_buffer(table, max_retries=1)
+
+        buffer.add(1, {'review_count': 1, 'rating_avg': 3.0})
+        self.assertEqual(buffer.flush(), {'written': 0, 'failed': 1})
+        self.assertEqual(len(buffer), 1)
+
+        # 다시 시도하기 전에 들어온 값이 우선한다.
+        buffer.add(1, {'review_count': 2})
+        self.assertEqual(buffer.flush(), {'written': 1, 'failed': 0})
+        self.assertEqual(table.items[1], {'review_count': 2, 'rating_avg': 3.0})
+
+    def test_drop_after_max_flushes(self):
+        table = FakeTable(fail_keys={1: 100})
+        buffer = self.make_buffer(table, max_retries=0, max_flushes=3)
+
+        buffer.add(1, {'review_count': 1})
+        for _ in range(3):
+            self.assertEqual(buffer.flush(), {'written': 0, 'failed': 1})
+
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(len(table.calls), 3)
+
+    def test_shutdown_flush(self):
+        table = FakeTable()
+        buffer = self.make_buffer(table, batch_size=10)
+
+        buffer.add(1, {'review_count': 1})
+        buffer.add(2, {'review_count': 5})
+        self.assertEqual(table.calls, [])
+
+        self.assertEqual(buffer.shutdown(), {'written': 2, 'failed': 0})
+        self.assertEqual(table.items, {1: {'review_count': 1}, 2: {'review_count': 5}})
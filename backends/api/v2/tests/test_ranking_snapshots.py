@@ -0,0 +1,40 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from services.ranking_snapshots import service as ranking_snapshot_service
+
+
+class TestRankingSnapshots(SimpleTestCase):
+    snapshot = {
+        'complete': True,
+        'created_at': 0,
+        'items': [
+            # id, 순위, 순위 변동 타입, 순위 변동, 브랜드, 브랜드 카테고리, 가격, 구매가능, 1차 카테고리, 2차 카테고리
+            [11, 1, 'up', 2, 5, [1], 10000, True, [3], [31]],
+            [12, 2, 'new', 0, 5, [1], 20000, False, [4], [41]],
+        ],
+    }
+
+    def get_list(self, scope, scope_id, **kwargs):
+        kwargs.setdefault('limit', 20)
+        with mock.patch('services.ranking_snapshots.get_ranking_snapshot', return_value=self.snapshot):
+            return ranking_snapshot_service.get_list(scope, scope_id, **kwargs)
+
+    def test_brand_scope_with_string_pk(self):
+        result = self.get_list('brand', '5', brand_id='5')
+
+        self.assertEqual([product['id'] for product in result['products']], [11, 12])
+        self.assertEqual(result['total_count'], 2)
+
+    def test_string_filter_ids(self):
+        result = self.get_list('category', 31, brand_id='5', main_category_id='4')
+
+        self.assertEqual([product['id'] for product in result['products']], [12])
+
+    def test_price_and_commerce_filters(self):
+        result = self.get_list('brand', 5, max_price=15000)
+        self.assertEqual([product['id'] for product in result['products']], [11])
+
+        result = self.get_list('brand', 5, is_commerce=True)
+        self.assertEqual([product['id'] for product in result['products']], [11])
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import transaction
 from rest_framework import routers
 from rest_framework import status
@@ -7,11 +9,16 @@ from rest_framework.response import Response
 
 from backends.ec.v2.forms.products import ProductsForm, PricingForm
 from backends.ec.v2.responses.products import ProductBasic, ProductDetail
-from libs.elasticsearch.reviews import elasticsearch_reviews
+from backends.common.exceptions import NotFoundException
+from cash_db.redis_utils import create_job, get_job
 from libs.shortcuts import get_object_or_404
 from models.product_goods import ProductGoods
 from models.products import Product
 from services.products import service as products_service
+from tasks.products import propagate_goods_pricing
+
+# 가격 반영 작업 진행 상황 보관 시간 (초)
+PRICING_JOB_EXPIRE = 60 * 60 * 24
 
 
 class ProductView(viewsets.ViewSet):
@@ -179,34 +186,31 @@ class ProductView(viewsets.ViewSet):
                     info.max_price = product.get('max_price')
                     info.save()
 
-                body = {"query": {'match': {'idProduct': product_id}}}
-                sample = elasticsearch_reviews.search(body=body)
-                size = sample.get('hits').get('total')
-                res = elasticsearch_reviews.search(body=body, _size=size)
-                hits = res.get('hits')
-
-                data = []
-                for item in hits.get('hits'):
-                    body = {
-                        "_op_type": 'update',
-                        "_index": 'review_ko',
-                        "_type": 'reviews',
-                        "_id": item.get('_id'),
-                        "doc": {
-                            'goods_info': {
-                                'goods_count': product.get('goods_count'),
-                                'min_price': product.get('min_price'),
-                                'max_price': product.get('max_price')
-                            }
-                        },
-                        'doc_as_upsert': True
-                    }
-                    data.append(body)
-                    # elasticsearch_reviews.update(_id=item.get('_id'), body=body)
-                if data:
-                    elasticsearch_reviews.bulk(data)
+        # 리뷰 문서 반영은 백그라운드에서 처리한다.
+        job_id = uuid.uuid4().hex
+        goods = params.validated_data.get('data')
+        create_job(job_id, {
+            'status': 'pending',
+            'product_count': len(goods),
+            'product_done': 0,
+            'review_count': 0,
+        }, PRICING_JOB_EXPIRE)
+        propagate_goods_pricing.delay(job_id, goods)
+
+        return Response({'job_id': job_id}, status=status.HTTP_200_OK)
+
+    @list_route(methods=['get'])
+    def pricing_job(self, request):
+        """
+        제품 가격 리뷰 반영 진행 상황
+        ---
+        job_id (필수)
+        """
+        job = get_job(request.GET.get('job_id') or '')
+        if job is None:
+            raise NotFoundException('Not existed job')
 
-        return Response({}, status=status.HTTP_200_OK)
+        return Response(job, status=status.HTTP_200_OK)
 
 
 router = routers.DefaultRouter(trailing_slash=False)
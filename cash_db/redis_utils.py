@@ -18,26 +18,98 @@ def get_redis_tables(type=None,key='default'):
         env = ''
     tables = {
         'user': {
-            'default': ['rank_user_all', 'rank_user_all_copy'],
-            'all': ['rank_user_all', 'rank_user_all_copy'],
-            'this_week': ['rank_user_this_week',
-                'rank_user_this_week_copy'],
-            'last_week': ['rank_user_last_week', 'rank_user_last_week_copy']
+            'default': ['rank_user_all'],
+            'all': ['rank_user_all'],
+            'this_week': ['rank_user_this_week'],
+            'last_week': ['rank_user_last_week']
         },
         'list': {
-            'default': ['rank_list_all', 'rank_list_all_copy'],
-            'all': ['rank_list_all', 'rank_list_all_copy'],
-            'this_week': ['rank_list_this_week',
-                'rank_list_this_week_copy'],
-            'last_week': ['rank_list_last_week', 'rank_list_last_week_copy']
+            'default': ['rank_list_all'],
+            'all': ['rank_list_all'],
+            'this_week': ['rank_list_this_week'],
+            'last_week': ['rank_list_last_week']
+        },
+        'version': {
+            'default': ['rank_version_all'],
+            'all': ['rank_version_all'],
+            'this_week': ['rank_version_this_week'],
+            'last_week': ['rank_version_last_week']
+        },
+        'rank_ledger': {
+            'default': ['rank_ledger']
+        },
+        'brand_directory': {
+            'default': ['brand_directory_version']
+        },
+        'category_matcher': {
+            'default': ['category_matcher_version']
+        },
+        'category_tree': {
+            'default': ['category_tree_version']
+        },
+        'point_config': {
+            'default': ['point_config_version']
+        },
+        'review_index': {
+            'default': ['review_index_pending', 'review_index_scheduled'],
+            'attempts': ['review_index_attempts']
+        },
+        'job': {
+            'default': ['job']
+        },
+        'like_dirty': {
+            'default': ['like_dirty_users', 'like_dirty_reviews']
+        },
+        'product_search': {
+            'default': ['product_search_changes', 'product_search_sequence']
+        },
+        'ranking_snapshot': {
+            'default': ['ranking_snapshot'],
+            'requests': ['ranking_snapshot_requests'],
+            'lock': ['ranking_snapshot_lock']
+        },
+        'product_card': {
+            'default': ['product_card'],
+            'invalidated': ['product_card_invalidated']
+        },
+        'first_review': {
+            'default': ['first_review_owner'],
+            'candidates': ['first_review_candidates']
+        },
+        'like_notification': {
+            'default': ['like_notification_reviews', 'like_notification_scheduled'],
+            'events': ['like_notification_events']
         },
         'review_is_written':{
             "default":['review_is_written']
+        },
+        'product_rating': {
+            'default': ['product_rating_buckets']
+        },
+        'product_update': {
+            'default': ['product_update_pending', 'product_update_requests',
+                        'product_update_scheduled']
+        },
+        'naver_refresh': {
+            'default': ['naver_refresh_lock']
+        },
+        'image_meta': {
+            'default': ['image_meta'],
+            'lock': ['image_meta_lock']
         }
     }
     
     return [env + t for t in tables[type][key]]
 
+def get_redis_table(type=None, key='default'):
+    return get_redis_tables(type, key)[0]
+
+def get_staging_table(table):
+    """
+    재생성 중인 랭킹 테이블 (다음 세대)
+    """
+    return table + ':next'
+
 def set_review_is_written(user_id,dict):
     table = get_redis_tables('review_is_written')[0]
     
@@ -63,96 +135,909 @@ def get_review_is_written(user_id):
     
     return result
 
-def get_data(func, tables, *keyword, **kwargs):
-    result = None
-    
-    for t in tables:
-        value = func(t, *keyword)
-        if value is not None:
-            result = value
-            break
-    
-    return result
-
-def get_mdata(func, tables, *keyword, **kwargs):
-    result = None
-    
-    for t in tables:
-        values = func(t, *keyword, **kwargs)
-        if len(values) > 0:
-            result = values
-            break
-    
-    return result
-
 def period_hget(period, id):
-    tables = get_redis_tables('user', period)
-    return get_data(redis_con.hget, tables, id)
+    return redis_con.hget(get_redis_table('user', period), id)
 
 def period_hset(period, id, val):
-    for t in get_redis_tables('user', period):
-        redis_con.hset(t, id, val)
+    redis_con.hset(get_redis_table('user', period), id, val)
     return 'done'
 
 def period_hdel(period, id):
-    for t in get_redis_tables('user', period):
-        redis_con.hdel(t, id)
+    redis_con.hdel(get_redis_table('user', period), id)
     return 'done'
 
 def period_hmget(period, ids):
-    tables = get_redis_tables('user', period)
-    return get_mdata(redis_con.hmget, tables, ids)
+    return redis_con.hmget(get_redis_table('user', period), ids)
 
 def period_zrevrank(period, id):
-    tables = get_redis_tables('list', period)
-    return get_data(redis_con.zrevrank, tables, id)
+    return redis_con.zrevrank(get_redis_table('list', period), id)
 
 def period_zcard(period):
-    tables = get_redis_tables('list', period)
-    return redis_con.zcard(tables[0])
+    return redis_con.zcard(get_redis_table('list', period))
 
 def period_zrangebyscore(period, score1, score2):
-    tables = get_redis_tables('list', period)
-    return get_mdata(redis_con.zrangebyscore, tables, score1, score2)
+    return redis_con.zrangebyscore(
+        get_redis_table('list', period), score1, score2)
 
 def period_zrevrange(period, score1, score2, **kwargs):
-    tables = get_redis_tables('list', period)
-    return get_mdata(redis_con.zrevrange, tables, score1, score2,
-                     **kwargs)
+    return redis_con.zrevrange(
+        get_redis_table('list', period), score1, score2, **kwargs)
 
 def period_zincrby(period, id,point):
-    for t in get_redis_tables('list', period):
-        redis_con.zincrby(t, id, point)
+    redis_con.zincrby(get_redis_table('list', period), amount=point, value=id)
     return 'done'
 
 def period_zrem(period, id):
-    for t in get_redis_tables('list', period):
-        redis_con.zrem(t, id)
+    redis_con.zrem(get_redis_table('list', period), id)
     return 'done'
 
 def period_zscore(period, id):
-    tables = get_redis_tables('list', period)
-    return get_data(redis_con.zscore, tables, id)
+    return redis_con.zscore(get_redis_table('list', period), id)
+
+# 랭킹 테이블 교체
+# 배치에서 랭킹을 다시 만들 때는 다음 세대 테이블(:next)에 쓴 후 RENAME 으로 한번에 교체한다.
+# 실시간 점수 변경은 현재 테이블에만 반영한다.
+# KEYS: (원본, 대상) 테이블 쌍 목록 + 증가시킬 version key 목록, ARGV: 테이블 쌍 개수
+SWAP_TABLES_SCRIPT = """
+local pairs_count = tonumber(ARGV[1])
+for i = 1, pairs_count * 2, 2 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('RENAME', KEYS[i], KEYS[i + 1])
+    else
+        redis.call('DEL', KEYS[i + 1])
+    end
+end
+
+local versions = {}
+for i = pairs_count * 2 + 1, #KEYS do
+    table.insert(versions, redis.call('INCR', KEYS[i]))
+end
+return versions
+"""
+
+swap_tables_script = redis_con.register_script(SWAP_TABLES_SCRIPT)
+
+def stage_period(period, scores, users=None, reset=False):
+    """
+    다음 세대 랭킹 테이블에 점수와 유저 정보를 쓴다.
+    나눠서 여러번 호출할 수 있으며 처음 호출할 때 reset=True 로 이전 내용을 지운다.
+    :param scores: { user_id: score }
+    :param users: { user_id: json string }
+    """
+    list_table = get_staging_table(get_redis_table('list', period))
+    user_table = get_staging_table(get_redis_table('user', period))
+
+    pipe = redis_con.pipeline(transaction=False)
+    if reset:
+        pipe.delete(list_table, user_table)
+    if scores:
+        pipe.zadd(list_table, scores)
+    if users:
+        pipe.hmset(user_table, users)
+    pipe.execute()
+
+    return 'done'
+
+def publish_period(period, with_users=False):
+    """
+    다음 세대 랭킹 테이블을 현재 테이블로 교체한다.
+    with_users 가 True 이면 유저 정보 테이블도 함께 교체한다.
+    :return: 교체된 랭킹의 version
+    """
+    list_table = get_redis_table('list', period)
+    keys = [get_staging_table(list_table), list_table]
+
+    if with_users:
+        user_table = get_redis_table('user', period)
+        keys += [get_staging_table(user_table), user_table]
+
+    versions = swap_tables_script(
+        keys=keys + [get_redis_table('version', period)],
+        args=[len(keys) // 2])
+
+    return versions[0]
+
+def rebuild_period(period, scores, users=None):
+    stage_period(period, scores, users, reset=True)
+    return publish_period(period, with_users=users is not None)
+
+def rollover_week():
+    """
+    이번주 랭킹을 지난주 랭킹으로 옮기고 이번주 랭킹을 비운다.
+    """
+    swap_tables_script(
+        keys=[get_redis_table('list', 'this_week'),
+              get_redis_table('list', 'last_week'),
+              get_redis_table('user', 'this_week'),
+              get_redis_table('user', 'last_week'),
+              get_redis_table('version', 'this_week'),
+              get_redis_table('version', 'last_week')],
+        args=[2])
+
+    return 'done'
+
+# 랭킹 포인트 변경 기록을 남기고 점수에 증감값을 반영한다.
+# 점수가 0 이하가 되거나 증감값이 'remove' 이면 랭킹에서 제외한다.
+# KEYS: 기록 list, 랭킹 테이블 목록, ARGV: 기록(json), 최대 기록 수, user id, 랭킹 테이블별 증감값
+RANK_LEDGER_SCRIPT = """
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+for i = 2, #KEYS do
+    local delta = ARGV[i + 2]
+    if delta == 'remove' then
+        redis.call('ZREM', KEYS[i], ARGV[3])
+    elseif tonumber(delta) ~= 0 then
+        local score = tonumber(redis.call('ZINCRBY', KEYS[i], delta, ARGV[3]))
+        if score <= 0 then
+            redis.call('ZREM', KEYS[i], ARGV[3])
+        end
+    end
+end
+return 1
+"""
+
+rank_ledger_script = redis_con.register_script(RANK_LEDGER_SCRIPT)
+
+def append_rank_ledger(entry, user_id, deltas, max_len=100000):
+    """
+    :param entry: 기록 (dict)
+    :param deltas: { period: 증감값 (None 이면 랭킹에서 제외) }
+    """
+    periods = list(deltas.keys())
+    rank_ledger_script(
+        keys=[get_redis_table('rank_ledger')] + [get_redis_table('list', period) for period in periods],
+        args=[json.dumps(entry), max_len, user_id] +
+             ['remove' if deltas[period] is None else deltas[period] for period in periods])
+    return 'done'
+
+def get_rank_ledger(start=0, end=-1):
+    return [json.loads(v) for v in redis_con.lrange(get_redis_table('rank_ledger'), start, end)]
 
 def get_user_review_info(key, id):
     result = period_hget(key, id)
     return result and json.loads(result)['reviewCnt']
 
+# 유저의 score, rank, total 을 한번에 계산한다.
+# 동점자는 같은 랭크를 가지므로 rank 는 (나보다 점수가 높은 유저 수 + 1) 이다.
+# KEYS: 랭킹 테이블, ARGV: user id 목록
+USER_RANK_SCRIPT = """
+local total = redis.call('ZCARD', KEYS[1])
+local result = {}
+for _, id in ipairs(ARGV) do
+    local score = redis.call('ZSCORE', KEYS[1], id)
+    if score then
+        table.insert(result, score)
+        table.insert(result, redis.call('ZCOUNT', KEYS[1], '(' .. score, '+inf') + 1)
+        table.insert(result, total)
+    else
+        table.insert(result, false)
+        table.insert(result, false)
+        table.insert(result, false)
+    end
+end
+return result
+"""
+
+user_rank_script = redis_con.register_script(USER_RANK_SCRIPT)
+
+def make_rank_info(score, rank, total):
+    if score is None:
+        return None
+
+    return {
+        'score': int(float(score)),
+        'rank': rank,
+        'ratio': 100 if total == 0 else math.ceil(rank / total * 100)
+    }
+
+def get_users_rank(period, ids):
+    """
+    여러 유저의 랭킹 정보를 한번의 요청으로 가져온다.
+    :return: { id: {'score', 'rank', 'ratio'} or None }
+    """
+    if not ids:
+        return dict()
+
+    values = user_rank_script(keys=[get_redis_table('list', period)], args=ids)
+
+    result = dict()
+    for idx, id in enumerate(ids):
+        score, rank, total = values[idx * 3: idx * 3 + 3]
+        result[id] = make_rank_info(score, rank, total)
+
+    return result
+
 def get_user_rank(period, id):
-    score = period_zscore(period, id)
-    
-    if score is not None:
-        result = dict()
-        users = period_zrangebyscore(period, score, score)
-        # 인덱스가 0 부터 시작하기 떄문에 1을 더해준다.
-        rank = period_zrevrank(period, users[-1]) + 1
-        total = period_zcard(period)
-        result['score'] = int(score)
-        result['rank'] = rank
-        result['ratio'] = 100 if total == 0 else \
-                math.ceil(rank/total * 100)
-    else:
-        result = None
-        
+    return get_users_rank(period, [id])[id]
+
+# 한 페이지의 유저와 점수를 가져온다.
+# 페이지 첫 유저의 랭크 계산을 위해 첫 유저보다 점수가 높은 유저 수와 전체 유저 수를 함께 반환한다.
+# KEYS: 랭킹 테이블, ARGV: start, end
+RANK_PAGE_SCRIPT = """
+local rows = redis.call('ZREVRANGE', KEYS[1], ARGV[1], ARGV[2], 'WITHSCORES')
+if #rows == 0 then
+    return {0, 0}
+end
+
+local result = {redis.call('ZCARD', KEYS[1]), redis.call('ZCOUNT', KEYS[1], '(' .. rows[2], '+inf')}
+for _, v in ipairs(rows) do
+    table.insert(result, v)
+end
+return result
+"""
+
+rank_page_script = redis_con.register_script(RANK_PAGE_SCRIPT)
+
+def period_zrevrange_with_rank(period, start, end):
+    """
+    start ~ end 구간의 유저를 랭크와 함께 가져온다.
+    랭크는 페이지 안에서 계산하며 동점자는 같은 랭크를 가진다.
+    :return: [{'id', 'score', 'rank', 'ratio'}, ...]
+    """
+    values = rank_page_script(
+        keys=[get_redis_table('list', period)], args=[start, end])
+
+    total, higher = values[0], values[1]
+    rows = values[2:]
+
+    result = list()
+    for idx in range(0, len(rows), 2):
+        score = rows[idx + 1]
+        if not result:
+            rank = higher + 1
+        elif score == rows[idx - 1]:
+            rank = result[-1]['rank']
+        else:
+            # 이전 유저와 점수가 다르면 앞에 있는 유저 수 + 1 이 랭크가 된다.
+            rank = start + idx // 2 + 1
+
+        info = make_rank_info(score, rank, total)
+        info['id'] = rows[idx]
+        result.append(info)
+
     return result
-    
+
+def get_product_rating_table(product_id):
+    return '{}:{}'.format(get_redis_table('product_rating'), product_id)
+
+# 제품 평점 구간 카운터가 이미 있을 때만 증감한다.
+# 카운터가 없는 제품은 전체 집계(reconcile)로 처음 만든다.
+# KEYS: 제품 평점 구간 카운터, ARGV: 구간, 증감값 목록
+INCR_PRODUCT_RATING_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+incr_product_rating_script = redis_con.register_script(INCR_PRODUCT_RATING_SCRIPT)
+
+def incr_product_rating_counters(product_id, deltas):
+    """
+    :param deltas: { 구간: 증감값 }
+    :return: 카운터가 있어서 반영되었으면 True
+    """
+    args = list()
+    for bucket, delta in deltas.items():
+        if delta:
+            args += [bucket, delta]
+
+    if not args:
+        return False
+
+    return bool(incr_product_rating_script(
+        keys=[get_product_rating_table(product_id)], args=args))
+
+def get_product_rating_counters(product_id):
+    """
+    :return: { 구간: 리뷰 수 } 카운터가 없으면 None
+    """
+    values = redis_con.hgetall(get_product_rating_table(product_id))
+    if not values:
+        return None
+    return {k: int(v) for k, v in values.items()}
+
+def get_products_rating_counters(product_ids):
+    pipe = redis_con.pipeline(transaction=False)
+    for product_id in product_ids:
+        pipe.hgetall(get_product_rating_table(product_id))
+
+    result = dict()
+    for product_id, values in zip(product_ids, pipe.execute()):
+        result[product_id] = {k: int(v) for k, v in values.items()} \
+            if values else None
+    return result
+
+def set_products_rating_counters(counters):
+    """
+    :param counters: { product_id: { 구간: 리뷰 수 } }
+    """
+    pipe = redis_con.pipeline(transaction=False)
+    for product_id, values in counters.items():
+        pipe.hmset(get_product_rating_table(product_id), values)
+    pipe.execute()
+    return 'done'
+
+def scan_product_rating_ids(count=1000):
+    """
+    카운터가 저장된 제품 아이디 (SCAN)
+    """
+    prefix = get_redis_table('product_rating') + ':'
+    for key in redis_con.scan_iter(match=prefix + '*', count=count):
+        yield int(key[len(prefix):])
+
+def delete_products_rating_counters(product_ids):
+    if not product_ids:
+        return 0
+    return redis_con.delete(*[get_product_rating_table(product_id) for product_id in product_ids])
+
+# 제품 점수 재계산 요청을 모은다.
+# 처리 예약이 없을 때만 1 을 반환해서 호출한 쪽이 처리 task 를 예약하도록 한다.
+# KEYS: 대기 제품 set, 요청 수, 처리 예약 키, ARGV: product id, 예약 유지 시간(초)
+ADD_PRODUCT_UPDATE_SCRIPT = """
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('INCR', KEYS[2])
+if redis.call('SET', KEYS[3], 1, 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+# 대기 중인 제품을 모두 꺼내고 요청 수를 초기화한다.
+# KEYS: 대기 제품 set, 요청 수, 처리 예약 키
+POP_PRODUCT_UPDATES_SCRIPT = """
+redis.call('DEL', KEYS[3])
+local ids = redis.call('SMEMBERS', KEYS[1])
+redis.call('DEL', KEYS[1])
+local result = {tonumber(redis.call('GETSET', KEYS[2], 0) or 0)}
+for _, id in ipairs(ids) do
+    table.insert(result, id)
+end
+return result
+"""
+
+add_product_update_script = redis_con.register_script(ADD_PRODUCT_UPDATE_SCRIPT)
+pop_product_updates_script = redis_con.register_script(POP_PRODUCT_UPDATES_SCRIPT)
+
+def add_product_update(product_id, expire):
+    """
+    :return: 처리 task 를 예약해야 하면 True
+    """
+    return bool(add_product_update_script(
+        keys=get_redis_tables('product_update'), args=[product_id, expire]))
+
+def pop_product_updates():
+    """
+    :return: (요청 수, 제품 아이디 목록)
+    """
+    values = pop_product_updates_script(keys=get_redis_tables('product_update'))
+    return values[0], [int(v) for v in values[1:]]
+
+def get_naver_refresh_table(product_id):
+    return '{}:{}'.format(get_redis_table('naver_refresh'), product_id)
+
+def lock_naver_refresh(product_id, expire):
+    """
+    제품의 네이버 정보 갱신 예약, 이미 예약되어 있으면 False
+    """
+    return bool(redis_con.set(get_naver_refresh_table(product_id), 1, nx=True, ex=expire))
+
+def unlock_naver_refresh(product_id):
+    return redis_con.delete(get_naver_refresh_table(product_id))
+
+def get_images_meta(urls):
+    """
+    :return: { url: { 'etag', 'width', 'height', 'ratio' } } (없으면 None)
+    """
+    if not urls:
+        return dict()
+    values = redis_con.hmget(get_redis_table('image_meta'), urls)
+    return {url: json.loads(value) if value else None for url, value in zip(urls, values)}
+
+def set_image_meta(url, meta):
+    return redis_con.hset(get_redis_table('image_meta'), url, json.dumps(meta))
+
+def lock_image_meta(url, expire):
+    """
+    이미지 정보 계산 예약, 이미 예약되어 있으면 False
+    """
+    key = '{}:{}'.format(get_redis_table('image_meta', 'lock'), url)
+    return bool(redis_con.set(key, 1, nx=True, ex=expire))
+
+def get_point_config_version():
+    return int(redis_con.get(get_redis_table('point_config')) or 0)
+
+def bump_point_config_version():
+    return redis_con.incr(get_redis_table('point_config'))
+
+def get_brand_directory_version():
+    return int(redis_con.get(get_redis_table('brand_directory')) or 0)
+
+def bump_brand_directory_version():
+    return redis_con.incr(get_redis_table('brand_directory'))
+
+def get_category_matcher_version():
+    return int(redis_con.get(get_redis_table('category_matcher')) or 0)
+
+def bump_category_matcher_version():
+    return redis_con.incr(get_redis_table('category_matcher'))
+
+def get_category_tree_version():
+    return int(redis_con.get(get_redis_table('category_tree')) or 0)
+
+def bump_category_tree_version():
+    return redis_con.incr(get_redis_table('category_tree'))
+
+# 리뷰 검색 색인 요청을 모은다. (review id, 처음 요청 시각)
+# 처리 예약이 없을 때만 1 을 반환해서 호출한 쪽이 처리 task 를 예약하도록 한다.
+# KEYS: 대기 리뷰 zset, 처리 예약 키, ARGV: 요청 시각, 예약 유지 시간(초), review id 목록
+ADD_REVIEW_INDEX_SCRIPT = """
+for i = 3, #ARGV do
+    redis.call('ZADD', KEYS[1], 'NX', ARGV[1], ARGV[i])
+end
+if redis.call('SET', KEYS[2], 1, 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+# 처리할 시각이 된 리뷰를 먼저 요청된 것부터 count 개 꺼낸다.
+# KEYS: 대기 리뷰 zset, 처리 예약 키, ARGV: count, 현재 시각
+POP_REVIEW_INDEX_SCRIPT = """
+redis.call('DEL', KEYS[2])
+local rows = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[2], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[1]))
+for i = 1, #rows, 2 do
+    redis.call('ZREM', KEYS[1], rows[i])
+end
+return rows
+"""
+
+add_review_index_script = redis_con.register_script(ADD_REVIEW_INDEX_SCRIPT)
+pop_review_index_script = redis_con.register_script(POP_REVIEW_INDEX_SCRIPT)
+
+def add_review_index(review_ids, queued_at, expire):
+    """
+    :return: 처리 task 를 예약해야 하면 True
+    """
+    return bool(add_review_index_script(
+        keys=get_redis_tables('review_index'), args=[queued_at, expire] + list(review_ids)))
+
+def pop_review_index(count, now):
+    """
+    :return: [(review id, 처리 시각), ...]
+    """
+    rows = pop_review_index_script(keys=get_redis_tables('review_index'), args=[count, now])
+    return [(int(rows[i]), float(rows[i + 1])) for i in range(0, len(rows), 2)]
+
+def requeue_review_index(review_ids, now, retry_delay, max_attempts):
+    """
+    처리하지 못한 리뷰를 시도 횟수만큼 늦춰서 (retry_delay * 2^(시도 횟수 - 1) 초 후) 다시 넣는다.
+    :return: max_attempts 번 실패해서 버린 review id 목록
+    """
+    review_ids = list(review_ids)
+    if not review_ids:
+        return list()
+
+    attempts_table = get_redis_table('review_index', 'attempts')
+    pipe = redis_con.pipeline()
+    for review_id in review_ids:
+        pipe.hincrby(attempts_table, review_id, 1)
+    attempts = pipe.execute()
+
+    requeued = dict()
+    dropped = list()
+    for review_id, attempt in zip(review_ids, attempts):
+        if attempt >= max_attempts:
+            dropped.append(review_id)
+        else:
+            requeued[review_id] = now + retry_delay * (2 ** (attempt - 1))
+
+    pipe = redis_con.pipeline()
+    if requeued:
+        # 그 사이에 새로 들어온 요청이 있으면 그대로 둔다.
+        pipe.zadd(get_redis_table('review_index'), requeued, nx=True)
+    if dropped:
+        pipe.hdel(attempts_table, *dropped)
+    pipe.execute()
+
+    return dropped
+
+def clear_review_index_attempts(review_ids):
+    review_ids = list(review_ids)
+    if not review_ids:
+        return 0
+    return redis_con.hdel(get_redis_table('review_index', 'attempts'), *review_ids)
+
+def get_next_review_index_at():
+    """
+    :return: 가장 먼저 처리할 리뷰의 처리 시각 (대기 중인 리뷰가 없으면 None)
+    """
+    rows = redis_con.zrange(get_redis_table('review_index'), 0, 0, withscores=True)
+    return rows[0][1] if rows else None
+
+def count_review_index():
+    return redis_con.zcard(get_redis_table('review_index'))
+
+def get_job_table(job_id):
+    return '{}:{}'.format(get_redis_table('job'), job_id)
+
+def create_job(job_id, values, expire):
+    """
+    백그라운드 작업 진행 상황
+    :param values: 초기값 { 필드: 값 }
+    """
+    table = get_job_table(job_id)
+    pipe = redis_con.pipeline(transaction=False)
+    pipe.hmset(table, values)
+    pipe.expire(table, expire)
+    pipe.execute()
+    return 'done'
+
+def update_job(job_id, values=None, increments=None):
+    """
+    :param values: 바꿀 값 { 필드: 값 }
+    :param increments: 증가값 { 필드: 증가값 }
+    """
+    table = get_job_table(job_id)
+    pipe = redis_con.pipeline(transaction=False)
+    if values:
+        pipe.hmset(table, values)
+    for field, amount in (increments or dict()).items():
+        pipe.hincrby(table, field, amount)
+    pipe.execute()
+    return 'done'
+
+def get_job(job_id):
+    return redis_con.hgetall(get_job_table(job_id)) or None
+
+def add_like_dirty(user_id, review_id=None):
+    """
+    좋아요 수가 바뀐 유저, 리뷰 (좋아요 수 검증 대상)
+    """
+    users_table, reviews_table = get_redis_tables('like_dirty')
+    pipe = redis_con.pipeline(transaction=False)
+    pipe.sadd(users_table, user_id)
+    if review_id:
+        pipe.sadd(reviews_table, review_id)
+    pipe.execute()
+    return 'done'
+
+def pop_like_dirty():
+    """
+    :return: (유저 아이디 목록, 리뷰 아이디 목록)
+    """
+    users_table, reviews_table = get_redis_tables('like_dirty')
+    pipe = redis_con.pipeline(transaction=True)
+    pipe.smembers(users_table)
+    pipe.smembers(reviews_table)
+    pipe.delete(users_table, reviews_table)
+    user_ids, review_ids, _ = pipe.execute()
+    return [int(v) for v in user_ids], [int(v) for v in review_ids]
+
+def get_like_notification_table(review_id):
+    return '{}:{}'.format(get_redis_table('like_notification', 'events'), review_id)
+
+# 좋아요 알림을 리뷰별로 모은다.
+# 처리 예약이 없을 때만 1 을 반환해서 호출한 쪽이 처리 task 를 예약하도록 한다.
+# KEYS: 대기 리뷰 set, 처리 예약 키, 리뷰의 좋아요 목록, ARGV: review id, 좋아요(json), 예약 유지 시간(초)
+ADD_LIKE_NOTIFICATION_SCRIPT = """
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('RPUSH', KEYS[3], ARGV[2])
+if redis.call('SET', KEYS[2], 1, 'NX', 'EX', ARGV[3]) then
+    return 1
+end
+return 0
+"""
+
+# 대기 중인 리뷰와 좋아요 목록을 모두 꺼낸다.
+# KEYS: 대기 리뷰 set, 처리 예약 키, ARGV: 리뷰의 좋아요 목록 key prefix
+# return: { review id, 좋아요 수, 좋아요(json) ... } 반복
+POP_LIKE_NOTIFICATIONS_SCRIPT = """
+redis.call('DEL', KEYS[2])
+local ids = redis.call('SMEMBERS', KEYS[1])
+redis.call('DEL', KEYS[1])
+local result = {}
+for _, id in ipairs(ids) do
+    local key = ARGV[1] .. ':' .. id
+    local events = redis.call('LRANGE', key, 0, -1)
+    redis.call('DEL', key)
+    table.insert(result, id)
+    table.insert(result, #events)
+    for _, event in ipairs(events) do
+        table.insert(result, event)
+    end
+end
+return result
+"""
+
+add_like_notification_script = redis_con.register_script(ADD_LIKE_NOTIFICATION_SCRIPT)
+pop_like_notifications_script = redis_con.register_script(POP_LIKE_NOTIFICATIONS_SCRIPT)
+
+def add_like_notification(review_id, event, expire):
+    """
+    :param event: 좋아요 정보 (dict)
+    :return: 처리 task 를 예약해야 하면 True
+    """
+    reviews_table, scheduled_table = get_redis_tables('like_notification')
+    return bool(add_like_notification_script(
+        keys=[reviews_table, scheduled_table, get_like_notification_table(review_id)],
+        args=[review_id, json.dumps(event), expire]))
+
+def pop_like_notifications():
+    """
+    :return: { review id: [좋아요 정보, ...] }
+    """
+    values = pop_like_notifications_script(
+        keys=get_redis_tables('like_notification'),
+        args=[get_redis_table('like_notification', 'events')])
+
+    result = dict()
+    idx = 0
+    while idx < len(values):
+        review_id, count = int(values[idx]), int(values[idx + 1])
+        result[review_id] = [json.loads(v) for v in values[idx + 2: idx + 2 + count]]
+        idx += 2 + count
+    return result
+
+def requeue_like_notifications(likes, expire):
+    """
+    처리하지 못한 좋아요를 그 사이에 들어온 좋아요 앞에 다시 넣는다.
+    :param likes: { review id: [좋아요 정보, ...] }
+    :return: 처리 task 를 예약해야 하면 True
+    """
+    reviews_table, scheduled_table = get_redis_tables('like_notification')
+    pipe = redis_con.pipeline()
+    for review_id, events in likes.items():
+        if not events:
+            continue
+        pipe.sadd(reviews_table, review_id)
+        pipe.lpush(get_like_notification_table(review_id), *[json.dumps(event) for event in reversed(events)])
+    pipe.set(scheduled_table, 1, nx=True, ex=expire)
+    return bool(pipe.execute()[-1])
+
+def get_first_review_candidates_table(product_id):
+    return '{}:{}'.format(get_redis_table('first_review', 'candidates'), product_id)
+
+def _make_first_review_member(review_id, user_id):
+    return '{}:{}'.format(review_id, user_id)
+
+def _parse_first_review_member(member):
+    review_id, user_id = member.split(':')
+    return int(review_id), int(user_id)
+
+# 제품의 첫 리뷰 후보(작성 시각 순)에 추가하고, 첫 리뷰 작성자가 없으면 등록한다.
+# KEYS: 첫 리뷰 작성자 hash, 제품의 후보 zset, ARGV: product id, 후보(review id:user id), 작성 시각
+# return: 첫 리뷰로 등록되었으면 1
+ADD_FIRST_REVIEW_SCRIPT = """
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[2])
+return redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2])
+"""
+
+# 제품의 첫 리뷰 후보에서 제거하고, 첫 리뷰였다면 다음으로 먼저 쓴 리뷰를 첫 리뷰로 등록한다.
+# KEYS: 첫 리뷰 작성자 hash, 제품의 후보 zset, ARGV: product id, 후보(review id:user id)
+# return: { 첫 리뷰였으면 1, 다음 후보, 다음 후보 작성 시각 }
+REMOVE_FIRST_REVIEW_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[2])
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return {0}
+end
+local next = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+if #next == 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return {1}
+end
+redis.call('HSET', KEYS[1], ARGV[1], next[1])
+return {1, next[1], next[2]}
+"""
+
+add_first_review_script = redis_con.register_script(ADD_FIRST_REVIEW_SCRIPT)
+remove_first_review_script = redis_con.register_script(REMOVE_FIRST_REVIEW_SCRIPT)
+
+def add_first_review(product_id, review_id, user_id, created_at):
+    """
+    :param created_at: 리뷰 작성 시각 (%Y%m%d%H%M%S)
+    :return: 첫 리뷰로 등록되었으면 True
+    """
+    owner_table = get_redis_table('first_review')
+    return bool(add_first_review_script(
+        keys=[owner_table, get_first_review_candidates_table(product_id)],
+        args=[product_id, _make_first_review_member(review_id, user_id), int(created_at)]))
+
+def remove_first_review(product_id, review_id, user_id):
+    """
+    :return: (첫 리뷰였는지, 다음 첫 리뷰 (review id, user id, 작성 시각) 또는 None)
+    """
+    owner_table = get_redis_table('first_review')
+    result = remove_first_review_script(
+        keys=[owner_table, get_first_review_candidates_table(product_id)],
+        args=[product_id, _make_first_review_member(review_id, user_id)])
+
+    if len(result) < 3:
+        return bool(result[0]), None
+
+    next_review_id, next_user_id = _parse_first_review_member(result[1])
+    return True, (next_review_id, next_user_id, '{:d}'.format(int(float(result[2]))))
+
+def get_first_review_owners(product_ids):
+    """
+    :return: { product id: (review id, user id) }
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return dict()
+
+    owners = redis_con.hmget(get_redis_table('first_review'), product_ids)
+    return {product_id: _parse_first_review_member(owner)
+            for product_id, owner in zip(product_ids, owners) if owner}
+
+def set_first_reviews(candidates):
+    """
+    제품별 첫 리뷰 후보와 첫 리뷰 작성자를 다시 쓴다. (backfill)
+    :param candidates: { product id: [(review id, user id, 작성 시각), ...] } 작성 시각 순
+    """
+    owner_table = get_redis_table('first_review')
+    pipe = redis_con.pipeline()
+    for product_id, rows in candidates.items():
+        table = get_first_review_candidates_table(product_id)
+        pipe.delete(table)
+        if rows:
+            pipe.zadd(table, {_make_first_review_member(review_id, user_id): int(created_at)
+                              for review_id, user_id, created_at in rows})
+            pipe.hset(owner_table, product_id, _make_first_review_member(rows[0][0], rows[0][1]))
+        else:
+            pipe.hdel(owner_table, product_id)
+    pipe.execute()
+
+def set_first_review_owner(product_id, owner):
+    """
+    첫 리뷰 작성자를 첫 리뷰 기록(Review_first_log)에 맞춘다.
+    :param owner: (review id, user id, 작성 시각) 또는 None (작성자 없음)
+    """
+    owner_table = get_redis_table('first_review')
+    if owner is None:
+        redis_con.hdel(owner_table, product_id)
+        return
+
+    review_id, user_id, created_at = owner
+    member = _make_first_review_member(review_id, user_id)
+    pipe = redis_con.pipeline()
+    pipe.zadd(get_first_review_candidates_table(product_id), {member: int(created_at)})
+    pipe.hset(owner_table, product_id, member)
+    pipe.execute()
+
+def get_product_card_table(product_id):
+    return '{}:{}'.format(get_redis_table('product_card'), product_id)
+
+def get_product_cards(product_ids):
+    """
+    :return: { product id: 제품 카드 (dict) } (없으면 None)
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return dict()
+
+    values = redis_con.mget([get_product_card_table(product_id) for product_id in product_ids])
+    return {product_id: json.loads(value) if value else None for product_id, value in zip(product_ids, values)}
+
+def get_product_card_invalidated_table(product_id):
+    return '{}:{}'.format(get_redis_table('product_card', 'invalidated'), product_id)
+
+# 최근에 지워진(invalidated) 제품이 아니면 카드를 저장한다.
+# 카드를 지우기 전에 읽은 오래된 제품 정보가 지운 후에 저장되지 않도록 한다.
+# KEYS: (카드, 지움 표시) 반복, ARGV: 유지 시간(초), 카드(json) 반복
+SET_PRODUCT_CARDS_SCRIPT = """
+local count = 0
+for i = 1, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i + 1]) == 0 then
+        redis.call('SET', KEYS[i], ARGV[(i + 1) / 2 + 1], 'EX', ARGV[1])
+        count = count + 1
+    end
+end
+return count
+"""
+
+set_product_cards_script = redis_con.register_script(SET_PRODUCT_CARDS_SCRIPT)
+
+def set_product_cards(cards, expire):
+    """
+    :param cards: { product id: 제품 카드 (dict) }
+    :return: 저장한 카드 수
+    """
+    if not cards:
+        return 0
+
+    keys = list()
+    args = [expire]
+    for product_id, card in cards.items():
+        keys += [get_product_card_table(product_id), get_product_card_invalidated_table(product_id)]
+        args.append(json.dumps(card, separators=(',', ':')))
+    return set_product_cards_script(keys=keys, args=args)
+
+def delete_product_cards(product_ids, invalidated_expire=None):
+    """
+    :param invalidated_expire: 이 시간(초) 동안 카드를 다시 저장하지 않는다.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+
+    pipe = redis_con.pipeline()
+    if invalidated_expire:
+        for product_id in product_ids:
+            pipe.set(get_product_card_invalidated_table(product_id), 1, ex=invalidated_expire)
+    pipe.delete(*[get_product_card_table(product_id) for product_id in product_ids])
+    return pipe.execute()[-1]
+
+def get_ranking_snapshot_table(key):
+    return '{}:{}'.format(get_redis_table('ranking_snapshot'), key)
+
+def get_ranking_snapshot(key):
+    """
+    제품 랭킹 스냅샷을 가져오고 조회 수를 올린다. (주기적으로 다시 만들 대상 선정용)
+    :return: { 'complete', 'created_at', 'items' } (없으면 None)
+    """
+    pipe = redis_con.pipeline(transaction=False)
+    pipe.get(get_ranking_snapshot_table(key))
+    pipe.zincrby(get_redis_table('ranking_snapshot', 'requests'), 1, key)
+    value, _ = pipe.execute()
+    return json.loads(value) if value else None
+
+def set_ranking_snapshot(key, snapshot, expire):
+    pipe = redis_con.pipeline(transaction=False)
+    pipe.set(get_ranking_snapshot_table(key), json.dumps(snapshot, separators=(',', ':')), ex=expire)
+    pipe.delete('{}:{}'.format(get_redis_table('ranking_snapshot', 'lock'), key))
+    pipe.execute()
+
+def lock_ranking_snapshot(key, expire):
+    """
+    랭킹 스냅샷 생성 예약, 이미 예약되어 있으면 False
+    """
+    table = '{}:{}'.format(get_redis_table('ranking_snapshot', 'lock'), key)
+    return bool(redis_con.set(table, 1, nx=True, ex=expire))
+
+def pop_ranking_snapshot_requests(limit):
+    """
+    많이 조회된 스냅샷 key 상위 limit 개, 나머지와 조회 수는 지운다.
+    """
+    table = get_redis_table('ranking_snapshot', 'requests')
+    pipe = redis_con.pipeline()
+    pipe.zrevrange(table, 0, limit - 1)
+    pipe.delete(table)
+    keys, _ = pipe.execute()
+    return keys
+
+# 제품 검색 색인 변경 기록 (member: p:제품, b:브랜드, c:카테고리 아이디, score: 변경 순번)
+# 최근 ARGV[1] 개만 남긴다.
+# KEYS: 변경 기록 zset, 순번 키, ARGV: 남길 개수, 변경 대상 목록
+ADD_PRODUCT_SEARCH_CHANGES_SCRIPT = """
+for i = 2, #ARGV do
+    local seq = redis.call('INCR', KEYS[2])
+    redis.call('ZADD', KEYS[1], seq, ARGV[i])
+end
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[1]) - 1)
+return redis.call('GET', KEYS[2])
+"""
+
+add_product_search_changes_script = redis_con.register_script(ADD_PRODUCT_SEARCH_CHANGES_SCRIPT)
+
+def add_product_search_changes(members, max_length=50000):
+    if not members:
+        return None
+    return add_product_search_changes_script(
+        keys=get_redis_tables('product_search'), args=[max_length] + list(members))
+
+def get_product_search_changes(since):
+    """
+    :param since: 마지막으로 반영한 변경 순번
+    :return: (since 이후 변경 대상 목록, 남아있는 가장 오래된 순번, 현재 순번)
+    """
+    changes_table, sequence_table = get_redis_tables('product_search')
+    pipe = redis_con.pipeline(transaction=False)
+    pipe.zrangebyscore(changes_table, '({}'.format(since), '+inf')
+    pipe.zrange(changes_table, 0, 0, withscores=True)
+    pipe.get(sequence_table)
+    members, oldest, sequence = pipe.execute()
+    return members, int(oldest[0][1]) if oldest else None, int(sequence or 0)
@@ -0,0 +1,119 @@
+"""
+DynamoDB 속성 업데이트를 모아서 한번에 반영한다.
+
+같은 키에 대한 업데이트는 하나로 합치고(나중 값 우선) flush 할 때
+UpdateItem 을 max_workers 개까지 병렬로 실행한다.
+실패한 업데이트는 다음 flush 때 다시 시도하고 max_flushes 번 연속 실패하면 버린다.
+부분 속성 업데이트라서 BatchWriteItem(PutItem) 대신 UpdateItem 을 사용한다.
+"""
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from libs.aws.dynamodb import aws_dynamodb_products
+
+logger = logging.getLogger(__name__)
+
+
+class DynamoDBUpdateBuffer:
+    def __init__(self, update_func, batch_size=25, max_workers=4, max_retries=3, retry_delay=0.2,
+                 max_flushes=5):
+        """
+        :param update_func: update_func(key, attr_update) 형태의 UpdateItem 함수
+        :param max_flushes: 한 키의 업데이트를 다시 시도하는 최대 flush 수
+        """
+        self.update_func = update_func
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_flushes = max_flushes
+
+        self._pending = dict()
+        self._attempts = dict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, key, attr_update):
+        """
+        업데이트를 버퍼에 넣고 batch_size 만큼 모이면 flush 한다.
+        """
+        with self._lock:
+            self._pending.setdefault(key, dict()).update(attr_update)
+            is_full = len(self._pending) >= self.batch_size
+
+        if is_full:
+            self.flush()
+
+    def flush(self, wait_done=True):
+        """
+        버퍼의 업데이트를 반영한다.
+        wait_done 이 False 이면 반영을 기다리지 않고 바로 반환한다.
+        :return: { 'written': 성공 수, 'failed': 실패 수 } (wait_done 이 False 이면 None)
+        """
+        with self._lock:
+            items, self._pending = self._pending, dict()
+
+        futures = [self._executor.submit(self._write, key, attr_update)
+                   for key, attr_update in items.items()]
+
+        if not wait_done:
+            return None
+
+        wait(futures)
+        written = sum(1 for f in futures if f.result())
+
+        return {
+            'written': written,
+            'failed': len(futures) - written,
+        }
+
+    def _write(self, key, attr_update):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.update_func(key, attr_update)
+                with self._lock:
+                    self._attempts.pop(key, None)
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error('dynamodb update failed ({}): {}'.format(key, e))
+                else:
+                    time.sleep(self.retry_delay * (2 ** attempt))
+
+        with self._lock:
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts >= self.max_flushes:
+                self._attempts.pop(key, None)
+                logger.error('dynamodb update dropped after {} flushes ({}): {}'.format(
+                    attempts, key, attr_update))
+                return False
+
+            # 다음 flush 때 다시 시도한다. 그 사이에 들어온 값이 우선한다.
+            self._attempts[key] = attempts
+            pending = self._pending.get(key, dict())
+            self._pending[key] = dict(attr_update, **pending)
+
+        return False
+
+    def shutdown(self):
+        """
+        남은 업데이트를 반영하고 작업 스레드를 정리한다.
+        """
+        result = self.flush()
+        self._executor.shutdown(wait=True)
+        return result
+
+
+def _update_product(product_id, attr_update):
+    aws_dynamodb_products.update(product_id=product_id, attr_update=attr_update)
+
+
+product_update_buffer = DynamoDBUpdateBuffer(_update_product)
+
+# 프로세스 종료 시 남은 업데이트를 반영한다.
+atexit.register(product_update_buffer.shutdown)
@@ -0,0 +1,75 @@
+"""
+원격 이미지의 크기 정보
+이미지 전체를 받지 않고 헤더 부분만 Range 요청으로 읽어서 크기를 구한다.
+"""
+import requests
+from PIL import ImageFile
+
+CHUNK_SIZE = 16 * 1024
+MAX_READ_SIZE = 512 * 1024
+TIMEOUT = 3
+
+
+def get_etag(url):
+    """
+    이미지의 ETag (없으면 Last-Modified)
+    """
+    response = requests.head(url, timeout=TIMEOUT, allow_redirects=True)
+    response.raise_for_status()
+    return response.headers.get('ETag') or response.headers.get('Last-Modified')
+
+
+def read_image_size(url):
+    """
+    :return: (width, height)
+    """
+    parser = ImageFile.Parser()
+    start = 0
+
+    while start < MAX_READ_SIZE:
+        end = start + CHUNK_SIZE - 1
+        response = requests.get(url, headers={'Range': 'bytes={}-{}'.format(start, end)},
+                                timeout=TIMEOUT, stream=True)
+        try:
+            response.raise_for_status()
+
+            # Range 를 지원하지 않으면 전체 응답을 조금씩 읽는다.
+            is_partial = response.status_code == 206
+            if not is_partial and start > 0:
+                break
+
+            received = 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                parser.feed(chunk)
+                received += len(chunk)
+                if parser.image:
+                    return parser.image.size
+                if start + received >= MAX_READ_SIZE:
+                    break
+        finally:
+            response.close()
+
+        if not is_partial or received < CHUNK_SIZE:
+            break
+        start += received
+
+    raise ValueError('cannot read image size: {}'.format(url))
+
+
+def get_image_meta(url, etag=None):
+    """
+    :param etag: 저장된 ETag, 같으면 크기를 다시 읽지 않는다.
+    :return: { 'etag', 'width', 'height', 'ratio' } (변경이 없으면 None)
+    """
+    current_etag = get_etag(url)
+    if etag and current_etag == etag:
+        return None
+
+    width, height = read_image_size(url)
+
+    return {
+        'etag': current_etag,
+        'width': width,
+        'height': height,
+        'ratio': round(height / width, 4) if width else None,
+    }
@@ -0,0 +1,76 @@
+"""
+정렬 키 기반(keyset) 페이징
+마지막 항목의 정렬 키 값을 cursor 로 넘겨서 OFFSET 없이 다음 페이지를 조회한다.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DATETIME_PREFIX = 'dt:'
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return DATETIME_PREFIX + value.isoformat()
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, str) and value.startswith(DATETIME_PREFIX):
+        parsed = parse_datetime(value[len(DATETIME_PREFIX):])
+        if parsed is None:
+            raise ValueError('invalid cursor')
+        return parsed
+    return value
+
+
+def encode_cursor(values):
+    """
+    정렬 키 값 목록을 cursor 문자열로 만든다.
+    """
+    data = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length=None):
+    """
+    cursor 문자열을 정렬 키 값 목록으로 되돌린다.
+    :raise ValueError: 잘못된 cursor
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data.decode())
+    except Exception:
+        raise ValueError('invalid cursor')
+
+    if not isinstance(values, list) or (length is not None and len(values) != length):
+        raise ValueError('invalid cursor')
+
+    return [_decode_value(v) for v in values]
+
+
+def get_keyset_values(obj, ordering):
+    """
+    ordering(order_by 인자 목록) 순서대로 객체의 정렬 키 값을 가져온다.
+    """
+    return [getattr(obj, field.lstrip('-')) for field in ordering]
+
+
+def keyset_filter(ordering, values):
+    """
+    정렬 키 값 다음 항목들을 찾는 조건
+    (a, b, c) 이후 = a 이후 or (a 같고 b 이후) or (a, b 같고 c 이후)
+    ordering 의 마지막 필드는 유일해야 한다.
+    """
+    condition = Q()
+    equals = dict()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = '{}__lt'.format(name) if field.startswith('-') else '{}__gt'.format(name)
+        condition |= Q(**dict(equals, **{lookup: value}))
+        equals[name] = value
+
+    return condition
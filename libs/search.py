@@ -0,0 +1,109 @@
+"""
+문자열 부분 일치(LIKE '%word%') 검색용 메모리 색인
+공백을 지우고 소문자로 바꾼 문자열의 글자/2글자(bigram) 위치 목록을 만들어두고
+검색어의 가장 드문 n-gram 후보만 실제 문자열과 비교한다.
+색인 이후의 변경은 별도(delta)로 보관하고 일정 수 이상 쌓이면 다시 만든다.
+변경은 delta 를 복사해서 고친 후 교체하므로 검색 중인 다른 스레드에 영향을 주지 않는다.
+"""
+import re
+from array import array
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(text):
+    """
+    공백 제거 + 소문자
+    """
+    return WHITESPACE.sub('', text or '').lower()
+
+
+def _ngrams(text):
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+class SubstringIndex:
+    def __init__(self, items=()):
+        """
+        :param items: [(id, 문자열), ...]
+        """
+        self._ids = list()
+        self._texts = list()
+        self._positions = dict()
+        postings = dict()
+
+        for _id, text in items:
+            text = normalize(text)
+            position = len(self._ids)
+            self._ids.append(_id)
+            self._texts.append(text)
+            self._positions[_id] = position
+            for gram in _ngrams(text):
+                postings.setdefault(gram, list()).append(position)
+
+        self._postings = {gram: array('i', positions) for gram, positions in postings.items()}
+        self._removed = set()
+        self._delta = dict()
+
+    @property
+    def delta_size(self):
+        return len(self._removed) + len(self._delta)
+
+    def apply(self, updates=(), removes=()):
+        """
+        변경을 한번에 반영한다.
+        :param updates: [(id, 문자열), ...]
+        :param removes: [id, ...]
+        """
+        removed = set(self._removed)
+        delta = dict(self._delta)
+
+        for _id in removes:
+            position = self._positions.get(_id)
+            if position is not None:
+                removed.add(position)
+            delta.pop(_id, None)
+
+        for _id, text in updates:
+            position = self._positions.get(_id)
+            if position is not None:
+                removed.add(position)
+            delta[_id] = normalize(text)
+
+        self._removed = removed
+        self._delta = delta
+
+    def update(self, _id, text):
+        self.apply(updates=[(_id, text)])
+
+    def remove(self, _id):
+        self.apply(removes=[_id])
+
+    def search(self, word):
+        """
+        :param word: normalize 된 검색어
+        :return: 검색어를 포함하는 id set
+        """
+        if not word:
+            return set()
+
+        removed = self._removed
+        delta = self._delta
+
+        grams = [word] if len(word) == 1 else [word[i:i + 2] for i in range(len(word) - 1)]
+        candidates = min((self._postings.get(gram, ()) for gram in grams), key=len)
+
+        results = set()
+        if candidates:
+            texts = self._texts
+            for position in candidates:
+                if position not in removed and word in texts[position]:
+                    results.add(self._ids[position])
+
+        for _id, text in delta.items():
+            if word in text:
+                results.add(_id)
+
+        return results
@@ -1,37 +1,106 @@
-from django.conf import settings
-import os
-import pickle
+"""
+제품 검색어로 2차 카테고리를 찾는 색인
+카테고리명의 단어별 카테고리 아이디와 단어의 n-gram 색인을 프로세스 메모리에 보관한다.
+처음 검색할 때 만들고, redis 의 version 이 바뀌면 백그라운드에서 새로 만든 후 한번에 교체한다.
+"""
+import logging
+import re
+import threading
+import time
 
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from cash_db.redis_utils import get_category_matcher_version, bump_category_matcher_version
+from libs.search import SubstringIndex, normalize
 from models.products import SubCategory
 
+logger = logging.getLogger(__name__)
+
+# version 을 확인하는 간격 (초)
+VERSION_CHECK_INTERVAL = 60
+
+
+class CategoryMatcher:
+    def __init__(self, version):
+        self.version = version
+
+        category_dict = dict()
+        for category_id, name in SubCategory.objects.filter(is_display=True).values_list('id', 'name'):
+            for k in set(re.findall("[\w]+", name)):
+                category_dict.setdefault(k, [])
+                category_dict[k].append(category_id)
+
+        self.category_dict = category_dict
+        self.keys = list(category_dict.keys())
+        self.index = SubstringIndex(enumerate(self.keys))
+
+    def get_category_id(self, words):
+        if len(words) == 1:
+            if len(words[0]) == 1:
+                return list(self.category_dict.get(words[0], []))
+
+        ids = list()
+        for word in words:
+            for position in sorted(self.index.search(normalize(word))):
+                key = self.keys[position]
+                if word in key:
+                    ids.extend(self.category_dict[key])
+        return ids
 
-def make_category_pickle():
-    categories = SubCategory.objects.filter(is_display=True)
 
-    import re
-    category_dict = {}
-    for c in categories:
+_matcher = {'matcher': None, 'checked_at': 0, 'building': False}
+_lock = threading.Lock()
 
-        for k in set(re.findall("[\w]+", c.name)):
-            category_dict.setdefault(k, [])
-            category_dict[k].append(c.id)
 
-    with open(os.path.join(settings.BASE_DIR, 'resources', 'sub_category.pkl'), 'wb') as f:
-        pickle.dump(category_dict, f)
+def _build(version):
+    try:
+        _matcher['matcher'] = CategoryMatcher(version)
+    except Exception as e:
+        logger.error('category matcher build failed: {}'.format(e))
+    finally:
+        _matcher['building'] = False
 
 
-try:
-    with open(os.path.join(settings.BASE_DIR, 'resources', 'sub_category.pkl'), 'rb') as f:
-        d = pickle.load(f)
-except:
-    make_category_pickle()
-    with open(os.path.join(settings.BASE_DIR, 'resources', 'sub_category.pkl'), 'rb') as f:
-        d = pickle.load(f)
+def get_matcher():
+    """
+    처음에는 바로 만들고, 이후 version 이 바뀌면 기존 색인으로 응답하면서 새 색인을 만든다.
+    """
+    matcher = _matcher['matcher']
+    now = time.time()
+    if matcher is not None and now < _matcher['checked_at'] + VERSION_CHECK_INTERVAL:
+        return matcher
+
+    with _lock:
+        matcher = _matcher['matcher']
+        if matcher is not None and now < _matcher['checked_at'] + VERSION_CHECK_INTERVAL:
+            return matcher
+
+        _matcher['checked_at'] = now
+        version = get_category_matcher_version()
+
+        if matcher is None:
+            matcher = CategoryMatcher(version)
+            _matcher['matcher'] = matcher
+        elif matcher.version != version and not _matcher['building']:
+            _matcher['building'] = True
+            threading.Thread(target=_build, args=(version,), daemon=True).start()
+
+    return matcher
+
+
+def refresh_category_matcher():
+    """
+    모든 프로세스의 카테고리 색인을 다시 만들도록 한다.
+    """
+    return bump_category_matcher_version()
 
 
 def get_category_id(words):
-    if len(words) == 1:
-        if len(words[0]) == 1:
-            return [item for idlist in (d[word] for word in words if word in d.keys()) for item in idlist]
+    return get_matcher().get_category_id(words)
+
 
-    return [item for idlist in (d[key] for word in words for key in d.keys() if word in key) for item in idlist]
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+def category_matcher_changed(sender, instance, **kwargs):
+    refresh_category_matcher()
@@ -1,5 +1,5 @@
-from resources.preprocess_category import make_category_pickle
+from resources.preprocess_category import refresh_category_matcher
 
 
 def run():
-    make_category_pickle()
+    refresh_category_matcher()
@@ -0,0 +1,8 @@
+from services.first_reviews import service as first_review_service
+
+
+def run():
+    """
+    전체 제품의 첫 리뷰 후보 목록 재생성
+    """
+    return first_review_service.backfill()
@@ -0,0 +1,5 @@
+from tasks.images import refresh_image_metas
+
+
+def run():
+    refresh_image_metas.delay()
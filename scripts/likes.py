@@ -0,0 +1,5 @@
+from tasks.reviews import reconcile_like_counts
+
+
+def run():
+    reconcile_like_counts.delay()
@@ -0,0 +1,5 @@
+from tasks.products import refresh_popular_naver_info
+
+
+def run():
+    refresh_popular_naver_info.delay()
@@ -0,0 +1,5 @@
+from tasks.products import reconcile_product_scores
+
+
+def run():
+    reconcile_product_scores.delay()
@@ -0,0 +1,5 @@
+from tasks.rankings import refresh_ranking_snapshots
+
+
+def run():
+    refresh_ranking_snapshots.delay()
@@ -0,0 +1,14 @@
+from cash_db.redis_utils import rollover_week
+from services.rank_ledger import service as rank_ledger_service
+from services.reviews import service as review_service
+
+
+def rollover():
+    rollover_week()
+
+
+def rebuild():
+    """
+    누적/이번주 유저 랭킹 전체 재생성
+    """
+    return rank_ledger_service.rebuild(review_service.get_review_points())
@@ -1,20 +1,164 @@
+import bisect
 import re
+import time
 
 from django.conf import settings
-from django.db.models import Case, IntegerField
 from django.db.models import F
-from django.db.models import Q
-from django.db.models import Value
-from django.db.models import When
-from django.db.models.functions import Substr
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 
+from cash_db.redis_utils import get_brand_directory_version, bump_brand_directory_version
+from libs.search import SubstringIndex, normalize
 from libs.utils import local_now
 from models.brands import Brand, BrandCategory, Brandbanner
 from models.reviews import Review
 from models.users import User
 
+# 브랜드 목록 캐시 (프로세스별)
+BRAND_DIRECTORY_TTL = 60
+_brand_directory_cache = {'version': None, 'directory': None, 'expires_at': 0}
+
+# 한글 음절 초성(ㄱ ㄲ ㄴ ㄷ ㄸ ㄹ ㅁ ㅂ ㅃ ㅅ ㅆ ㅇ ㅈ ㅉ ㅊ ㅋ ㅌ ㅍ ㅎ)별 초성 탭
+CHOSEONG_INITIALS = (1, 1, 2, 3, 3, 4, 5, 6, 6, 7, 7, 8, 9, 9, 10, 11, 12, 13, 14)
+# 한글 자모별 초성 탭
+JAMO_INITIALS = {'ㄱ': 1, 'ㄲ': 1, 'ㄴ': 2, 'ㄷ': 3, 'ㄸ': 3, 'ㄹ': 4, 'ㅁ': 5, 'ㅂ': 6, 'ㅅ': 7, 'ㅆ': 7,
+                 'ㅇ': 8, 'ㅈ': 9, 'ㅉ': 9, 'ㅊ': 10, 'ㅋ': 11, 'ㅌ': 12, 'ㅍ': 13, 'ㅎ': 14}
+# 영문, 숫자 탭
+LATIN_INITIAL = 15
+
+
+def get_sort_group(name):
+    """
+    한글 < 영문 < 숫자 순서
+    """
+    first = (name or ' ')[0]
+    if '0' <= first <= '9':
+        return 3
+    elif ord(first) < 128:
+        return 2
+    return 1
+
+
+def get_initials(name):
+    """
+    브랜드명이 속하는 초성 탭 목록
+    """
+    name = name or ''
+    initials = set(JAMO_INITIALS[char] for char in name if char in JAMO_INITIALS)
+
+    first = name[:1]
+    if '가' <= first <= '힣':
+        initials.add(CHOSEONG_INITIALS[(ord(first) - ord('가')) // 588])
+    elif first > '힣':
+        initials.add(14)
+    elif re.match('[a-zA-Z0-9]', first):
+        initials.add(LATIN_INITIAL)
+
+    return initials
+
+
+class BrandDirectory:
+    """
+    전시 중인 브랜드 전체를 정렬해서 보관한다.
+    초성 탭, 브랜드 카테고리별 목록과 브랜드명/초성(phoneme) 검색용 정렬 목록을 미리 만든다.
+    """
+    def __init__(self):
+        brands = list(Brand.objects.filter(is_display=True))
+        category_ids = dict()
+        for brand_id, category_id in Brand.objects.filter(
+                is_display=True, categories__isnull=False
+        ).values_list('id', 'categories__id'):
+            category_ids.setdefault(brand_id, set()).add(category_id)
+
+        self.brands = {brand.id: brand for brand in brands}
+
+        # 이름순, (한글, 영문, 숫자) + 이름순
+        self.by_name = sorted(brands, key=lambda brand: ((brand.name or '').lower(), brand.id))
+        self.by_group = sorted(brands, key=lambda brand: (
+            get_sort_group(brand.name), (brand.name or '').lower(), brand.id))
+        self.name_order = {brand.id: idx for idx, brand in enumerate(self.by_name)}
+        self.group_order = {brand.id: idx for idx, brand in enumerate(self.by_group)}
+
+        self.initials = dict()
+        self.categories = dict()
+        for brand in self.by_group:
+            for initial in get_initials(brand.name):
+                self.initials.setdefault(initial, list()).append(brand)
+            for category_id in category_ids.get(brand.id, ()):
+                self.categories.setdefault(category_id, list()).append(brand)
+
+        # 앞부분 검색 (공백 제거한 브랜드명, 초성)
+        self.prefixes = sorted(
+            [(normalize(brand.name), brand.id) for brand in brands] +
+            [(normalize(brand.phoneme), brand.id) for brand in brands if brand.phoneme]
+        )
+        self.prefix_keys = [key for key, _ in self.prefixes]
+
+        # 부분 검색
+        self.names = SubstringIndex([(brand.id, brand.name) for brand in brands])
+        self.phonemes = SubstringIndex([(brand.id, brand.phoneme) for brand in brands if brand.phoneme])
+
+        self.exact = dict()
+        for brand in brands:
+            for value in (brand.name, brand.phoneme):
+                if value:
+                    self.exact.setdefault(value.strip().lower(), set()).add(brand.id)
+
+    def match_prefix(self, word):
+        word = normalize(word)
+        matched = set()
+        for key, brand_id in self.prefixes[bisect.bisect_left(self.prefix_keys, word):]:
+            if not key.startswith(word):
+                break
+            matched.add(brand_id)
+        return matched
+
+    def match_contains(self, word):
+        word = normalize(word)
+        return self.names.search(word) | self.phonemes.search(word)
+
+    def search(self, query, match, order):
+        """
+        :param match: 단어 검색 (match_prefix, match_contains)
+        :param order: 정렬 순서 (name_order, group_order)
+        :return: 검색된 브랜드 목록 (검색어에 단어가 없으면 None)
+        """
+        word_list = re.findall('([\w.]+)', query)
+        if len(word_list) < 1:
+            return None
+
+        if len(word_list) == 1 and len(word_list[0]) == 1:
+            matched = self.exact.get(word_list[0].lower(), set())
+        else:
+            matched = None
+            for word in word_list:
+                word_matched = match(word)
+                matched = word_matched if matched is None else matched & word_matched
+
+        return [self.brands[brand_id] for brand_id in sorted(matched, key=order.get)]
+
 
 class BrandService:
+    def get_directory(self):
+        """
+        프로세스 안에 BRAND_DIRECTORY_TTL 동안 보관하는 브랜드 목록
+        TTL 이 지나면 redis 의 version 을 확인해서 바뀌었을 때만 다시 만든다.
+        """
+        cache = _brand_directory_cache
+        now = time.time()
+
+        if cache['directory'] is not None and now < cache['expires_at']:
+            return cache['directory']
+
+        version = get_brand_directory_version()
+        if cache['directory'] is None or cache['version'] != version:
+            cache['directory'] = BrandDirectory()
+            cache['version'] = version
+
+        cache['expires_at'] = now + BRAND_DIRECTORY_TTL
+
+        return cache['directory']
+
     def search_brand_list(self, params, only_count=None):
         """
         브랜드 검색 ( EC API )
@@ -25,36 +169,18 @@ class BrandService:
 
         brand_name = params.data.get('name')
 
-        brands = Brand.objects.filter(is_display=True)
+        directory = self.get_directory()
+        brands = directory.by_name
 
         if brand_name:
-            q = Q()
-            word_list = re.findall('([\w.]+)', brand_name)
-            if len(word_list) < 1:
+            brands = directory.search(brand_name, directory.match_prefix, directory.name_order)
+            if brands is None:
                 return []
 
-            elif len(word_list) == 1:
-                if len(word_list[0]) == 1:
-                    q &= (Q(name__iexact=word_list[0]) | Q(phoneme__iexact=word_list[0]))
-                    brands = brands.filter(q)
-                else:
-                    for sch_word in word_list:
-                        brands = brands.extra(
-                            where=["replace(brandTitle, ' ', '') LIKE %s OR brandTitleInitial LIKE %s "],
-                            params=[sch_word + '%', sch_word + '%'])
-            else:
-                for sch_word in word_list:
-                    brands = brands.extra(
-                        where=["replace(brandTitle, ' ', '') LIKE %s OR brandTitleInitial LIKE %s "],
-                        params=[sch_word + '%', sch_word + '%'])
-
         if only_count:
-            return brands.count()
+            return len(brands)
 
-        brands = brands.order_by('name').distinct()
-        brands = brands[offset: offset + limit + 1]
-
-        return brands
+        return brands[offset: offset + limit + 1]
 
     def get_brands(self, **kwargs):
         """
@@ -67,56 +193,15 @@ class BrandService:
 
         query = kwargs.get('query')
 
-        brands = Brand.objects.filter(is_display=True)
+        directory = self.get_directory()
+        brands = directory.by_name
 
         if query:
-            q = Q()
-            word_list = re.findall('([\w.]+)', query)
-            if len(word_list) < 1:
+            brands = directory.search(query, directory.match_contains, directory.group_order)
+            if brands is None:
                 return []
 
-            elif len(word_list) == 1:
-                if len(word_list[0]) == 1:
-                    q &= (Q(name__iexact=word_list[0]) | Q(phoneme__iexact=word_list[0]))
-                    brands = brands.filter(q)
-                else:
-                    for sch_word in word_list:
-                        brands = brands.extra(
-                            where=[
-                                "replace(brandTitle, ' ', '') LIKE %s "
-                                "OR brandTitleInitial LIKE %s "
-                            ],
-                            params=[
-                                '%' + sch_word + '%',
-                                '%' + sch_word + '%'
-                            ])
-            else:
-                for sch_word in word_list:
-                    brands = brands.extra(
-                        where=[
-                            "replace(brandTitle, ' ', '') LIKE %s "
-                            "OR brandTitleInitial LIKE %s "
-                        ],
-                        params=[
-                            '%' + sch_word + '%',
-                            '%' + sch_word + '%'
-                        ])
-
-            brands = brands.extra(select={
-                'sort_key': 'CASE '
-                            'WHEN ASCII(SUBSTRING(brandTitle,1)) BETWEEN 48 AND 57 THEN 3 '
-                            'WHEN ASCII(SUBSTRING(brandTitle,1)) < 128 THEN 2 '
-                            'ELSE 1 '
-                            'END'
-            })
-
-            brands = brands.order_by(
-                'sort_key', 'name'
-            ).distinct()
-
-        brands = brands[offset: offset + limit]
-
-        return brands
+        return brands[offset: offset + limit]
 
     def get_all_brands(self, **kwargs):
         """
@@ -128,50 +213,24 @@ class BrandService:
         brand_category_id = kwargs.get('brand_category_id')
         initial = kwargs.get('initial')
 
-        brands = Brand.objects.filter(is_display=True)
+        directory = self.get_directory()
+        brands = directory.by_group
 
         if initial:
-            sch_filter = [
-                None,
-                Q(name__regex=r'(ㄱ|ㄲ)') | Q(name__gte='가', name__lt='나'),
-                Q(name__regex=r'ㄴ') | Q(name__gte='나', name__lt='다'),
-                Q(name__regex=r'(ㄷ|ㄸ)') | Q(name__gte='다', name__lt='라'),
-                Q(name__regex=r'ㄹ') | Q(name__gte='라', name__lt='마'),
-                Q(name__regex=r'ㅁ') | Q(name__gte='마', name__lt='바'),
-                Q(name__regex=r'ㅂ') | Q(name__gte='바', name__lt='사'),
-                Q(name__regex=r'(ㅅ|ㅆ)') | Q(name__gte='사', name__lt='아'),
-                Q(name__regex=r'ㅇ') | Q(name__gte='아', name__lt='자'),
-                Q(name__regex=r'(ㅈ|ㅉ)') | Q(name__gte='자', name__lt='차'),
-                Q(name__regex=r'ㅊ') | Q(name__gte='차', name__lt='카'),
-                Q(name__regex=r'ㅋ') | Q(name__gte='카', name__lt='타'),
-                Q(name__regex=r'ㅌ') | Q(name__gte='타', name__lt='파'),
-                Q(name__regex=r'ㅍ') | Q(name__gte='파', name__lt='하'),
-                Q(name__regex=r'ㅎ') | Q(name__gte='하'),
-                Q(name__regex=r'^[a-zA-Z]') | Q(name__regex=r'^[0-9]')
-            ]
-            brands = brands.filter(sch_filter[initial])
+            brands = directory.initials.get(initial, [])
 
         if brand_category_id:
-            brands = brands.filter(categories__id=brand_category_id)
-
-        brands = brands.annotate(
-            init=Substr('name', 1),
-        )
-        brands = brands.annotate(
-            custom_order=Case(
-                When(Q(init__gte=chr(48)) & Q(init__lt=chr(57)), then=Value(3)),
-                When(Q(init__lt=chr(128)), then=Value(2)),
-                default=Value(1),
-                output_field=IntegerField(),
-            )
-        )
-
-        brands = brands.order_by('custom_order', 'name').distinct()
+            category_brands = directory.categories.get(brand_category_id, [])
+            if initial:
+                category_brand_ids = set(brand.id for brand in category_brands)
+                brands = [brand for brand in brands if brand.id in category_brand_ids]
+            else:
+                brands = category_brands
 
         if not initial:
             cursor = int(cursor or 1)
             offset = (cursor - 1) * limit
-            brands = brands.all()[offset: offset + limit + 1]
+            brands = brands[offset: offset + limit + 1]
 
         if not brands:
             return {
@@ -179,12 +238,6 @@ class BrandService:
                 'next_offset': None,
             }
 
-        if not len(brands):
-            return {
-                'list': [],
-                'next_offset': None,
-            }
-
         if len(brands) == limit + 1 and not initial:
             results = list(brands)
             next_offset = cursor + 1
@@ -381,3 +434,15 @@ class BrandService:
 
 
 service = BrandService()
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+def invalidate_brand_directory(sender, **kwargs):
+    bump_brand_directory_version()
+
+
+@receiver(m2m_changed, sender=Brand.categories.through)
+def invalidate_brand_directory_categories(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_brand_directory_version()
@@ -1,6 +1,7 @@
 import json
 import random
 import re
+import time
 
 from django.conf import settings
 from django.db.models import Case
@@ -8,18 +9,195 @@ from django.db.models import F
 from django.db.models import Value
 from django.db.models import When
 from django.db.models.functions import Concat
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 
+from cash_db.redis_utils import get_category_tree_version, bump_category_tree_version
 from db.raw_queries import get_monthly_products_by_main_category
 from libs.aws.dynamodb import aws_dynamodb_etc_items
-from libs.utils import get_image_ratio, request_ads
+from libs.utils import local_now, request_ads
 from models.keywords import Keyword
-from models.products import SubCategory, MainCategory
+from models.products import Product, SubCategory, MainCategory
 from models.reviews import Review
 from models.users import User
 from resources.preprocess_category import get_category_id
+from services.images import service as image_service
+
+# 카테고리 트리 캐시 (프로세스별)
+CATEGORY_TREE_TTL = 60
+# 브랜드/스토어별 카테고리는 제품 변경으로도 바뀌므로 version 과 상관없이 다시 만드는 간격 (초)
+CATEGORY_TREE_MAX_AGE = 60 * 10
+_category_tree_cache = {'version': None, 'tree': None, 'expires_at': 0}
+# 대분류별 이달의 신제품 후보 캐시 (프로세스별, 날짜가 바뀌면 다시 조회)
+MONTHLY_PRODUCTS_TTL = 60 * 5
+_monthly_products_cache = {'day': None, 'products': None, 'expires_at': 0}
+
+
+def group_categories(rows, filter_format=True):
+    """
+    (대분류, 소분류) 행을 대분류별로 묶어서 응답 형태로 가공함
+    """
+    categories = list()
+    if filter_format:
+        categories.append({
+            'id': 0,
+            'name': '대분류 전체',
+            'image': None,
+            'is_new': False,
+            'sub_categories': [
+                {'id': 0, 'name': '소분류 전체', 'seq': 0}
+            ]
+        })
+
+    mains = dict()
+    for row in rows:
+        main = mains.get(row['main_category_id'])
+        if main is None:
+            main = dict()
+            main['id'] = row['main_category_id']
+            main['name'] = row['main_category_name']
+            if not filter_format:
+                main['is_new'] = row['main_category_is_new']
+                main['image'] = row['main_category_image']
+
+            main['sub_categories'] = list()
+            if filter_format:
+                main['sub_categories'].append({
+                    'id': 0,
+                    'name': '소분류 전체',
+                    'is_new': False,
+                    'seq': 0
+                })
+
+            mains[main['id']] = main
+            categories.append(main)
+
+        new_sub = dict()
+        new_sub['id'] = row['sub_category_id']
+        new_sub['name'] = row['sub_category_name']
+        new_sub['seq'] = row['seq']
+        if not filter_format:
+            new_sub['is_new'] = row['is_new']
+
+        main['sub_categories'].append(new_sub)
+
+    return categories
+
+
+class CategoryTree:
+    """
+    전시 중인 전체 제품 카테고리와 브랜드/스토어별 대분류 목록
+    요청마다 다시 조회하지 않도록 미리 만들어 둔 목록을 그대로 돌려준다.
+    """
+
+    def __init__(self):
+        self.built_at = time.time()
+
+        rows = list(SubCategory.objects.filter(
+            is_display=True,
+            main_category__is_display=True
+        ).annotate(
+            sub_category_id=F('id'),
+            sub_category_name=F('name'),
+            main_category_id=F('main_category'),
+            main_category_name=F('main_category__name'),
+            main_category_is_new=F('main_category__is_new'),
+            main_category_image=Case(
+                When(main_category__file_name=None, then=None),
+                default=Concat(Value(settings.CDN), 'main_category__file_dir', Value('/'), 'main_category__file_name')
+            )
+        ).order_by(
+            'main_category__seq', 'seq', 'id'
+        ).values(
+            'sub_category_id', 'sub_category_name', 'is_new', 'seq',
+            'main_category_id', 'main_category_name',
+            'main_category_is_new', 'main_category_image'
+        ))
+
+        self.categories = group_categories(rows, filter_format=False)
+        self.filter_categories = group_categories(rows, filter_format=True)
+
+        # 랭킹 필터 (브랜드/스토어) 형태
+        self.rank_categories = [(category['id'], {
+            'id': category['id'],
+            'name': category['name'],
+            'sub_categories': [{'id': 0, 'name': "소분류 전체"}] + [
+                {'id': sub['id'], 'name': sub['name']} for sub in category['sub_categories']
+            ]
+        }) for category in self.categories]
+
+        self.brand_main_ids = dict()
+        for brand_id, main_category_id in Product.objects.filter(
+                categories__is_display=True
+        ).values_list('brand_id', 'categories__main_category').distinct():
+            self.brand_main_ids.setdefault(brand_id, set()).add(main_category_id)
+
+        self.store_main_ids = dict()
+        for store_id, main_category_id in Product.objects.filter(
+                categories__is_display=True,
+                storesproducts__store__isnull=False
+        ).values_list('storesproducts__store', 'categories__main_category').distinct():
+            self.store_main_ids.setdefault(store_id, set()).add(main_category_id)
+
+    def get_rank_categories(self, main_ids):
+        results = [
+            {
+                'id': 0,
+                'name': "대분류 전체",
+                'sub_categories': [
+                    {
+                        'id': 0,
+                        'name': "소분류 전체"
+                    }
+                ]
+            }
+        ]
+        results.extend(item for main_id, item in self.rank_categories if main_id in main_ids)
+        return results
 
 
 class CategoryService:
+    def get_tree(self):
+        """
+        프로세스 안의 카테고리 트리
+        CATEGORY_TREE_TTL 마다 version 을 확인해서 카테고리가 바뀌었거나 오래되었으면 다시 만든다.
+        """
+        cache = _category_tree_cache
+        now = time.time()
+
+        if cache['tree'] is not None and now < cache['expires_at']:
+            return cache['tree']
+
+        version = get_category_tree_version()
+        if cache['tree'] is None or cache['version'] != version or \
+                now > cache['tree'].built_at + CATEGORY_TREE_MAX_AGE:
+            cache['tree'] = CategoryTree()
+            cache['version'] = version
+
+        cache['expires_at'] = now + CATEGORY_TREE_TTL
+
+        return cache['tree']
+
+    def get_monthly_products(self, category_ids):
+        """
+        대분류별 이달의 신제품 후보
+        :return: { main_category_id: [후보, ...] }
+        """
+        cache = _monthly_products_cache
+        now = time.time()
+        day = local_now().strftime('%Y%m%d')
+
+        products = cache['products']
+        if products is None or cache['day'] != day or now > cache['expires_at'] or \
+                any(category_id not in products for category_id in category_ids):
+            products = {category_id: list(get_monthly_products_by_main_category(category_id))
+                        for category_id in category_ids}
+            cache['products'] = products
+            cache['day'] = day
+            cache['expires_at'] = now + MONTHLY_PRODUCTS_TTL
+
+        return products
+
     def get_product_categories(self, **kwargs):
         """
         제품 카테고리 리스트 ( 제품 검색 )
@@ -62,83 +240,67 @@ class CategoryService:
         """
         전제 제품 카테고리 리스트 ( 추전 제품 및 이달의 신제품 포함 )
         """
-        categories = SubCategory.objects.filter(
-            is_display=True,
-            main_category__is_display=True
-        )
-
-        categories = categories.annotate(
-            sub_category_id=F('id'),
-            sub_category_name=F('name'),
-            main_category_id=F('main_category'),
-            main_category_name=F('main_category__name'),
-            main_category_is_new=F('main_category__is_new'),
-            main_category_image=Case(
-                When(main_category__file_name=None, then=None),
-                default=Concat(Value(settings.CDN), 'main_category__file_dir', Value('/'), 'main_category__file_name')
-            )
-        )
-
-        categories = categories.order_by('main_category__seq')
-
-        results = self._make_categories_response(categories.values(
-            'sub_category_id', 'sub_category_name', 'is_new', 'seq',
-            'main_category_id', 'main_category_name',
-            'main_category_is_new', 'main_category_image'
-        ), filter_format=filter_format)
+        tree = self.get_tree()
+        if filter_format:
+            return list(tree.filter_categories)
+
+        # monthly 를 붙이므로 대분류만 복사한다.
+        results = [dict(category) for category in tree.categories]
+
+        # monthly
+        monthly_products = self.get_monthly_products([category['id'] for category in results])
+        banners = list()
+        for idx, category in enumerate(results):
+            products = monthly_products.get(category['id'])
+            if products:
+                recommended_item = dict()
+                choice = random.choice(products)
+                if choice.get('banner_image'):
+                    recommended_item['id'] = choice.get('id')
+                    recommended_item['banner_image'] = choice.get('banner_image')
+                    recommended_item['banner_image_720'] = choice.get('banner_image_720')
+                    recommended_item['link_type'] = choice.get('link_type')
+                    recommended_item['link_code'] = choice.get('link_code')
+
+                    # 통합검색 인트로는 광고소재C가 있으면 링크 설정과 관계없이 광고링크로 연결됩니다.
+                    recommended_item['is_custom'] = True
+                    recommended_item['end_date'] = choice.get('end_date')
+                    results[idx]['monthly'] = {
+                        'type': 'banner',
+                        'monthly_banner': recommended_item
+                    }
+                    banners.append(recommended_item)
+                else:
+                    recommended_item['id'] = choice.get('id')
+                    recommended_item['product_id'] = choice.get('product_id')
+                    recommended_item['name'] = choice.get('product_name')
+                    recommended_item['product_image'] = choice.get('product_image')
+                    recommended_item['product_image_720'] = choice.get('product_image_720')
+
+                    recommended_item['brand'] = dict()
+                    recommended_item['brand']['brand_id'] = choice.get('brand_id')
+                    recommended_item['brand']['name'] = choice.get('brand_name')
+
+                    recommended_item['price'] = choice.get('price')
+                    recommended_item['rating_avg'] = choice.get('rating_avg')
+                    recommended_item['review_count'] = choice.get('review_count')
+                    recommended_item['volume'] = choice.get('volume')
+                    recommended_item['is_discontinue'] = choice.get('is_discontinue')
+
+                    recommended_item['link_type'] = choice.get('link_type')
+                    recommended_item['link_code'] = choice.get('link_code')
+                    recommended_item['is_custom'] = False
+                    recommended_item['banner_ratio'] = 0.249
+                    recommended_item['end_date'] = choice.get('end_date')
+                    results[idx]['monthly'] = {
+                        'type': 'product',
+                        'monthly_product': recommended_item
+                    }
 
-        if not filter_format:
-            # monthly
-            for idx, category in enumerate(results):
-                category['sub_categories'].sort(key=lambda x: x['seq'])
-
-                products = get_monthly_products_by_main_category(category.get('id'))
-                if len(products) > 0:
-                    recommended_item = dict()
-                    choice = random.choice(products)
-                    if choice.get('banner_image'):
-                        recommended_item['id'] = choice.get('id')
-                        recommended_item['banner_image'] = choice.get('banner_image')
-                        recommended_item['banner_image_720'] = choice.get('banner_image_720')
-                        recommended_item['link_type'] = choice.get('link_type')
-                        recommended_item['link_code'] = choice.get('link_code')
-
-                        # 통합검색 인트로는 광고소재C가 있으면 링크 설정과 관계없이 광고링크로 연결됩니다.
-                        recommended_item['is_custom'] = True
-                        recommended_item['banner_ratio'] = get_image_ratio(
-                            recommended_item['banner_image_720'], is_url=True
-                        )
-                        recommended_item['end_date'] = choice.get('end_date')
-                        results[idx]['monthly'] = {
-                            'type': 'banner',
-                            'monthly_banner': recommended_item
-                        }
-                    else:
-                        recommended_item['id'] = choice.get('id')
-                        recommended_item['product_id'] = choice.get('product_id')
-                        recommended_item['name'] = choice.get('product_name')
-                        recommended_item['product_image'] = choice.get('product_image')
-                        recommended_item['product_image_720'] = choice.get('product_image_720')
-
-                        recommended_item['brand'] = dict()
-                        recommended_item['brand']['brand_id'] = choice.get('brand_id')
-                        recommended_item['brand']['name'] = choice.get('brand_name')
-
-                        recommended_item['price'] = choice.get('price')
-                        recommended_item['rating_avg'] = choice.get('rating_avg')
-                        recommended_item['review_count'] = choice.get('review_count')
-                        recommended_item['volume'] = choice.get('volume')
-                        recommended_item['is_discontinue'] = choice.get('is_discontinue')
-
-                        recommended_item['link_type'] = choice.get('link_type')
-                        recommended_item['link_code'] = choice.get('link_code')
-                        recommended_item['is_custom'] = False
-                        recommended_item['banner_ratio'] = 0.249
-                        recommended_item['end_date'] = choice.get('end_date')
-                        results[idx]['monthly'] = {
-                            'type': 'product',
-                            'monthly_product': recommended_item
-                        }
+        # 배너 이미지 비율은 한번에 조회한다.
+        ratios = image_service.get_ratios(banner['banner_image_720'] for banner in banners)
+        for banner in banners:
+            banner['banner_ratio'] = ratios.get(banner['banner_image_720'])
 
         return results
 
@@ -215,62 +377,7 @@ class CategoryService:
         """
         제품 카테고리 리스트를 응답 형태로 가공함
         """
-        categories = list()
-        if filter_format:
-            categories.append({
-                'id': 0,
-                'name': '대분류 전체',
-                'image': None,
-                'is_new': False,
-                'sub_categories': [
-                    {'id': 0, 'name': '소분류 전체', 'seq': 0}
-                ]
-            })
-
-        for row in query_set.iterator():
-            b_main = True
-
-            for category in categories:
-                if row['main_category_id'] == category['id']:
-                    new_sub = dict()
-                    new_sub['id'] = row['sub_category_id']
-                    new_sub['name'] = row['sub_category_name']
-                    new_sub['seq'] = row['seq']
-                    if not filter_format:
-                        new_sub['is_new'] = row['is_new']
-
-                    category['sub_categories'].append(new_sub)
-                    b_main = False
-                    break
-
-            if b_main:
-                new_main = dict()
-                new_main['id'] = row['main_category_id']
-                new_main['name'] = row['main_category_name']
-                if not filter_format:
-                    new_main['is_new'] = row['main_category_is_new']
-                    new_main['image'] = row['main_category_image']
-
-                new_main['sub_categories'] = list()
-                if filter_format:
-                    new_main['sub_categories'].append({
-                        'id': 0,
-                        'name': '소분류 전체',
-                        'is_new': False,
-                        'seq': 0
-                    })
-
-                new_sub = dict()
-                new_sub['id'] = row['sub_category_id']
-                new_sub['name'] = row['sub_category_name']
-                new_sub['seq'] = row['seq']
-                if not filter_format:
-                    new_sub['is_new'] = row['is_new']
-
-                new_main['sub_categories'].append(new_sub)
-                categories.append(new_main)
-
-        return categories
+        return group_categories(query_set.iterator(), filter_format=filter_format)
 
     def get_user_reviews_categories(self, user_id):
         """
@@ -351,89 +458,29 @@ class CategoryService:
         """
         특정 브랜드가 포함된 제품 카테고리 리스트
         """
-        query_set = MainCategory.objects.filter(
-            is_display=True,
-            subcategory__is_display=True,
-            subcategory__product__brand=brand_id
-        ).prefetch_related(
-            'subcategory_set'
-        ).distinct()
-
-        results = [
-            {
-                'id': 0,
-                'name': "대분류 전체",
-                'sub_categories': [
-                    {
-                        'id': 0,
-                        'name': "소분류 전체"
-                    }
-                ]
-            }
-        ]
-        for main in query_set:
-            item = dict()
-            item['id'] = main.id
-            item['name'] = main.name
-            item['sub_categories'] = [
-                {
-                    'id': 0,
-                    'name': "소분류 전체"
-                }
-            ]
-            for sub in main.subcategory_set.filter(is_display=True).all():
-                sub_item = dict()
-                sub_item['id'] = sub.id
-                sub_item['name'] = sub.name
-                item['sub_categories'].append(sub_item)
-
-            results.append(item)
-
-        return results
+        tree = self.get_tree()
+        return tree.get_rank_categories(tree.brand_main_ids.get(int(brand_id), ()))
 
     def get_categories_by_store_id(self, store_id):
         """
         특정 스토어와 연관된 제품 카테고리 리스트
         """
-        query_set = MainCategory.objects.filter(
-            is_display=True,
-            subcategory__is_display=True,
-            subcategory__product__storesproducts__store=store_id
-        ).prefetch_related(
-            'subcategory_set'
-        ).distinct()
+        tree = self.get_tree()
+        return tree.get_rank_categories(tree.store_main_ids.get(int(store_id), ()))
 
-        results = [
-            {
-                'id': 0,
-                'name': "대분류 전체",
-                'sub_categories': [
-                    {
-                        'id': 0,
-                        'name': "소분류 전체"
-                    }
-                ]
-            }
-        ]
-        for main in query_set:
-            item = dict()
-            item['id'] = main.id
-            item['name'] = main.name
-            item['sub_categories'] = [
-                {
-                    'id': 0,
-                    'name': "소분류 전체"
-                }
-            ]
-            for sub in main.subcategory_set.filter(is_display=True).all():
-                sub_item = dict()
-                sub_item['id'] = sub.id
-                sub_item['name'] = sub.name
-                item['sub_categories'].append(sub_item)
 
-            results.append(item)
+service = CategoryService()
 
-        return results
 
+@receiver(post_save, sender=MainCategory)
+@receiver(post_delete, sender=MainCategory)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+def category_tree_changed(sender, instance, **kwargs):
+    bump_category_tree_version()
 
-service = CategoryService()
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def category_tree_products_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_category_tree_version()
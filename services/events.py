@@ -7,8 +7,9 @@ from django.db.models import Value
 
 from db.raw_queries import get_end_events
 from libs.aws.dynamodb import aws_dynamodb_etc_list, aws_dynamodb_events
-from libs.utils import iso8601, get_image_ratio
+from libs.utils import iso8601
 from models.events import Event
+from services.images import service as image_service
 
 
 class EventService:
@@ -43,8 +44,10 @@ class EventService:
         results = events.all()[offset: offset + limit + 1]
 
         if term == 'ongoing':
+            results = list(results)
+            ratios = image_service.get_ratios([ev.event_image for ev in results])
             for ev in results:
-                setattr(ev, 'ratio', get_image_ratio(path=ev.event_image, is_url=True))
+                setattr(ev, 'ratio', ratios.get(ev.event_image))
         elif term == 'end':
             results = get_end_events(**kwargs)
             # results = results.annotate(
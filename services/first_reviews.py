@@ -0,0 +1,115 @@
+"""
+제품별 첫 리뷰 작성자 관리 로직 정의
+제품의 리뷰를 작성 시각 순 후보 목록(redis zset)으로 관리하고 첫 리뷰 작성자는 redis 에서 원자적으로 정한다.
+첫 리뷰 기록(Review_first_log)은 redis 에서 정해진 결과를 따라 저장한다.
+처음 적용하거나 redis 데이터가 유실되면 backfill 로 전체 제품의 후보 목록을 다시 만든다.
+"""
+from django.db import IntegrityError, transaction
+
+from cash_db.redis_utils import add_first_review, remove_first_review, set_first_reviews, set_first_review_owner
+from models.reviews import Review, Review_first_log
+
+
+class FirstReviewService:
+    def _restore_owner(self, product_id):
+        """
+        redis 의 첫 리뷰 작성자를 첫 리뷰 기록(Review_first_log)의 작성자로 되돌린다.
+        """
+        log = Review_first_log.objects.filter(id=product_id).first()
+        owner = None
+        if log is not None:
+            owner = Review.objects.filter(
+                product_id=product_id, user_id=log.user_id
+            ).order_by(
+                '_created_at', 'id'
+            ).values_list(
+                'id', 'user_id', '_created_at'
+            ).first()
+
+        set_first_review_owner(product_id, owner)
+
+    def review_created(self, review):
+        """
+        리뷰 작성 후 (트랜잭션 커밋 후) 호출
+        :return: 첫 리뷰인지
+        """
+        is_first = add_first_review(review.product_id, review.id, review.user_id, review._created_at)
+        if not is_first:
+            return False
+
+        try:
+            Review_first_log(id=review.product_id, user_id=review.user_id,
+                             timestamp=review._created_at).save(force_insert=True)
+        except IntegrityError:
+            # 이미 첫 리뷰 기록이 있으면 (backfill 전 제품) 첫 리뷰가 아니다.
+            self._restore_owner(review.product_id)
+            return False
+
+        return True
+
+    def review_deleted(self, product_id, review_id, user_id):
+        """
+        리뷰 삭제 후 (트랜잭션 커밋 후) 호출
+        첫 리뷰였다면 다음으로 먼저 쓴 리뷰 작성자에게 첫 리뷰를 넘긴다.
+        :return: (첫 리뷰였는지, 다음 첫 리뷰 (review id, user id, 작성 시각) 또는 None)
+        """
+        is_first, next_first = remove_first_review(product_id, review_id, user_id)
+        if not is_first:
+            return False, None
+
+        with transaction.atomic():
+            deleted, _ = Review_first_log.objects.filter(id=product_id, user_id=user_id).delete()
+
+            if deleted and next_first:
+                _, next_user_id, next_created_at = next_first
+                Review_first_log(id=product_id, user_id=next_user_id,
+                                 timestamp=next_created_at).save(force_insert=True)
+
+        if not deleted:
+            # 첫 리뷰 기록과 redis 가 달랐다면 첫 리뷰가 아니었으므로 기록을 따른다.
+            self._restore_owner(product_id)
+            return False, None
+
+        return True, next_first
+
+    def backfill(self, batch_size=1000):
+        """
+        모든 제품의 첫 리뷰 후보와 첫 리뷰 작성자를 MySQL 리뷰로 다시 만든다.
+        첫 리뷰 기록(Review_first_log)도 가장 먼저 쓴 리뷰 작성자로 맞춘다.
+        :return: 처리한 제품 수
+        """
+        product_ids = list(Review.objects.order_by().values_list('product_id', flat=True).distinct())
+
+        for idx in range(0, len(product_ids), batch_size):
+            batch_ids = product_ids[idx:idx + batch_size]
+
+            candidates = {product_id: list() for product_id in batch_ids}
+            rows = Review.objects.filter(
+                product_id__in=batch_ids
+            ).order_by(
+                'product_id', '_created_at', 'id'
+            ).values_list(
+                'product_id', 'id', 'user_id', '_created_at'
+            )
+            for product_id, review_id, user_id, created_at in rows.iterator():
+                candidates[product_id].append((review_id, user_id, created_at))
+
+            owners = {product_id: rows[0] for product_id, rows in candidates.items() if rows}
+            logs = {log.id: log for log in Review_first_log.objects.filter(id__in=batch_ids)}
+
+            with transaction.atomic():
+                for product_id, (_, user_id, created_at) in owners.items():
+                    log = logs.get(product_id)
+                    if log is None:
+                        Review_first_log(id=product_id, user_id=user_id, timestamp=created_at).save(force_insert=True)
+                    elif log.user_id != user_id:
+                        log.user_id = user_id
+                        log.timestamp = created_at
+                        log.save()
+
+            set_first_reviews(candidates)
+
+        return len(product_ids)
+
+
+service = FirstReviewService()
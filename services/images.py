@@ -0,0 +1,50 @@
+"""
+이미지 크기 비율 로직 정의
+요청 중에는 원격 이미지를 읽지 않고 미리 계산해 둔 값만 사용한다.
+계산되지 않은 이미지는 백그라운드에서 계산하도록 요청한다.
+"""
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from cash_db.redis_utils import get_images_meta
+from models.events import Event
+from tasks.images import request_image_meta
+
+
+class ImageService:
+    def get_ratios(self, urls):
+        """
+        :return: { url: ratio } (계산되지 않은 이미지는 None)
+        """
+        urls = list(set(url for url in urls if url))
+        metas = get_images_meta(urls)
+
+        ratios = dict()
+        for url in urls:
+            meta = metas.get(url)
+            if meta:
+                ratios[url] = meta.get('ratio')
+            else:
+                ratios[url] = None
+                request_image_meta(url)
+
+        return ratios
+
+    def get_ratio(self, url):
+        if not url:
+            return None
+        return self.get_ratios([url]).get(url)
+
+    def precompute(self, urls):
+        """
+        계산되지 않은 이미지의 비율을 미리 계산하도록 요청한다.
+        """
+        self.get_ratios(urls)
+
+
+service = ImageService()
+
+
+@receiver(post_save, sender=Event)
+def precompute_event_image_ratio(sender, instance, **kwargs):
+    service.precompute([instance.event_image])
@@ -0,0 +1,116 @@
+"""
+제품 카드 캐시 로직 정의
+제품 리스트에서 공통으로 쓰는 제품 정보(제품명, 이미지, 브랜드, 평점, 리뷰 수, 구매 정보)를
+redis 에 제품별로 저장해두고 리스트는 제품 아이디만 조회한 후 한번에(MGET) 채운다.
+제품, 브랜드, 구매 정보가 바뀌면 해당 제품 카드를 지운다.
+"""
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from cash_db.redis_utils import get_product_cards, set_product_cards, delete_product_cards
+from models.brands import Brand
+from models.product_goods import ProductGoods
+from models.products import Product
+
+CARD_EXPIRE = 60 * 60
+# 카드를 지운 후 다시 저장하지 않는 시간 (초)
+# 지우기 전에 오래된 제품 정보를 읽은 요청이 지운 후에 저장하는 것을 막는다.
+CARD_INVALIDATED_EXPIRE = 30
+
+
+class ProductCardService:
+    def make_card(self, product):
+        brand = product.brand
+
+        try:
+            goods = product.productgoods
+        except ObjectDoesNotExist:
+            goods = None
+
+        return {
+            'id': product.id,
+            'name': product.name,
+            'product_image_160': product.product_image_160,
+            'volume': product.volume,
+            'price': int(product.price) if product.price is not None else None,
+            'is_discontinue': bool(product.is_discontinue),
+            'rating_avg': product.rating_avg,
+            'review_count': product.review_count,
+            'brand': {
+                'id': brand.id,
+                'name': brand.name,
+                'brand_image_160': brand.brand_image_160,
+            },
+            'productgoods': {
+                'goods_count': goods.goods_count,
+                'min_price': goods.min_price,
+                'max_price': goods.max_price,
+            } if goods and goods.goods_count else None,
+        }
+
+    def get_cards(self, product_ids):
+        """
+        :return: { product_id: 제품 카드 } (없는 제품은 제외)
+        """
+        product_ids = list(set(int(product_id) for product_id in product_ids))
+        cards = {product_id: card for product_id, card in get_product_cards(product_ids).items() if card}
+
+        missing_ids = [product_id for product_id in product_ids if product_id not in cards]
+        if missing_ids:
+            products = Product.objects.filter(
+                id__in=missing_ids
+            ).select_related(
+                'brand', 'productgoods'
+            )
+            loaded = {product.id: self.make_card(product) for product in products}
+            set_product_cards(loaded, CARD_EXPIRE)
+            cards.update(loaded)
+
+        return cards
+
+    def get_list(self, product_ids):
+        """
+        제품 아이디 순서대로 제품 카드 목록
+        """
+        product_ids = list(product_ids)
+        cards = self.get_cards(product_ids)
+        return [cards[product_id] for product_id in product_ids if product_id in cards]
+
+    def hydrate(self, rows, key='id'):
+        """
+        조회 결과(dict)의 제품 정보를 제품 카드로 채운다. 순위 등 나머지 값은 그대로 둔다.
+        """
+        cards = self.get_cards(row[key] for row in rows)
+
+        results = list()
+        for row in rows:
+            card = cards.get(int(row[key]))
+            if card:
+                results.append(dict(row, **card))
+        return results
+
+    def invalidate(self, product_ids):
+        product_ids = list(product_ids)
+        transaction.on_commit(lambda: delete_product_cards(product_ids, CARD_INVALIDATED_EXPIRE))
+
+
+service = ProductCardService()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_card(sender, instance, **kwargs):
+    service.invalidate([instance.id])
+
+
+@receiver(post_save, sender=ProductGoods)
+@receiver(post_delete, sender=ProductGoods)
+def invalidate_product_goods_card(sender, instance, **kwargs):
+    service.invalidate([instance.product_id])
+
+
+@receiver(post_save, sender=Brand)
+def invalidate_brand_product_cards(sender, instance, **kwargs):
+    service.invalidate(Product.objects.filter(brand_id=instance.id).values_list('id', flat=True))
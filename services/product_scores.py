@@ -0,0 +1,385 @@
+"""
+제품 점수 계산 로직 정의
+제품별 평점 구간(rating1 ~ rating5_4) 리뷰 수를 redis 카운터로 유지하고
+리뷰 작성/수정/삭제 시 증감값만 반영하여 점수를 계산한다.
+카운터는 주기적으로 전체 집계(reconcile)와 맞춘다.
+같은 카운터에 블라인드 리뷰 수(blinded)도 함께 두고 제품 상세 리뷰 통계로 사용한다.
+관리자 블라인드/해제(리뷰 상태, 블라인드 사유, 회원 블라인드)는 카운터를 지우고 다음 조회 때 다시 만든다.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.db.models import Case, Count, IntegerField, Sum
+from django.db.models import Q
+from django.db.models import When
+
+from cash_db.redis_utils import incr_product_rating_counters, get_product_rating_counters, \
+    get_products_rating_counters, set_products_rating_counters, delete_products_rating_counters, \
+    scan_product_rating_ids
+from models.blinded_reviews import BlindedReview
+from models.reviews import Review
+from models.users import User
+
+BUCKETS = (
+    'rating1', 'rating2', 'rating3',
+    'rating4_1', 'rating4_2', 'rating4_3', 'rating4_4',
+    'rating5_1', 'rating5_2', 'rating5_3', 'rating5_4',
+)
+
+BLINDED = 'blinded'
+COUNTERS = BUCKETS + (BLINDED,)
+
+
+def get_user_level(review_count):
+    """
+    작성자의 리뷰 수에 따른 구간 (1 ~ 4)
+    """
+    if review_count <= 1:
+        return 1
+    elif review_count <= 10:
+        return 2
+    elif review_count < 30:
+        return 3
+    return 4
+
+
+def get_bucket(rating, review_count):
+    if rating <= 3:
+        return 'rating{}'.format(rating)
+    return 'rating{}_{}'.format(rating, get_user_level(review_count))
+
+
+def bucket_annotations():
+    """
+    평점 구간별 리뷰 수 집계용 annotation
+    """
+    annotations = {
+        'rating1': Case(When(rating=1, then=1), output_field=IntegerField(), default=0),
+        'rating2': Case(When(rating=2, then=1), output_field=IntegerField(), default=0),
+        'rating3': Case(When(rating=3, then=1), output_field=IntegerField(), default=0),
+    }
+
+    levels = {
+        1: Q(user__review_count__lte=1),
+        2: Q(user__review_count__gt=1, user__review_count__lte=10),
+        3: Q(user__review_count__gt=10, user__review_count__lt=30),
+        4: Q(user__review_count__gte=30),
+    }
+    for rating in (4, 5):
+        for level, q in levels.items():
+            annotations['rating{}_{}'.format(rating, level)] = Case(
+                When(Q(rating=rating) & q, then=1),
+                output_field=IntegerField(),
+                default=0
+            )
+
+    return annotations
+
+
+class ProductScoreService:
+    def get_counted_reviews(self):
+        """
+        점수 계산에 포함되는 리뷰
+        """
+        return Review.objects.filter(is_display=True, state='N', user__is_blinded=0)
+
+    def get_blinded_reviews(self):
+        """
+        블라인드 리뷰 (리뷰 또는 작성자가 블라인드 처리된 리뷰)
+        """
+        return Review.objects.filter(is_display=True).filter(Q(user__is_blinded__gt=0) | ~Q(state='N'))
+
+    def is_counted(self, review, user, state=None):
+        state = state if state is not None else review.state
+        return bool(review.is_display) and state == 'N' and not user.is_blinded
+
+    def is_blinded(self, review, user, state=None):
+        return bool(review.is_display) and not self.is_counted(review, user, state)
+
+    def calculate(self, counters):
+        """
+        평점 구간별 리뷰 수로 제품 점수, 평균 평점, 리뷰 수를 계산한다.
+        """
+        c = {bucket: max(counters.get(bucket) or 0, 0) for bucket in BUCKETS}
+
+        rating4 = c['rating4_1'] + c['rating4_2'] + c['rating4_3'] + c['rating4_4']
+        rating5 = c['rating5_1'] + c['rating5_2'] + c['rating5_3'] + c['rating5_4']
+
+        # review count
+        review_count = c['rating1'] + c['rating2'] + c['rating3'] + rating4 + rating5
+
+        # rating_avg
+        if review_count:
+            rating_avg = (c['rating1'] * 1.0 + c['rating2'] * 2.0 + c['rating3'] * 3.0 +
+                          rating4 * 4.0 + rating5 * 5) / review_count
+            rating_avg = round(rating_avg, 2)
+        else:
+            rating_avg = 0
+
+        # product score
+        converted_sum = c['rating1'] * -20.0 + c['rating2'] * -10.0 + c['rating3'] * -1.0
+        converted_sum += c['rating4_1'] * 0.5 + c['rating4_2'] * 2.5 + c['rating4_3'] * 4.0 + c['rating4_4'] * 5.0
+        converted_sum += c['rating5_1'] * 1.0 + c['rating5_2'] * 5.0 + c['rating5_3'] * 8.0 + c['rating5_4'] * 10.0
+
+        if review_count > 70:
+            score = converted_sum / review_count * 70
+        else:
+            score = converted_sum
+
+        review_count_score = review_count * 0.05 if review_count * 0.05 <= 50.0 else 50.0
+        score += review_count_score
+        score = round(score, 2)
+
+        return {
+            'score': score,
+            'review_count': review_count,
+            'rating_avg': rating_avg,
+        }
+
+    def get_counters(self, product_id):
+        """
+        제품의 평점 구간 카운터, 없으면 전체 집계로 만든다.
+        """
+        counters = get_product_rating_counters(product_id)
+        if counters is None or BLINDED not in counters:
+            counters = self.reconcile(product_id)
+        return counters
+
+    def get_review_stats(self, product_id):
+        """
+        제품 상세 리뷰 통계
+        :return: { 'ratings': { 평점: 리뷰 수 }, 'normal': 정상 리뷰 수, 'blinded': 블라인드 리뷰 수 }
+        """
+        counters = self.get_counters(product_id)
+
+        ratings = dict()
+        for bucket in BUCKETS:
+            rating = int(bucket[len('rating')])
+            ratings[rating] = ratings.get(rating, 0) + max(counters.get(bucket) or 0, 0)
+
+        return {
+            'ratings': ratings,
+            'normal': sum(ratings.values()),
+            'blinded': max(counters.get(BLINDED) or 0, 0),
+        }
+
+    def reconcile(self, product_id):
+        """
+        제품의 리뷰 전체를 집계해서 카운터를 다시 만든다.
+        """
+        result = self.get_counted_reviews().filter(
+            product_id=product_id
+        ).annotate(
+            **bucket_annotations()
+        ).aggregate(
+            **{bucket: Sum(bucket) for bucket in BUCKETS}
+        )
+
+        counters = {bucket: result.get(bucket) or 0 for bucket in BUCKETS}
+        counters[BLINDED] = self.get_blinded_reviews().filter(product_id=product_id).count()
+        set_products_rating_counters({product_id: counters})
+
+        return counters
+
+    def reconcile_all(self, batch_size=1000):
+        """
+        모든 제품의 카운터를 전체 집계와 맞춘다.
+        :return: 카운터가 달라진 제품 아이디 목록
+        """
+        rows = self.get_counted_reviews().values(
+            'product_id'
+        ).annotate(
+            **{bucket: Sum(expression) for bucket, expression in bucket_annotations().items()}
+        ).order_by(
+            'product_id'
+        )
+
+        blinded = dict(self.get_blinded_reviews().values(
+            'product_id'
+        ).annotate(
+            count=Count('id')
+        ).order_by().values_list('product_id', 'count'))
+
+        changed = list()
+        batch = dict()
+        counted_ids = set()
+        for row in rows.iterator():
+            counted_ids.add(row['product_id'])
+            batch[row['product_id']] = {bucket: row[bucket] or 0 for bucket in BUCKETS}
+            batch[row['product_id']][BLINDED] = blinded.pop(row['product_id'], 0)
+            if len(batch) >= batch_size:
+                changed += self._apply_reconciled(batch)
+                batch = dict()
+
+        # 블라인드 리뷰만 있는 제품
+        for product_id, count in blinded.items():
+            counted_ids.add(product_id)
+            batch[product_id] = dict({bucket: 0 for bucket in BUCKETS}, **{BLINDED: count})
+            if len(batch) >= batch_size:
+                changed += self._apply_reconciled(batch)
+                batch = dict()
+
+        # 리뷰가 모두 삭제/숨김된 제품은 카운터를 0 으로 맞춘다.
+        for product_id in scan_product_rating_ids():
+            if product_id in counted_ids:
+                continue
+            counted_ids.add(product_id)
+            batch[product_id] = dict({bucket: 0 for bucket in BUCKETS}, **{BLINDED: 0})
+            if len(batch) >= batch_size:
+                changed += self._apply_reconciled(batch)
+                batch = dict()
+
+        if batch:
+            changed += self._apply_reconciled(batch)
+
+        return changed
+
+    def _apply_reconciled(self, batch):
+        stored = get_products_rating_counters(list(batch.keys()))
+
+        changed = dict()
+        for product_id, counters in batch.items():
+            if stored.get(product_id) != counters:
+                changed[product_id] = counters
+
+        if changed:
+            set_products_rating_counters(changed)
+
+        return list(changed.keys())
+
+    def apply_deltas(self, deltas):
+        """
+        :param deltas: { product_id: { 구간: 증감값 } }
+        """
+        for product_id, values in deltas.items():
+            incr_product_rating_counters(product_id, values)
+
+    def _on_commit(self, product_id, deltas):
+        """
+        트랜잭션이 커밋된 후 증감값을 반영한다.
+        :return: 점수를 다시 계산해야 하는 제품 아이디 목록
+        """
+        transaction.on_commit(lambda: self.apply_deltas(deltas))
+        return [product_id] + [_id for _id in deltas.keys() if _id != product_id]
+
+    def _user_level_deltas(self, user, old_count, new_count, exclude_review_id=None):
+        """
+        작성자의 리뷰 수 구간이 바뀌면 작성자의 다른 4, 5점 리뷰도 구간을 옮긴다.
+        """
+        old_level = get_user_level(old_count)
+        new_level = get_user_level(new_count)
+
+        deltas = defaultdict(lambda: defaultdict(int))
+        if old_level == new_level or user.is_blinded:
+            return deltas
+
+        reviews = self.get_counted_reviews().filter(
+            user=user, rating__gte=4
+        ).exclude(
+            id=exclude_review_id
+        ).values_list('product_id', 'rating')
+
+        for product_id, rating in reviews:
+            deltas[product_id][get_bucket(rating, old_count)] -= 1
+            deltas[product_id][get_bucket(rating, new_count)] += 1
+
+        return deltas
+
+    def review_created(self, review, user, previous_review_count):
+        """
+        리뷰 작성 (작성자의 review_count 증가 후 호출)
+        """
+        deltas = self._user_level_deltas(user, previous_review_count, user.review_count, review.id)
+        if self.is_counted(review, user):
+            deltas[review.product_id][get_bucket(review.rating, user.review_count)] += 1
+        elif self.is_blinded(review, user):
+            deltas[review.product_id][BLINDED] += 1
+        return self._on_commit(review.product_id, deltas)
+
+    def review_updated(self, review, user, old_rating, old_state):
+        """
+        리뷰 수정
+        """
+        deltas = defaultdict(lambda: defaultdict(int))
+        if self.is_counted(review, user, old_state):
+            deltas[review.product_id][get_bucket(old_rating, user.review_count)] -= 1
+        elif self.is_blinded(review, user, old_state):
+            deltas[review.product_id][BLINDED] -= 1
+        if self.is_counted(review, user):
+            deltas[review.product_id][get_bucket(review.rating, user.review_count)] += 1
+        elif self.is_blinded(review, user):
+            deltas[review.product_id][BLINDED] += 1
+        return self._on_commit(review.product_id, deltas)
+
+    def review_deleted(self, review, user, previous_review_count):
+        """
+        리뷰 삭제 (작성자의 review_count 감소 후 호출)
+        """
+        deltas = self._user_level_deltas(user, previous_review_count, user.review_count, review.id)
+        if self.is_counted(review, user):
+            deltas[review.product_id][get_bucket(review.rating, previous_review_count)] -= 1
+        elif self.is_blinded(review, user):
+            deltas[review.product_id][BLINDED] -= 1
+        return self._on_commit(review.product_id, deltas)
+
+    def products_changed(self, product_ids):
+        """
+        증감값으로 반영할 수 없는 변경(회원 탈퇴, 일괄 블라인드 등) 후 호출
+        카운터를 지우고 다음 조회 때 전체 집계로 다시 만든다.
+        :return: 점수를 다시 계산해야 하는 제품 아이디 목록
+        """
+        product_ids = list(product_ids)
+        transaction.on_commit(lambda: delete_products_rating_counters(product_ids))
+        return product_ids
+
+
+service = ProductScoreService()
+
+
+def _blind_changed(product_ids):
+    # tasks.products 가 이 모듈을 import 하므로 여기서 import 한다.
+    from tasks.products import request_update_product_info
+
+    for product_id in service.products_changed(product_ids):
+        transaction.on_commit(lambda _id=product_id: request_update_product_info(_id))
+
+
+@receiver(post_init, sender=Review)
+def remember_review_blind_state(sender, instance, **kwargs):
+    # 지연 로딩 필드를 읽지 않도록 __dict__ 에서 꺼낸다.
+    instance._score_state = (instance.__dict__.get('state'), instance.__dict__.get('is_display'))
+
+
+@receiver(post_save, sender=Review)
+def review_blind_changed(sender, instance, created, **kwargs):
+    if created:
+        return
+    state = (instance.__dict__.get('state'), instance.__dict__.get('is_display'))
+    if state != getattr(instance, '_score_state', state):
+        _blind_changed([instance.product_id])
+    instance._score_state = state
+
+
+@receiver(post_save, sender=BlindedReview)
+@receiver(post_delete, sender=BlindedReview)
+def blinded_review_changed(sender, instance, **kwargs):
+    _blind_changed(Review.objects.filter(id=instance.review_id).values_list('product_id', flat=True))
+
+
+@receiver(post_init, sender=User)
+def remember_user_blind_state(sender, instance, **kwargs):
+    instance._score_is_blinded = instance.__dict__.get('is_blinded')
+
+
+@receiver(post_save, sender=User)
+def user_blind_changed(sender, instance, created, **kwargs):
+    if created:
+        return
+    is_blinded = instance.__dict__.get('is_blinded')
+    if is_blinded != getattr(instance, '_score_is_blinded', is_blinded):
+        _blind_changed(set(Review.objects.filter(
+            user_id=instance.id, is_display=True
+        ).values_list('product_id', flat=True)))
+    instance._score_is_blinded = is_blinded
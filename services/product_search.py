@@ -0,0 +1,334 @@
+"""
+제품 통합 검색 색인 로직 정의
+제품명, 브랜드명, 브랜드 초성, 2차 카테고리명을 프로세스 메모리에 색인하고
+검색어의 단어를 모두 포함하는 제품 아이디를 점수 순서로 돌려준다.
+제품/브랜드/카테고리 변경은 redis 의 변경 기록으로 다른 프로세스에 전달되어 바뀐 것만 다시 읽는다.
+색인을 만들 수 없으면 None 을 돌려주고 호출한 쪽에서 SQL 로 검색한다.
+"""
+import heapq
+import logging
+import re
+import threading
+import time
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from cash_db.redis_utils import add_product_search_changes, get_product_search_changes
+from libs.search import SubstringIndex, normalize
+from models.brands import Brand
+from models.products import Product, SubCategory
+
+logger = logging.getLogger(__name__)
+
+# 변경 기록을 확인하는 간격 (초)
+CHECK_INTERVAL = 10
+# 점수 반영을 위해 전체 색인을 다시 만드는 간격 (초)
+REBUILD_INTERVAL = 60 * 30
+# 색인 이후 변경이 이만큼 쌓이면 전체 색인을 다시 만든다.
+MAX_DELTA_SIZE = 5000
+
+
+def _get_set(sets, key, copied=None):
+    """
+    sets[key] 를 돌려준다. copied 가 있으면 처음 고칠 때 복사본으로 바꾼다.
+    """
+    if copied is None:
+        return sets.setdefault(key, set())
+    if key not in copied:
+        sets[key] = set(sets.get(key, ()))
+        copied.add(key)
+    return sets[key]
+
+
+class ProductSearchIndex:
+    def __init__(self, sequence):
+        self.sequence = sequence
+        self.built_at = time.time()
+        self.checked_at = self.built_at
+
+        self.brands = {_id: self._make_brand(name, phoneme, is_display)
+                       for _id, name, phoneme, is_display in Brand.objects.values_list(
+                           'id', 'name', 'phoneme', 'is_display')}
+        self.categories = {_id: self._make_category(name)
+                           for _id, name in SubCategory.objects.values_list('id', 'name')}
+
+        self.products = dict()
+        names = dict()
+        for _id, name, brand_id, score in Product.objects.filter(
+                is_display=True
+        ).values_list('id', 'name', 'brand_id', 'score'):
+            self.products[_id] = {'name': name, 'brand_id': brand_id, 'score': score, 'category_ids': set()}
+            names[_id] = name
+
+        for _id, category_id in Product.objects.filter(
+                is_display=True, categories__isnull=False
+        ).values_list('id', 'categories__id'):
+            self.products[_id]['category_ids'].add(category_id)
+
+        self.names = SubstringIndex(names.items())
+
+        self.brand_products = dict()
+        self.category_products = dict()
+        for _id in self.products:
+            self._link(_id, self.products, self.brand_products, self.category_products)
+
+    def _make_brand(self, name, phoneme, is_display):
+        return {'name': normalize(name), 'phoneme': normalize(phoneme),
+                'exact': {(name or '').strip().lower(), (phoneme or '').strip().lower()},
+                'is_display': bool(is_display)}
+
+    def _make_category(self, name):
+        return {'name': normalize(name), 'exact': (name or '').strip().lower()}
+
+    def _link(self, _id, products, brand_products, category_products, copied=None):
+        product = products[_id]
+        _get_set(brand_products, product['brand_id'], copied[0] if copied else None).add(_id)
+        for category_id in product['category_ids']:
+            _get_set(category_products, category_id, copied[1] if copied else None).add(_id)
+
+    def _unlink(self, _id, products, brand_products, category_products, copied):
+        product = products.pop(_id, None)
+        if product is None:
+            return
+        _get_set(brand_products, product['brand_id'], copied[0]).discard(_id)
+        for category_id in product['category_ids']:
+            _get_set(category_products, category_id, copied[1]).discard(_id)
+
+    @property
+    def delta_size(self):
+        return self.names.delta_size
+
+    def apply_changes(self, members):
+        """
+        바뀐 제품/브랜드/카테고리만 다시 읽는다.
+        검색 중인 요청이 같은 색인을 읽고 있으므로 고칠 dict, set 은 복사해서 고친 후 교체한다.
+        """
+        product_ids = set()
+        brands = None
+        categories = None
+        for member in members:
+            kind, _id = member.split(':')
+            _id = int(_id)
+            if kind == 'p':
+                product_ids.add(_id)
+            elif kind == 'b':
+                if brands is None:
+                    brands = dict(self.brands)
+                brand = Brand.objects.filter(id=_id).values_list('name', 'phoneme', 'is_display').first()
+                if brand:
+                    brands[_id] = self._make_brand(*brand)
+                else:
+                    brands.pop(_id, None)
+            elif kind == 'c':
+                if categories is None:
+                    categories = dict(self.categories)
+                name = SubCategory.objects.filter(id=_id).values_list('name', flat=True).first()
+                if name is not None:
+                    categories[_id] = self._make_category(name)
+                else:
+                    categories.pop(_id, None)
+
+        if brands is not None:
+            self.brands = brands
+        if categories is not None:
+            self.categories = categories
+
+        if not product_ids:
+            return
+
+        products = dict(self.products)
+        brand_products = dict(self.brand_products)
+        category_products = dict(self.category_products)
+        copied = (set(), set())
+
+        for _id in product_ids:
+            self._unlink(_id, products, brand_products, category_products, copied)
+
+        names = list()
+        for _id, name, brand_id, score in Product.objects.filter(
+                id__in=product_ids, is_display=True
+        ).values_list('id', 'name', 'brand_id', 'score'):
+            products[_id] = {'name': name, 'brand_id': brand_id, 'score': score, 'category_ids': set()}
+            names.append((_id, name))
+
+        for _id, category_id in Product.objects.filter(
+                id__in=product_ids, is_display=True, categories__isnull=False
+        ).values_list('id', 'categories__id'):
+            products[_id]['category_ids'].add(category_id)
+
+        for _id in product_ids:
+            if _id in products:
+                self._link(_id, products, brand_products, category_products, copied)
+
+        self.names.apply(updates=names, removes=product_ids)
+        self.products = products
+        self.brand_products = brand_products
+        self.category_products = category_products
+
+    def _match_word(self, word):
+        normalized = normalize(word)
+        matched = set(self.names.search(normalized))
+
+        brand_products = self.brand_products
+        for brand_id, brand in self.brands.items():
+            if normalized in brand['name'] or normalized in brand['phoneme']:
+                matched.update(brand_products.get(brand_id, ()))
+
+        category_products = self.category_products
+        for category_id, category in self.categories.items():
+            if normalized in category['name']:
+                matched.update(category_products.get(category_id, ()))
+
+        return matched
+
+    def _match_exact(self, word):
+        word = word.lower()
+        matched = set(_id for _id, product in self.products.items()
+                      if (product['name'] or '').strip().lower() == word)
+
+        brand_products = self.brand_products
+        for brand_id, brand in self.brands.items():
+            if word in brand['exact']:
+                matched.update(brand_products.get(brand_id, ()))
+
+        category_products = self.category_products
+        for category_id, category in self.categories.items():
+            if word == category['exact']:
+                matched.update(category_products.get(category_id, ()))
+
+        return matched
+
+    def search(self, words):
+        """
+        :return: 검색 조건에 맞는 제품 아이디 set
+        """
+        if len(words) == 1 and len(words[0]) == 1:
+            matched = self._match_exact(words[0])
+        else:
+            matched = None
+            for word in words:
+                word_matched = self._match_word(word)
+                matched = word_matched if matched is None else matched & word_matched
+                if not matched:
+                    break
+
+        # 전시 중인 브랜드의 카테고리가 있는 제품만
+        products = self.products
+        brands = self.brands
+        results = set()
+        for _id in matched or ():
+            product = products.get(_id)
+            if product and product['category_ids'] and \
+                    brands.get(product['brand_id'], {}).get('is_display'):
+                results.add(_id)
+        return results
+
+    def sort_key(self, _id):
+        product = self.products.get(_id)
+        score = product['score'] if product else None
+        return score is None, -(score or 0), _id
+
+
+class ProductSearchService:
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _get_index(self):
+        """
+        프로세스 안의 검색 색인
+        CHECK_INTERVAL 마다 변경 기록을 확인해서 바뀐 제품만 다시 읽는다.
+        """
+        index = self._index
+        now = time.time()
+        if index is not None and now < index.checked_at + CHECK_INTERVAL:
+            return index
+
+        with self._lock:
+            index = self._index
+            if index is not None and now < index.checked_at + CHECK_INTERVAL:
+                return index
+
+            members, oldest, sequence = get_product_search_changes(index.sequence if index else 0)
+            is_missed = index is not None and oldest is not None and oldest > index.sequence + 1
+
+            if index is None or is_missed or now > index.built_at + REBUILD_INTERVAL or \
+                    index.delta_size + len(members) > MAX_DELTA_SIZE:
+                index = ProductSearchIndex(sequence)
+            elif members:
+                index.apply_changes(members)
+                index.sequence = sequence
+
+            index.checked_at = now
+            self._index = index
+
+        return index
+
+    def search(self, query, offset=0, limit=None):
+        """
+        :return: (점수 순 제품 아이디 목록 (offset 부터 limit 개), 전체 수), 색인을 쓸 수 없으면 None
+        """
+        try:
+            index = self._get_index()
+        except Exception as e:
+            logger.error('product search index unavailable: {}'.format(e))
+            return None
+
+        words = re.findall('([\w.]+)', query)
+        if not words:
+            return [], 0
+
+        matched = index.search(words)
+        if limit is None:
+            product_ids = sorted(matched, key=index.sort_key)[offset:]
+        else:
+            product_ids = heapq.nsmallest(offset + limit, matched, key=index.sort_key)[offset:]
+
+        return product_ids, len(matched)
+
+    def _add_changes(self, members):
+        try:
+            add_product_search_changes(members)
+        except Exception as e:
+            logger.error('product search change failed: {}'.format(e))
+
+    def changed(self, members):
+        """
+        트랜잭션 커밋 후 변경 기록에 추가한다.
+        :param members: 'p:제품 아이디', 'b:브랜드 아이디', 'c:카테고리 아이디'
+        """
+        members = list(members)
+        transaction.on_commit(lambda: self._add_changes(members))
+
+
+service = ProductSearchService()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_search_product_changed(sender, instance, **kwargs):
+    service.changed(['p:{}'.format(instance.id)])
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_search_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        service.changed(['p:{}'.format(_id) for _id in pk_set or ()])
+    else:
+        service.changed(['p:{}'.format(instance.id)])
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+def product_search_brand_changed(sender, instance, **kwargs):
+    service.changed(['b:{}'.format(instance.id)])
+
+
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+def product_search_category_changed(sender, instance, **kwargs):
+    service.changed(['c:{}'.format(instance.id)])
@@ -22,6 +22,9 @@ from models.products import Product, ViewCategory, ProductRanking
 from models.recommend_products import RecommendProduct
 from models.stores import Store
 from models.users import Wish
+from services.product_cards import service as product_card_service
+from services.product_search import service as product_search_service
+from tasks.products import request_refresh_naver_info
 from libs.shortcuts import get_object_or_404
 
 
@@ -160,6 +163,27 @@ class ProductService:
         )
 
         if query:
+            # 메모리 검색 색인을 쓸 수 없을 때만 SQL 로 검색한다.
+            cursor = int(cursor or 1)
+            offset = (cursor - 1) * limit
+            searched = product_search_service.search(query, offset, 0 if only_count else limit + 1)
+            if searched is not None:
+                product_ids, total_count = searched
+                if only_count:
+                    return total_count
+
+                results = product_card_service.get_list(product_ids)
+                if len(results) == limit + 1:
+                    next_offset = cursor + 1
+                    del results[-1]
+                else:
+                    next_offset = None
+
+                return {
+                    'list': results,
+                    'next_offset': next_offset,
+                }
+
             products = products.filter(
                 (Q(categories__is_display=True) | Q(categories__is_display=False))
             )
@@ -223,11 +247,13 @@ class ProductService:
 
         if cursor and not query:
             base = products.filter(id__lt=cursor)
-            results = base.all()[:limit + 1]
+            product_ids = base.values_list('id', flat=True)[:limit + 1]
         else:
             cursor = int(cursor or 1)
             offset = (cursor - 1) * limit
-            results = products.all()[offset: offset + limit + 1]
+            product_ids = products.values_list('id', flat=True)[offset: offset + limit + 1]
+
+        results = product_card_service.get_list(product_ids)
 
         if not results:
             return {
@@ -242,9 +268,8 @@ class ProductService:
             }
 
         if len(results) == limit + 1:
-            results = list(results)
             if cursor and not query:
-                next_offset = results[-2].id
+                next_offset = results[-2]['id']
             else:
                 next_offset = cursor + 1
             del results[-1]
@@ -270,32 +295,15 @@ class ProductService:
             month_new = None
 
         # 네이버 api
-        if not 'naver_api_updated_at' in results:
-            # initial
-            blog_info, shop_info = naver_openapi.retrieve(
-                results['brand_title']['S'] + " " + results['product_title']['S']
+        # 저장된 값을 바로 응답하고 없거나 오래되었으면 백그라운드에서 갱신한다.
+        blog_info = json.loads(results['blog_info']['B'].decode()) if 'blog_info' in results else None
+        shop_info = json.loads(results['shop_info']['B'].decode()) if 'shop_info' in results else []
+
+        if not 'naver_api_updated_at' in results or \
+                naver_openapi.check_updadted(results['naver_api_updated_at']['S']):
+            request_refresh_naver_info(
+                product_id, results['brand_title']['S'] + " " + results['product_title']['S']
             )
-            attr_update = {
-                'naver_api_updated_at': {'Value': {'S': naver_openapi.get_current_time()}},
-                'blog_info': {'Value': {'B': json.dumps(blog_info)}},
-                'shop_info': {'Value': {'B': json.dumps(shop_info)}}
-            }
-            aws_dynamodb_products.update(product_id=product_id, attr_update=attr_update)
-        else:
-            updated_at = results['naver_api_updated_at']['S']
-            if naver_openapi.check_updadted(updated_at):
-                blog_info, shop_info = naver_openapi.retrieve(
-                    results['brand_title']['S'] + " " + results['product_title']['S']
-                )
-                attr_update = {
-                    'naver_api_updated_at': {'Value': {'S': naver_openapi.get_current_time()}},
-                    'blog_info': {'Value': {'B': json.dumps(blog_info)}},
-                    'shop_info': {'Value': {'B': json.dumps(shop_info)}}
-                }
-                aws_dynamodb_products.update(product_id=product_id, attr_update=attr_update)
-            else:
-                blog_info = json.loads(results['blog_info']['B'].decode()) if 'blog_info' in results else None
-                shop_info = json.loads(results['shop_info']['B'].decode()) if 'shop_info' in results else []
 
         sub_categories = [{
                               'id': a['id_second_category'],
@@ -569,17 +577,16 @@ class ProductService:
 
         products = Product.objects.visible().filter(
             release_date=ym
-        ).select_related(
-            'brand', 'productgoods'
         ).order_by('-score', 'id')
 
         cursor = int(cursor or 1)
         offset = (cursor - 1) * limit
-        results = products.all()[offset: offset + limit + 1]
+        rows = list(products.values('id', 'score')[offset: offset + limit + 1])
 
+        results = product_card_service.hydrate(rows)
         for idx, product in enumerate(results):
-            if product.score:
-                setattr(product, 'rank', offset + idx + 1)
+            if product.get('score'):
+                product['rank'] = offset + idx + 1
 
         if not results:
             return {
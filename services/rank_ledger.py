@@ -0,0 +1,169 @@
+"""
+유저 랭킹 포인트 기록 로직 정의
+리뷰 작성/삭제, 첫 리뷰 보너스 이전 등 포인트 변경을 기록(ledger)으로 남기고
+랭킹 테이블에는 증감값만 반영한다.
+전체 재생성(rebuild)은 MySQL 의 리뷰로 다음 세대 랭킹 테이블을 만든 후 한번에 교체한다.
+"""
+import json
+
+from django.db.models import Case, Count, IntegerField, Sum, When
+
+from cash_db.redis_utils import append_rank_ledger, stage_period, publish_period
+from libs.utils import kst_now, kst_last_week_friday_18_00
+from models.reviews import Review, Review_first_log
+
+DATETIME_FORMAT = '%Y%m%d%H%M%S'
+
+
+class RankLedgerService:
+    def get_week_start(self):
+        """
+        이번주 랭킹 시작 시각 (지난주 금요일 18시, 리뷰 _created_at 형식)
+        """
+        return kst_last_week_friday_18_00().strftime(DATETIME_FORMAT)
+
+    def is_this_week(self, created_at):
+        return created_at >= self.get_week_start()
+
+    def record(self, event, user_id, deltas, **data):
+        """
+        :param event: review_written, review_deleted, first_bonus_transferred
+        :param deltas: { period: 증감값 (None 이면 랭킹에서 제외) }
+        """
+        entry = dict(data, event=event, user_id=user_id, deltas=deltas,
+                     timestamp=kst_now().strftime(DATETIME_FORMAT))
+        return append_rank_ledger(entry, user_id, deltas)
+
+    def review_written(self, period, user_id, points, is_multiple, is_first):
+        """
+        리뷰 작성 포인트 (기본 + 3의 배수 보너스 + 첫 리뷰 보너스)
+        """
+        point = points['review_point'] + \
+                (is_multiple * points['multiple_bonus_point']) + \
+                (is_first * points['first_bonus_point'])
+
+        self.record('review_written', user_id, {period: point},
+                    is_multiple=bool(is_multiple), is_first=bool(is_first))
+        return point
+
+    def review_deleted(self, review, review_id, user_id, points, review_count, this_week_review_count, is_first):
+        """
+        리뷰 삭제 포인트 차감
+        :param review_id: 삭제 전 리뷰 아이디 (삭제 후에는 review.id 가 None 이다.)
+        :param review_count: 삭제 후 남은 리뷰 수
+        :param this_week_review_count: 삭제 후 남은 이번주 리뷰 수
+        """
+        point = points['review_point'] + \
+                (((review_count + 1) % 3 == 0) * points['multiple_bonus_point']) + \
+                (is_first * points['first_bonus_point'])
+
+        # 남은 리뷰가 없으면 랭킹에서 제외한다.
+        deltas = {'all': None if review_count == 0 else -point}
+        if self.is_this_week(review._created_at):
+            deltas['this_week'] = None if this_week_review_count == 0 else -point
+
+        self.record('review_deleted', user_id, deltas,
+                    review_id=review_id, product_id=review.product_id, is_first=bool(is_first))
+        return point
+
+    def first_bonus_transferred(self, user_id, product_id, points, created_at):
+        """
+        첫 리뷰가 삭제되어 다음 리뷰 작성자에게 첫 리뷰 보너스를 준다.
+        """
+        point = points['first_bonus_point']
+
+        deltas = {'all': point}
+        if self.is_this_week(created_at):
+            deltas['this_week'] = point
+
+        self.record('first_bonus_transferred', user_id, deltas, product_id=product_id)
+        return point
+
+    def rebuild(self, points, batch_size=1000):
+        """
+        모든 유저의 누적/이번주 랭킹을 MySQL 리뷰로 다시 만든다.
+        유저를 batch_size 만큼씩 읽어 다음 세대 테이블에 쓰고 마지막에 현재 테이블과 교체한다.
+        재생성 중에 반영된 증감값은 교체 시 사라지므로 사용량이 적은 시간에 실행한다.
+        :return: 랭킹에 포함된 유저 수
+        """
+        week_start = self.get_week_start()
+
+        rows = Review.objects.filter(
+            state='N', when_seceded=0, is_display=1,
+            user__is_blinded=0, user__is_black=0, user__is_active=1
+        ).values(
+            'user_id', 'user__nickname', 'user__file_dir', 'user__file_name_save'
+        ).annotate(
+            review_count=Count('id'),
+            this_week_review_count=Sum(
+                Case(When(_created_at__gte=week_start, then=1), output_field=IntegerField(), default=0)
+            )
+        ).order_by('user_id')
+
+        user_count = 0
+        batch = list()
+        is_first_batch = True
+        for row in rows.iterator():
+            batch.append(row)
+            if len(batch) >= batch_size:
+                user_count += self._stage_batch(batch, points, week_start, is_first_batch)
+                batch = list()
+                is_first_batch = False
+
+        if batch or is_first_batch:
+            user_count += self._stage_batch(batch, points, week_start, is_first_batch)
+
+        publish_period('all', with_users=True)
+        publish_period('this_week')
+
+        return user_count
+
+    def _stage_batch(self, rows, points, week_start, reset):
+        user_ids = [row['user_id'] for row in rows]
+
+        first_counts = dict()
+        for row in Review_first_log.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+                count=Count('id'),
+                this_week_count=Sum(
+                    Case(When(timestamp__gte=week_start, then=1), output_field=IntegerField(), default=0)
+                )
+        ).order_by():
+            first_counts[row['user_id']] = (row['count'], row['this_week_count'] or 0)
+
+        scores = dict()
+        this_week_scores = dict()
+        users = dict()
+        for row in rows:
+            user_id = row['user_id']
+            review_count = row['review_count']
+            this_week_review_count = row['this_week_review_count'] or 0
+            first_count, this_week_first_count = first_counts.get(user_id, (0, 0))
+
+            score = (review_count * points['review_point']) + \
+                    ((review_count // 3) * points['multiple_bonus_point']) + \
+                    (first_count * points['first_bonus_point'])
+
+            this_week_score = (this_week_review_count * points['review_point']) + \
+                              ((review_count // 3 - (review_count - this_week_review_count) // 3) *
+                               points['multiple_bonus_point']) + \
+                              (this_week_first_count * points['first_bonus_point'])
+
+            if score > 0:
+                scores[user_id] = score
+                users[user_id] = json.dumps({
+                    'idRegister': user_id,
+                    'nickname': row['user__nickname'],
+                    'fileDir': row['user__file_dir'],
+                    'fileSaveName': row['user__file_name_save'],
+                    'reviewCnt': review_count,
+                })
+            if this_week_score > 0:
+                this_week_scores[user_id] = this_week_score
+
+        stage_period('all', scores, users, reset=reset)
+        stage_period('this_week', this_week_scores, reset=reset)
+
+        return len(scores)
+
+
+service = RankLedgerService()
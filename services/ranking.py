@@ -14,9 +14,21 @@ from db.raw_queries import (
     get_prodcuts_ranking_by_category_id_without_user_conditions, get_products_ranking_by_category_id,
     get_prodcuts_by_category_id)
 from models.products import Product, WeeklyRanking
+from services.product_cards import service as product_card_service
+from services.ranking_snapshots import service as ranking_snapshot_service
+from tasks.rankings import request_ranking_snapshot
 
 
 class RankingService:
+    def _get_snapshot_list(self, scope, scope_id, **kwargs):
+        """
+        미리 계산된 랭킹 스냅샷에서 조회한다. 스냅샷이 없으면 생성을 요청한다.
+        """
+        result = ranking_snapshot_service.get_list(scope, scope_id, **kwargs)
+        if result['is_missing']:
+            request_ranking_snapshot(result['key'])
+        return result
+
     def get_products_ranking_by_category_id(self, **kwargs):
         """
         카테고리별 제품 순위 리스트
@@ -29,7 +41,10 @@ class RankingService:
         order = kwargs.get('order')
 
         products_count = None
-        if order == 'rank':
+        snapshot = self._get_snapshot_list('category', kwargs.get('category_id'), **kwargs) if order == 'rank' else None
+        if snapshot and snapshot['products'] is not None:
+            products = snapshot['products']
+        elif order == 'rank':
             is_custom_conditions = False
             for key in custom_conditions:
                 if kwargs.get(key) != 'all':
@@ -55,22 +70,9 @@ class RankingService:
             products_count = results.get('total_count')
 
         # response format
+        products = product_card_service.hydrate(products)
         for product in products:
             product['rank'] = product.get('product_rank')
-            product['brand'] = dict()
-            product['brand']['id'] = product.get('brand_id')
-            product['brand']['name'] = product.get('brand_name')
-            product['brand']['brand_image'] = product.get('brand_image')
-            product['brand']['brand_image_160'] = product.get('brand_image_160')
-
-            goods_count = product.get('goods_count')
-            if goods_count:
-                product['productgoods'] = dict()
-                product['productgoods']['goods_count'] = product.get('goods_count')
-                product['productgoods']['min_price'] = product.get('min_price')
-                product['productgoods']['max_price'] = product.get('max_price')
-            else:
-                product['productgoods'] = None
 
         if not len(products):
             return {
@@ -141,7 +143,10 @@ class RankingService:
         order = kwargs.get('order')
 
         products_count = None
-        if order == 'rank':
+        snapshot = self._get_snapshot_list('brand', kwargs.get('brand_id'), **kwargs) if order == 'rank' else None
+        if snapshot and snapshot['products'] is not None:
+            products = snapshot['products']
+        elif order == 'rank':
             is_custom_conditions = False
             for key in custom_conditions:
                 if kwargs.get(key) != 'all':
@@ -167,22 +172,9 @@ class RankingService:
             products_count = results.get('total_count')
 
         # response format
+        products = product_card_service.hydrate(products)
         for product in products:
             product['rank'] = product.get('product_rank')
-            product['brand'] = dict()
-            product['brand']['id'] = product.get('brand_id')
-            product['brand']['name'] = product.get('brand_name')
-            product['brand']['brand_image'] = product.get('brand_image')
-            product['brand']['brand_image_160'] = product.get('brand_image_160')
-
-            goods_count = product.get('goods_count')
-            if goods_count:
-                product['productgoods'] = dict()
-                product['productgoods']['goods_count'] = product.get('goods_count')
-                product['productgoods']['min_price'] = product.get('min_price')
-                product['productgoods']['max_price'] = product.get('max_price')
-            else:
-                product['productgoods'] = None
 
         if not len(products):
             return {
@@ -210,28 +202,21 @@ class RankingService:
         limit = kwargs.get('limit', 20)
         cursor = kwargs.get('cursor')
 
-        results = get_prodcuts_by_store_id(**kwargs)
+        snapshot = self._get_snapshot_list('store', kwargs.get('store_id'), **kwargs) \
+            if kwargs.get('order') == 'rank' else None
+        if snapshot and snapshot['products'] is not None:
+            products = snapshot['products']
+            products_count = snapshot['total_count']
+        else:
+            results = get_prodcuts_by_store_id(**kwargs)
 
-        products = results.get('products')
-        products_count = results.get('total_count')
+            products = results.get('products')
+            products_count = results.get('total_count')
 
         # response format
+        products = product_card_service.hydrate(products)
         for product in products:
             product['rank'] = product.get('product_rank')
-            product['brand'] = dict()
-            product['brand']['id'] = product.get('brand_id')
-            product['brand']['name'] = product.get('brand_name')
-            product['brand']['brand_image'] = product.get('brand_image')
-            product['brand']['brand_image_160'] = product.get('brand_image_160')
-
-            goods_count = product.get('goods_count')
-            if goods_count:
-                product['productgoods'] = dict()
-                product['productgoods']['goods_count'] = product.get('goods_count')
-                product['productgoods']['min_price'] = product.get('min_price')
-                product['productgoods']['max_price'] = product.get('max_price')
-            else:
-                product['productgoods'] = None
 
         if not len(products):
             return {
@@ -263,17 +248,16 @@ class RankingService:
 
         products = Product.objects.visible().filter(
             release_date=ym
-        ).select_related(
-            'brand'
         ).order_by('-score', 'id')
 
         cursor = int(cursor or 1)
         offset = (cursor - 1) * limit
-        results = products.all()[offset: offset + limit + 1]
+        rows = list(products.values('id', 'score')[offset: offset + limit + 1])
 
+        results = product_card_service.hydrate(rows)
         for idx, product in enumerate(results):
-            if product.score:
-                setattr(product, 'rank', offset + idx + 1)
+            if product.get('score'):
+                product['rank'] = offset + idx + 1
 
         if not results:
             return {
@@ -0,0 +1,195 @@
+"""
+제품 랭킹 스냅샷 로직 정의
+카테고리/브랜드/스토어별 랭킹을 (성별, 연령, 피부타입, 집계기간) 조건마다 미리 계산해서
+제품 순서와 필터용 정보(브랜드, 브랜드 카테고리, 가격, 구매가능 여부, 카테고리)를 redis 에 저장한다.
+가격, 브랜드, 카테고리, 구매가능 필터는 저장된 순서에서 바로 걸러낸다.
+키워드 필터나 스냅샷이 없는 조건은 기존 쿼리로 조회한다.
+"""
+import time
+
+from django.conf import settings
+
+from cash_db.redis_utils import get_ranking_snapshot, set_ranking_snapshot
+from db.raw_queries import (
+    get_prodcuts_ranking_by_brand_id_with_user_conditions, get_products_ranking_by_brand_id,
+    get_prodcuts_by_store_id, get_prodcuts_ranking_by_category_id_with_user_conditions,
+    get_products_ranking_by_category_id)
+from models.products import Product
+
+USER_CONDITIONS = ('gender', 'age', 'skin_type', 'rank_term')
+
+# 스냅샷 항목 순서
+ID, RANK, RANK_CHANGE_TYPE, RANK_CHANGE, BRAND_ID, BRAND_CATEGORY_IDS, PRICE, IS_COMMERCE, \
+    MAIN_CATEGORY_IDS, SUB_CATEGORY_IDS = range(10)
+
+
+class RankingSnapshotService:
+    def make_key(self, scope, scope_id, **kwargs):
+        """
+        :param scope: category, brand, store
+        """
+        values = list()
+        for name in USER_CONDITIONS:
+            value = kwargs.get(name) or 'all'
+            # 다중 선택 값은 순서와 상관없이 같은 스냅샷을 쓴다.
+            values.append(','.join(sorted(set(value.split(',')))))
+
+        return ':'.join([scope, str(scope_id)] + values)
+
+    def parse_key(self, key):
+        """
+        :return: (scope, scope_id, { gender, age, skin_type, rank_term })
+        """
+        scope, scope_id, *values = key.split(':')
+        return scope, int(scope_id), dict(zip(USER_CONDITIONS, values))
+
+    def _fetch_ranking(self, scope, scope_id, conditions, size):
+        kwargs = dict(conditions, order='rank', cursor=None, limit=size)
+        is_custom_conditions = any(conditions[name] != 'all' for name in USER_CONDITIONS)
+
+        if scope == 'category':
+            kwargs['category_id'] = scope_id
+            if is_custom_conditions:
+                return get_prodcuts_ranking_by_category_id_with_user_conditions(**kwargs)
+            return get_products_ranking_by_category_id(**kwargs)
+        elif scope == 'brand':
+            kwargs['brand_id'] = scope_id
+            if is_custom_conditions:
+                return get_prodcuts_ranking_by_brand_id_with_user_conditions(**kwargs)
+            return get_products_ranking_by_brand_id(**kwargs)
+        elif scope == 'store':
+            kwargs['store_id'] = scope_id
+            return get_prodcuts_by_store_id(**kwargs).get('products')
+
+        raise ValueError('invalid scope: {}'.format(scope))
+
+    def _get_filter_values(self, product_ids):
+        values = {product_id: [None, list(), None, False, list(), list()] for product_id in product_ids}
+
+        for product_id, brand_id, price, goods_count in Product.objects.filter(
+                id__in=product_ids
+        ).values_list('id', 'brand_id', 'price', 'productgoods__goods_count'):
+            values[product_id][0] = brand_id
+            values[product_id][2] = int(price) if price is not None else None
+            values[product_id][3] = bool(goods_count)
+
+        for product_id, brand_category_id in Product.objects.filter(
+                id__in=product_ids, brand__brandcategories__brand_category__isnull=False
+        ).values_list('id', 'brand__brandcategories__brand_category'):
+            values[product_id][1].append(brand_category_id)
+
+        for product_id, main_category_id, sub_category_id in Product.objects.filter(
+                id__in=product_ids, categories__isnull=False
+        ).values_list('id', 'categories__main_category', 'categories__id'):
+            values[product_id][4].append(main_category_id)
+            values[product_id][5].append(sub_category_id)
+
+        return values
+
+    def build(self, key):
+        """
+        스냅샷을 다시 만든다.
+        :return: 스냅샷 제품 수
+        """
+        scope, scope_id, conditions = self.parse_key(key)
+        size = settings.RANKING_SNAPSHOT_SIZE
+
+        rows = self._fetch_ranking(scope, scope_id, conditions, size)
+        complete = len(rows) <= size
+        rows = rows[:size]
+
+        filter_values = self._get_filter_values([row['id'] for row in rows])
+        items = [
+            [row['id'], row.get('product_rank'), row.get('rank_change_type'), row.get('rank_change')] +
+            filter_values[row['id']]
+            for row in rows
+        ]
+
+        set_ranking_snapshot(key, {
+            'complete': complete,
+            'created_at': int(time.time()),
+            'items': items,
+        }, settings.RANKING_SNAPSHOT_EXPIRE)
+
+        return len(items)
+
+    def _get_filters(self, scope, kwargs):
+        """
+        스냅샷에 적용할 필터 (아이디는 숫자로 맞춘다)
+        스냅샷 범위(scope)의 아이디는 이미 스냅샷 조건이므로 제외한다.
+        """
+        filters = dict(kwargs)
+        filters.pop('{}_id'.format(scope), None)
+
+        for name in ('brand_id', 'brand_category_id', 'main_category_id', 'sub_category_id'):
+            if filters.get(name):
+                filters[name] = int(filters[name])
+
+        return filters
+
+    def _match(self, item, kwargs):
+        brand_id = kwargs.get('brand_id')
+        if brand_id and item[BRAND_ID] != brand_id:
+            return False
+
+        brand_category_id = kwargs.get('brand_category_id')
+        if brand_category_id and brand_category_id not in item[BRAND_CATEGORY_IDS]:
+            return False
+
+        sub_category_id = kwargs.get('sub_category_id')
+        main_category_id = kwargs.get('main_category_id')
+        if sub_category_id:
+            if sub_category_id not in item[SUB_CATEGORY_IDS]:
+                return False
+        elif main_category_id and main_category_id not in item[MAIN_CATEGORY_IDS]:
+            return False
+
+        min_price = kwargs.get('min_price')
+        max_price = kwargs.get('max_price')
+        if min_price is not None or max_price is not None:
+            if item[PRICE] is None:
+                return False
+            if min_price is not None and item[PRICE] < min_price:
+                return False
+            if max_price is not None and item[PRICE] > max_price:
+                return False
+
+        if kwargs.get('is_commerce') and not item[IS_COMMERCE]:
+            return False
+
+        return True
+
+    def get_list(self, scope, scope_id, **kwargs):
+        """
+        스냅샷에서 랭킹 한 페이지를 가져온다.
+        :return: { 'key', 'products': [{ id, product_rank, rank_change_type, rank_change }, ...](limit + 1 개까지),
+                   'total_count', 'is_missing' } (스냅샷을 쓸 수 없으면 'products' 가 None)
+        """
+        key = self.make_key(scope, scope_id, **kwargs)
+        if kwargs.get('keywords'):
+            return {'key': key, 'products': None, 'total_count': None, 'is_missing': False}
+
+        snapshot = get_ranking_snapshot(key)
+        if not snapshot or not snapshot.get('complete'):
+            return {'key': key, 'products': None, 'total_count': None, 'is_missing': snapshot is None}
+
+        filters = self._get_filters(scope, kwargs)
+        items = [item for item in snapshot['items'] if self._match(item, filters)]
+
+        limit = kwargs.get('limit', 20)
+        offset = (int(kwargs.get('cursor') or 1) - 1) * limit
+
+        return {
+            'key': key,
+            'products': [{
+                'id': item[ID],
+                'product_rank': item[RANK],
+                'rank_change_type': item[RANK_CHANGE_TYPE],
+                'rank_change': item[RANK_CHANGE],
+            } for item in items[offset: offset + limit + 1]],
+            'total_count': len(items),
+            'is_missing': False,
+        }
+
+
+service = RankingSnapshotService()
@@ -0,0 +1,144 @@
+"""
+리뷰 검색(elasticsearch) 색인 문서 생성 로직 정의
+색인할 리뷰의 작성자, 제품, 브랜드, 카테고리, 구매 정보를 한번에 가져와서 문서를 만든다.
+제품 구매 정보가 바뀌면 해당 제품의 리뷰 문서를 나눠서 업데이트한다.
+"""
+from libs.elasticsearch.reviews import elasticsearch_reviews
+from models.product_goods import ProductGoods
+from models.reviews import Review
+
+INDEX_NAME = 'review_ko'
+DOC_TYPE = 'reviews'
+
+
+class ReviewIndexService:
+    def make_document(self, review, goods=None):
+        user = review.user
+        product = review.product
+
+        body = dict()
+        # review
+        body['idreviewcomment'] = review.id
+        body['reviewText'] = review.contents
+        body['rating'] = review.rating
+        body['likeCount'] = review.like_count
+        body['isDisplay'] = int(review.is_display)
+        body['isEvaluation'] = int(review.is_evaluation)
+        body['create_date'] = review._created_at
+        body['tag'] = review.tag
+
+        # user
+        body['idRegister'] = user.id
+        body['nickName'] = user.nickname
+        body['birthYear'] = user.birth_year
+        body['skinType'] = user._skin_type
+        body['gender'] = user._gender
+        body['registerScore'] = user.score
+        body['registerRank'] = user.rank
+        body['isBlind'] = user.is_blinded
+        body['registerFileDir'] = user.file_dir
+        body['registerFileSaveName'] = user.file_name_save
+
+        # product
+        body['idProduct'] = product.id
+        body['productTitle'] = product.name
+        body['idBrand'] = product.brand_id
+        body['productFileDir'] = product.file_dir
+        body['productFileSaveName'] = product.file_name
+        body['brandTitle'] = product.brand.name
+        body['productIsDisplay'] = int(product.is_display)
+
+        body['firstCategoryList'] = ""
+        body['secondCategoryList'] = ""
+        for category in product.categories.all():
+            body['firstCategoryList'] += "[" + str(category.main_category_id) + "]"
+            body['secondCategoryList'] += "[" + str(category.id) + "]"
+
+        if goods:
+            body['goods_info'] = {
+                "goods_count": goods.goods_count,
+                "min_price": goods.min_price,
+                "max_price": goods.max_price
+            }
+
+        return body
+
+    def iter_product_review_hits(self, product_ids, page_size=1000):
+        """
+        제품들의 리뷰 문서를 search_after 로 page_size 개씩 가져온다.
+        :return: 페이지별 [(문서 아이디, 제품 아이디), ...]
+        """
+        body = {
+            'query': {'terms': {'idProduct': list(product_ids)}},
+            '_source': ['idProduct'],
+            'sort': [{'idreviewcomment': 'asc'}],
+        }
+
+        while True:
+            res = elasticsearch_reviews.search(body=body, _size=page_size)
+            hits = res.get('hits').get('hits')
+            if not hits:
+                break
+
+            yield [(hit.get('_id'), hit.get('_source').get('idProduct')) for hit in hits]
+
+            if len(hits) < page_size:
+                break
+            body['search_after'] = hits[-1].get('sort')
+
+    def make_goods_actions(self, hits, goods_info):
+        """
+        리뷰 문서의 구매 정보(goods_info) 업데이트 작업
+        :param goods_info: { product_id: { 'goods_count', 'min_price', 'max_price' } }
+        """
+        return [{
+            "_op_type": 'update',
+            "_index": INDEX_NAME,
+            "_type": DOC_TYPE,
+            "_id": _id,
+            "doc": {'goods_info': goods_info[int(product_id)]},
+            'doc_as_upsert': True
+        } for _id, product_id in hits]
+
+    def make_actions(self, review_ids):
+        """
+        리뷰 목록의 bulk 색인 작업 (없어진 리뷰는 삭제)
+        :return: { review_id: action }
+        """
+        reviews = Review.objects.filter(
+            id__in=review_ids
+        ).select_related(
+            'user', 'product', 'product__brand'
+        ).prefetch_related(
+            'product__categories'
+        )
+        reviews = {review.id: review for review in reviews}
+
+        goods = ProductGoods.objects.filter(
+            product_id__in=set(review.product_id for review in reviews.values()), goods_count__gt=0
+        )
+        goods = {item.product_id: item for item in goods}
+
+        actions = dict()
+        for review_id in review_ids:
+            review = reviews.get(review_id)
+            if review is None:
+                actions[review_id] = {
+                    '_op_type': 'delete',
+                    '_index': INDEX_NAME,
+                    '_type': DOC_TYPE,
+                    '_id': review_id,
+                }
+            else:
+                actions[review_id] = {
+                    '_op_type': 'index',
+                    '_index': INDEX_NAME,
+                    '_type': DOC_TYPE,
+                    '_id': review_id,
+                    '_source': self.make_document(review, goods.get(review.product_id)),
+                }
+
+        return actions
+
+
+service = ReviewIndexService()
@@ -1,6 +1,7 @@
 import re
 import math
 import json
+import time
 from datetime import datetime, timedelta
 from enum import Enum
 
@@ -8,21 +9,28 @@ from django.conf import settings
 from django.db import transaction
 from django.db.models import F
 from django.db.models import Q, Count, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
 from backends.api import exceptions
 from cash_db.redis_utils import redis_get_exists_table, get_redis_tables, get_user_review_info, get_user_rank,\
-    period_zincrby, period_hget, period_hset, period_zcard, period_zrem
+    period_hget, period_hset, period_zcard, get_point_config_version, bump_point_config_version, add_like_dirty, \
+    pop_like_dirty
 from libs.elasticsearch.reviews import elasticsearch_reviews
-from libs.utils import local_now, iso8601, get_age_range, utc_now
+from libs.pagination import encode_cursor, decode_cursor, get_keyset_values, keyset_filter
+from libs.utils import iso8601, get_age_range, utc_now
 from models.common_codes import CommonCodeValue
 from models.messages import MessageBox, MessageCategory, MessageCheck
-from models.product_goods import ProductGoods
 from models.report_reviews import ReportReview
-from models.reviews import Review, Reviewlike, Review_first_log
-from models.tags import TagObject
+from models.reviews import Review, Reviewlike
 from models.users import Gender, SkinTypeCode, User
 from models.points import Point
+from services.product_cards import service as product_card_service
+from services.product_scores import service as product_score_service
+from services.rank_ledger import service as rank_ledger_service
+from services.tags import service as tag_service
+from services.users import service as users_service
 
 class Sort(Enum):
     like_desc = 'popular'
@@ -31,9 +39,34 @@ class Sort(Enum):
     create_date_asc = 'oldest'
 
 
+# 정렬별 order_by, 마지막 필드는 keyset 페이징을 위해 유일한 값을 사용한다.
+SORT_ORDERING = {
+    'popular': ('-like_count', '-_created_at', '-id'),
+    'unpopular': ('like_count', '-_created_at', '-id'),
+    'latest': ('-_created_at', '-id'),
+    'oldest': ('_created_at', 'id'),
+}
+
+# elasticsearch 정렬 (search_after 페이징)
+ES_SORT_ORDERING = {
+    'like_desc': ({'likeCount': 'desc'}, {'create_date': 'desc'}, {'idreviewcomment': 'desc'}),
+    'like_asc': ({'likeCount': 'asc'}, {'create_date': 'desc'}, {'idreviewcomment': 'desc'}),
+    'create_date_desc': ({'create_date': 'desc'}, {'idreviewcomment': 'desc'}),
+    'create_date_asc': ({'create_date': 'asc'}, {'idreviewcomment': 'asc'}),
+}
+
+
+# 리뷰 포인트 설정 캐시 (프로세스별)
+POINT_CONFIG_TTL = 60
+# 포인트 설정은 앱 밖에서도 바뀌므로 version 과 상관없이 다시 읽는 간격 (초)
+POINT_CONFIG_MAX_AGE = 60 * 10
+_point_config_cache = {'version': None, 'rows': None, 'expires_at': 0, 'loaded_at': 0}
+
+
 class ReviewService:
     query_set = Review.objects.filter(is_display=True)
     list_type = None
+    product_id = None
 
     def setter(self, **kwargs):
         user_id = kwargs.get('user_id')
@@ -44,6 +77,7 @@ class ReviewService:
 
         self.query_set = Review.objects.filter(is_display=True)
         self.list_type = None
+        self.product_id = int(product_id) if product_id else None
 
         if user_id:
             # 유저를 기반으로 리뷰 리스트
@@ -208,6 +242,23 @@ class ReviewService:
 
         return query_set
 
+    def _get_product_review_stats(self, **kwargs):
+        """
+        필터 없는 제품 상세 리뷰 리스트의 평점별 리뷰 수, 정상/블라인드 리뷰 수
+        필터가 있으면 None
+        """
+        if not self.product_id:
+            return None
+
+        for key in ('rating', 'gender', 'skin_type', 'age'):
+            value = kwargs.get(key)
+            if value and value != 'all':
+                return None
+        if kwargs.get('contents'):
+            return None
+
+        return product_score_service.get_review_stats(self.product_id)
+
     def _set_sorting(self, query_set, **kwargs):
         """
         파라미터를 가지고 쿼리 셋의 정렬을 세팅한다.
@@ -223,18 +274,7 @@ class ReviewService:
 
         sort = Sort[order].value if order else default_sort
 
-        base = query_set
-
-        if sort == 'popular':
-            base = base.order_by('-like_count', '-_created_at')
-        elif sort == 'unpopular':
-            base = base.order_by('like_count', '-_created_at')
-        elif sort == 'latest':
-            base = base.order_by('-_created_at')
-        elif sort == 'oldest':
-            base = base.order_by('_created_at')
-
-        query_set = base
+        query_set = query_set.order_by(*SORT_ORDERING[sort])
 
         return query_set, sort
 
@@ -253,15 +293,25 @@ class ReviewService:
         base = self._set_conditions(self.query_set, **kwargs)
 
         if self.list_type == 'product_reviews':
+            state = kwargs.get('state')
+
+            # 필터가 없으면 제품 리뷰 통계(redis)를 사용한다.
+            stats = self._get_product_review_stats(**kwargs)
+            if only_count and stats:
+                return stats['normal'] if state == 'normal' else stats['blinded']
+
             if only_count:
                 base = base.force_index('reviewcomment_product_count_index')
             else:
                 base = base.force_index('reviewcomment_product_review_index')
 
-            state = kwargs.get('state')
             # 정상 상태인 리뷰에서만 필터 검색이 가능하다.
             if state == 'normal':
-                rating_points = base.values('rating').all().annotate(count=Count('id'))
+                if stats:
+                    rating_points = [{'rating': rating, 'count': count}
+                                     for rating, count in sorted(stats['ratings'].items()) if count]
+                else:
+                    rating_points = base.values('rating').all().annotate(count=Count('id'))
 
         if only_count:
             return base.all().count()
@@ -278,13 +328,11 @@ class ReviewService:
             'user', 'product', 'product__brand', 'product__productgoods'
         )
 
-        if cursor and sort == 'latest':
-            base = base.filter(id__lt=cursor)
-            results = base.all()[:limit + 1]
-        else:
-            cursor = int(cursor or 1)
-            offset = (cursor - 1) * limit
-            results = base.all()[offset: offset + limit + 1]
+        ordering = SORT_ORDERING[sort]
+        if cursor:
+            base = base.filter(keyset_filter(ordering, decode_cursor(cursor, len(ordering))))
+
+        results = base.all()[:limit + 1]
 
         if not results:
             return {
@@ -304,10 +352,7 @@ class ReviewService:
 
         if len(results) == limit + 1:
             results = list(results)
-            if sort == 'latest':
-                next_offset = results[-2].id
-            else:
-                next_offset = cursor + 1
+            next_offset = encode_cursor(get_keyset_values(results[-2], ordering))
             del results[-1]
         else:
             next_offset = None
@@ -439,26 +484,17 @@ class ReviewService:
 
         # 정렬순서
         sort = kwargs.get('order')
-        if sort == 'like_desc':
-            order = "likeCount:desc"
-        elif sort == 'like_asc':
-            order = "likeCount:asc"
-        elif sort == 'create_date_asc':
-            order = "create_date:asc"
-        else:
-            order = "create_date:desc"
+        ordering = ES_SORT_ORDERING.get(sort, ES_SORT_ORDERING['create_date_desc'])
 
         cursor = kwargs.get('cursor')
         limit = kwargs.get('limit', 20)
 
-        if cursor and order == "create_date:desc":
-            es_must.append({'range': {"idreviewcomment": {"lt": cursor}}})
-            body = {'query': {'bool': {'must': es_must}}}
-            es_data = elasticsearch_reviews.get_list(order, limit + 1, body)
-        else:
-            offset = (int(cursor or 1) - 1) * limit
-            body = {'query': {'bool': {'must': es_must}}}
-            es_data = elasticsearch_reviews.get_list(order, limit + 1, body, offset)
+        body = {'query': {'bool': {'must': es_must}}, 'sort': list(ordering)}
+        if cursor:
+            body['search_after'] = decode_cursor(cursor, len(ordering))
+
+        res = elasticsearch_reviews.search(body=body, _size=limit + 1)
+        es_data = {'hits': res['hits']['hits'], 'total': res['hits']['total']}
 
         skin_map = {
             8: "건성",
@@ -534,18 +570,17 @@ class ReviewService:
 
             review_list.append(item)
 
-        for goods in ProductGoods.objects.filter(product_id__in=product_id_list):
-            for review in review_list:
-                if review['product']['id'] == goods.product_id:
-                    review['product']['productgoods'] = goods
+        # 제품 정보는 제품 카드로 채운다.
+        cards = product_card_service.get_cards(product_id_list)
+        for review in review_list:
+            card = cards.get(review['product']['id'])
+            if card:
+                review['product'] = card
 
         row = es_data['total']
 
         if len(review_list) == limit + 1:
-            if order == "create_date:desc":
-                next_offset = review_list[-2].get('id')
-            else:
-                next_offset = int(cursor or 1) + 1
+            next_offset = encode_cursor(es_data['hits'][-2]['sort'])
             del review_list[-1]
         else:
             next_offset = None
@@ -583,20 +618,55 @@ class ReviewService:
 
         return base.first()
 
+    def like_added(self, review):
+        """
+        좋아요 추가, 리뷰와 작성자의 좋아요 수(인기도)를 증감값으로 반영한다.
+        """
+        Review.objects.filter(id=review.id).update(like_count=F('like_count') + 1)
+        User.objects.filter(id=review.user_id).update(like_count=F('like_count') + 1, score=F('score') + 2)
+        transaction.on_commit(lambda: add_like_dirty(review.user_id, review.id))
+
+    def likes_removed(self, user_id, count):
+        """
+        리뷰 삭제로 좋아요가 지워졌을 때 작성자의 좋아요 수(인기도) 감소
+        """
+        if count:
+            User.objects.filter(id=user_id).update(like_count=F('like_count') - count, score=F('score') - count * 2)
+            transaction.on_commit(lambda: add_like_dirty(user_id))
+
+    def reconcile_dirty_like_counts(self):
+        """
+        마지막 검증 이후 좋아요 수가 바뀐 유저, 리뷰만 검증한다.
+        """
+        user_ids, review_ids = pop_like_dirty()
+        return self.reconcile_like_counts(user_ids, review_ids)
+
+    def reconcile_like_counts(self, user_ids, review_ids):
+        """
+        좋아요 수를 실제 좋아요 데이터와 비교해서 다르면 바로잡는다.
+        :return: (바로잡은 유저 수, 바로잡은 리뷰 아이디 목록)
+        """
+        fixed_users = 0
+        for user in User.objects.filter(id__in=user_ids).only('id', 'like_count', 'score'):
+            info = users_service.get_user_score_info(user.id)
+            if user.like_count != info.get('like_count') or user.score != info.get('score'):
+                User.objects.filter(id=user.id).update(like_count=info.get('like_count'), score=info.get('score'))
+                fixed_users += 1
+
+        fixed_reviews = list()
+        for review in Review.objects.filter(id__in=review_ids).only('id', 'user_id', 'product_id', 'like_count'):
+            like_count = Reviewlike.objects.filter(writer=review.user_id, product=review.product_id).count()
+            if review.like_count != like_count:
+                Review.objects.filter(id=review.id).update(like_count=like_count)
+                fixed_reviews.append(review.id)
+
+        return fixed_users, fixed_reviews
+
     def delete_tags(self, review_id):
         """
         태그와 리뷰와의 연결 제거
         """
-        object_tags = TagObject.objects.select_related('tag').filter(type='review', object_id=review_id)
-        now = local_now().strftime('%Y%m%d%H%M%S')
-        # tag count update
-        for _obj in object_tags:
-            _obj.tag.count -= 1
-            _obj.tag.modified_date = now
-            _obj.tag.save()
-        # delete tag mapping
-        if object_tags.exists():
-            object_tags.delete()
+        tag_service.remove_reviews_tags([review_id])
 
     def create_report(self, review_id, user_id, client_ip, report_type, contents, editor_id):
         """
@@ -620,67 +690,86 @@ class ReviewService:
         common_code_values = common_code_values.values('value_code', 'value_name')
         return common_code_values
 
+    def _make_like_text(self, nicknames, count, review):
+        """
+        :param nicknames: 최근 좋아요 한 순서의 닉네임 목록
+        """
+        if count == 2 and len(nicknames) >= 2:
+            return "{}, {}님이 내 리뷰를 좋아합니다.\n{} - {}".format(
+                nicknames[0], nicknames[1], review.product.brand.name, review.product.name
+            )
+        elif count > 2:
+            return "{}님 외 {}명이 내 리뷰를 좋아합니다.\n{} - {}".format(
+                nicknames[0], count - 1, review.product.brand.name, review.product.name
+            )
+        return "{}님이 내 리뷰를 좋아합니다.\n{} - {}".format(
+            nicknames[0], review.product.brand.name, review.product.name
+        )
+
     @transaction.atomic
-    def make_like_message(self, review_id, register_id, created_at=None):
+    def make_like_messages(self, likes):
         """
-        좋아요 알림함 메세지 생성
+        좋아요 알림함 메세지 생성 (리뷰별로 모은 좋아요를 한번에 반영)
+        :param likes: { review_id: [{ 'register_id', 'created_at'(timestamp) }, ...] }
+        :return: 리뷰별 푸시 [{ 'target_id', 'product_id', 'text' }, ...]
         """
-        review = Review.objects.select_related(
+        reviews = Review.objects.select_related(
             'user', 'product', 'product__brand'
-        ).get(
-            id=review_id
-        )
+        ).in_bulk(list(likes.keys()))
+        if not reviews:
+            return []
+
+        register_ids = set(like['register_id'] for events in likes.values() for like in events)
+        nicknames = dict(User.objects.filter(id__in=register_ids).values_list('id', 'nickname'))
+
+        category = MessageCategory.objects.get(name='좋아요')
+        boxes = {box.reference_id: box for box in MessageBox.objects.filter(
+            category=category, reference_id__in=list(reviews.keys()), is_active=True
+        )}
+
+        new_boxes = list()
+        pushes = list()
+        for review_id, review in reviews.items():
+            events = sorted(likes[review_id], key=lambda like: like['created_at'])
+            latest = [nicknames.get(like['register_id']) for like in reversed(events)]
+            created_at = datetime.fromtimestamp(events[0]['created_at'], tz=timezone.utc)
+            updated_at = datetime.fromtimestamp(events[-1]['created_at'], tz=timezone.utc)
+
+            box = boxes.get(review_id)
+            if box is None or box.user_id != review.user_id:
+                new_boxes.append(MessageBox(
+                    user_id=review.user_id, category=category, reference_id=review_id, is_active=True,
+                    message=self._make_like_text(latest, len(events), review),
+                    created_at=created_at, updated_at=updated_at
+                ))
+            else:
+                # 메세지 생성 이후 (최대 2주) 의 좋아요를 모두 합쳐서 보여준다.
+                since = max(box.created_at, updated_at - timedelta(days=14))
+                recent = Reviewlike.objects.filter(
+                    writer=review.user_id, product=review.product_id,
+                    create_date__gte=since.astimezone(tz=timezone.get_current_timezone()).strftime('%Y%m%d%H%M%S')
+                ).order_by('-create_date').values_list('register__nickname', flat=True)
+                count = recent.count()
+                box.message = self._make_like_text(list(recent[:2]) or latest, max(count, 1), review)
+                box.updated_at = updated_at
+                box.save()
+
+            pushes.append({
+                'target_id': review.user_id,
+                'product_id': review.product_id,
+                'text': self._make_like_text(latest, len(events), review),
+            })
 
-        if not created_at:
-            created_at = utc_now()
-        two_week_ago = created_at.astimezone(tz=timezone.get_current_timezone()) - timedelta(days=14)
+        if new_boxes:
+            MessageBox.objects.bulk_create(new_boxes)
 
-        obj, created = MessageBox.objects.get_or_create(
-            user_id=review.user_id,
-            category=MessageCategory.objects.get(name='좋아요'),
-            reference_id=review_id,
-            is_active=True
-        )
+        # 다시 읽지 않은 상태로 바꾼다.
+        updated_box_ids = [box.id for box in boxes.values()]
+        if updated_box_ids:
+            MessageCheck.objects.filter(message__in=updated_box_ids).delete()
 
-        if created:
-            register = User.objects.get(id=register_id)
-            obj.message = "{}님이 내 리뷰를 좋아합니다.\n{} - {}".format(
-                register.nickname, review.product.brand.name, review.product.name
-            )
-            obj.created_at = created_at
-            obj.updated_at = created_at
-            obj.save()
-        else:
-            MessageCheck.objects.filter(user_id=review.user_id, message=obj.id).delete()
-            likes = Reviewlike.objects.filter(
-                writer=review.user, product=review.product,
-                create_date__gte=two_week_ago.strftime('%Y%m%d%H%M%S'),
-            )
-            likes = likes.filter(
-                create_date__gte=obj.created_at.astimezone(tz=timezone.get_current_timezone()).strftime('%Y%m%d%H%M%S')
-            ).order_by(
-                'create_date'
-            )
-            likes = likes.values(
-                'register__nickname',
-            )
-            count = likes.count()
-            if count == 2:
-                nickname1 = likes[1].get('register__nickname')
-                nickname2 = likes[0].get('register__nickname')
-                obj.message = "{}, {}님이 내 리뷰를 좋아합니다.\n{} - {}".format(
-                    nickname1, nickname2, review.product.brand.name, review.product.name
-                )
+        return pushes
 
-            elif count > 2:
-                likes = list(likes)
-                nickname = likes[-1].get('register__nickname')
-                obj.message = "{}님 외 {}명이 내 리뷰를 좋아합니다.\n{} - {}".format(
-                    nickname, count - 1, review.product.brand.name, review.product.name
-                )
-            obj.updated_at = created_at
-            obj.save()
-    
     def get_review_count(self,id):
         return Review.objects.filter(
             user__id=id, state='N', when_seceded=0, is_display=1).count()
@@ -698,21 +787,15 @@ class ReviewService:
         previous_rank_info = get_user_rank(period, user_id)
 
         points = self.get_review_points()
-        # 점수를 계산한 후 반영한다.
-        # 기본 10 점 + review_count가 3으로 떨어지면 3 점 + 처음 리뷰 3 점
-        point = points['review_point']
-        bonus = (is_multiple * points['multiple_bonus_point']) + \
-                (is_first * points['first_bonus_point'])
-
-        point_and_bonus = point + bonus
         is_first_review = False
         
         if previous_rank_info is not None:
             previous_rank = previous_rank_info['rank']
             
-            # 변경 사항은 원본과 복사본 모두에 적용한다.
+            # 변경 사항은 현재 랭킹 테이블에만 적용한다.
             # 랭킹 포인트 업데이트
-            period_zincrby(period, user_id, point_and_bonus)
+            # 기본 10 점 + review_count가 3으로 떨어지면 3 점 + 처음 리뷰 3 점
+            rank_ledger_service.review_written(period, user_id, points, is_multiple, is_first)
             # 업데이트 후 랭킹을 다시 가져온다.
             updated_rank_info = get_user_rank(period, user_id)
             
@@ -722,7 +805,7 @@ class ReviewService:
             upgrade_range = previous_rank - updated_rank
         else:
             is_first_review = True
-            period_zincrby(period, user_id, point_and_bonus)
+            rank_ledger_service.review_written(period, user_id, points, is_multiple, is_first)
             updated_rank_info = get_user_rank(period, user_id)
             total_count = period_zcard(period)
             
@@ -796,79 +879,52 @@ class ReviewService:
         return result if len(result) > 0 else None
 
     def get_review_points(self):
-        result = dict()
-        points = Point.objects.filter(name__in=(
-            'review_point', 'first_bonus_point', 'multiple_bonus_point')).all()
-        for r in points:
-            _point = r.point
-        
-            if r.event_start_date and r.event_end_date and r.event_point and \
-                    r.event_start_date < utc_now() < r.event_end_date:
-                _point = r.event_point
-        
-            if r.name == 'review_point':
-                result['review_point'] = _point
-        
-            if r.name == 'multiple_bonus_point':
-                result['multiple_bonus_point'] = _point
-        
-            if r.name == 'first_bonus_point':
-                result['first_bonus_point'] = _point
-    
-        return result
-    
-    def reset_rank(self,user_id):
         """
-        rank 를 리셋한다.
-        :return:
+        리뷰 포인트 설정 (이벤트 기간이면 이벤트 포인트)
         """
-        period_zrem('all',user_id)
-        period_zrem('this_week',user_id)
-        
-        reviews = Review.objects.filter(
-            user_id=user_id, state='N', when_seceded=0,
-            is_display=1, user__is_blinded=0, user__is_black=0,
-            user__is_active=1).all()
+        now = utc_now()
 
-        user_review_count = len(reviews)
-        
-        if user_review_count <= 0:
-            return ''
+        result = dict()
+        for name, point, event_point, event_start_date, event_end_date in self._get_point_config():
+            _point = point
 
-        review_points = self.get_review_points()
+            if event_start_date and event_end_date and event_point and \
+                    event_start_date < now < event_end_date:
+                _point = event_point
 
-        review_first_logs = Review_first_log.objects.filter(
-                user_id=user_id).all()
+            result[name] = _point
 
-        first_count = len(review_first_logs)
-        
-        this_week_first_count = 0
-        for r in review_first_logs:
-            # 해당 리뷰가 이번주에 쓴 것이라면 this_week_first_count 에도 넣어준다.
-            if r.created_at > iso8601(kst_last_week_friday_18_00()):
-                this_week_first_count += 1
+        return result
 
-        this_week_review = [r for r in reviews
-            if r.created_at > iso8601(kst_last_week_friday_18_00())]
+    def _get_point_config(self):
+        """
+        프로세스 안에 POINT_CONFIG_TTL 동안 보관하는 포인트 설정
+        TTL 이 지나면 redis 의 version 을 확인해서 바뀌었거나 POINT_CONFIG_MAX_AGE 가 지났으면 다시 읽는다.
+        """
+        config = _point_config_cache
+        now = time.time()
 
-        user_this_week_review_count = len(this_week_review)
+        if config['rows'] is not None and now < config['expires_at']:
+            return config['rows']
 
-        score = (user_review_count * review_points['review_point']) + \
-                ((user_review_count // 3) * \
-                 review_points['multiple_bonus_point']) + \
-                (first_count * review_points['first_bonus_point'])
-        
-        if score > 0:
-            period_zincrby('all',user_id,score)
+        version = get_point_config_version()
+        if config['rows'] is None or config['version'] != version or \
+                now > config['loaded_at'] + POINT_CONFIG_MAX_AGE:
+            rows = tuple(Point.objects.filter(name__in=(
+                'review_point', 'first_bonus_point', 'multiple_bonus_point'
+            )).values_list('name', 'point', 'event_point', 'event_start_date', 'event_end_date'))
+            config['rows'] = rows
+            config['version'] = version
+            config['loaded_at'] = now
 
-        this_week_score = \
-            (user_this_week_review_count *
-             review_points['review_point']) + \
-            ((user_review_count // 3 - (user_review_count - user_this_week_review_count) // 3) * \
-             review_points['multiple_bonus_point']) + \
-            (this_week_first_count * review_points['first_bonus_point'])
+        config['expires_at'] = now + POINT_CONFIG_TTL
 
-        if this_week_score > 0:
-            period_zincrby('this_week', user_id, this_week_score)
+        return config['rows']
 
 service = ReviewService()
+
+
+@receiver(post_save, sender=Point)
+@receiver(post_delete, sender=Point)
+def invalidate_point_config(sender, **kwargs):
+    bump_point_config_version()
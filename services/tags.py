@@ -1,8 +1,11 @@
 import re
+from collections import Counter, OrderedDict
 
-from django.db.models import Q
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
 
-from models.tags import Tag
+from libs.utils import local_now
+from models.tags import Tag, TagObject
 
 
 class TagService:
@@ -64,5 +67,80 @@ class TagService:
             'next_offset': next_offset,
         }
 
+    def _get_or_create_tags(self, names, now):
+        """
+        :return: ({ 태그 이름: 태그 아이디 }, 새로 만든 태그 이름 set)
+        """
+        tags = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+        missing = [name for name in names if name not in tags]
+        if not missing:
+            return tags, set()
+
+        created = set(missing)
+        try:
+            with transaction.atomic():
+                Tag.objects.bulk_create([Tag(name=name, create_date=now) for name in missing])
+        except IntegrityError:
+            # 동시에 같은 태그가 만들어진 경우 하나씩 처리한다.
+            created = set()
+            for name in missing:
+                tag, is_created = Tag.objects.get_or_create(name=name, defaults={'create_date': now})
+                tags[name] = tag.id
+                if is_created:
+                    created.add(name)
+            return tags, created
+
+        tags.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+        return tags, created
+
+    def set_review_tags(self, review_id, tag_names):
+        """
+        리뷰의 태그 연결을 tag_names 로 맞춘다.
+        기존 연결과 비교해서 추가/삭제된 태그만 반영하고 태그 수는 한번에 증감한다.
+        """
+        now = local_now().strftime('%Y%m%d%H%M%S')
+        names = list(OrderedDict.fromkeys(tag_names))
+
+        current = dict(TagObject.objects.filter(
+            type='review', object_id=review_id
+        ).values_list('tag__name', 'tag_id'))
+
+        removed_ids = [tag_id for name, tag_id in current.items() if name not in names]
+        added_names = [name for name in names if name not in current]
+
+        if removed_ids:
+            TagObject.objects.filter(type='review', object_id=review_id, tag_id__in=removed_ids).delete()
+            Tag.objects.filter(id__in=removed_ids).update(count=F('count') - 1, modified_date=now)
+
+        if added_names:
+            tags, created = self._get_or_create_tags(added_names, now)
+            TagObject.objects.bulk_create([
+                TagObject(type='review', object_id=review_id, tag_id=tags[name]) for name in added_names
+            ])
+
+            # 새로 만든 태그는 기본 수를 그대로 사용한다.
+            existing_ids = [tags[name] for name in added_names if name not in created]
+            if existing_ids:
+                Tag.objects.filter(id__in=existing_ids).update(count=F('count') + 1, modified_date=now)
+
+    def remove_reviews_tags(self, review_ids):
+        """
+        리뷰들의 태그 연결 제거
+        """
+        object_tags = TagObject.objects.filter(type='review', object_id__in=review_ids)
+        counts = Counter(object_tags.values_list('tag_id', flat=True))
+        if not counts:
+            return
+
+        object_tags.delete()
+
+        # 감소량이 같은 태그끼리 묶어서 갱신한다.
+        now = local_now().strftime('%Y%m%d%H%M%S')
+        tag_ids_by_amount = dict()
+        for tag_id, amount in counts.items():
+            tag_ids_by_amount.setdefault(amount, list()).append(tag_id)
+        for amount, tag_ids in tag_ids_by_amount.items():
+            Tag.objects.filter(id__in=tag_ids).update(count=F('count') - amount, modified_date=now)
+
 
 service = TagService()
@@ -9,8 +9,8 @@ from db.raw_queries import counting_for_user_score
 from libs.aws.dynamodb import aws_dynamodb_etc_list
 from libs.utils import get_age_range
 from models.users import User, SkinTypeCode, Gender, SkinTypeKor
-from cash_db.redis_utils import period_zrevrange, period_zcard, period_hmget, \
-    get_user_rank
+from cash_db.redis_utils import period_zcard, period_hmget, \
+    period_zrevrange_with_rank
 from backends.api import exceptions
 class UserService:
     def get_user_score_info(self, user_id):
@@ -185,13 +185,24 @@ class UserService:
         start = limit * (cursor - 1) - 1 if cursor > 1 else limit * (cursor - 1)
         end = limit * cursor
         
-        user_id_and_scores = period_zrevrange(
-            period, start , end, withscores=True)
-        
-        if user_id_and_scores:
-            user_ids = list(r[0] for r in user_id_and_scores)
+        #  hash map 을 업데이트할 때 자신의 점수만 계산해서 넣기 때문에
+        #  sorted set 의 list 를 기준으로 랭킹을 정함으로 rank 를 페이지 단위로 다시 계산한다.
+        #  동점자는 같은 랭크로 표현한다.
+        user_ranks = period_zrevrange_with_rank(period, start, end)
+
+        if user_ranks:
+            user_ids = list(r['id'] for r in user_ranks)
             # user 정보는 all로 통합하여 참고하도록 한다.
             users = period_hmget('all', user_ids)
+
+            # hash map 에 없는 유저는 DB 에서 한번에 가져온다.
+            missing_ids = [user_ids[idx] for idx, val in enumerate(users)
+                           if val is None]
+            missing_users = dict()
+            if missing_ids:
+                missing_users = {
+                    str(u.id): u for u in User.objects.filter(id__in=missing_ids)}
+
             results = list()
             # profile_image 이미지를 만들어서 반환한다.
             for idx, val in enumerate(users):
@@ -201,39 +212,25 @@ class UserService:
                         val['fileDir'] and val['fileSaveName'] \
                     and  "{}{}/{}".format(
                         settings.CDN, val['fileDir'],val['fileSaveName'])
-                    #  hash map 을 업데이트할 때 자신의 점수만 계산해서 넣기 때문에
-                     #  sorted set 의 list 를 기준으로 랭킹을 정함으로
-                    # rank 를 다시 계산해서 넣어준다.
-                    #  중복값을 표현하기 위해 바로 전 인덱스의 포인트와 현 포인트가 같으면
-                    # 랭크를 같게 표현한다.
-                    user_info = get_user_rank(
-                            period, val['idRegister'])
-                    val['rank'] = user_info['rank']
-                    val['score'] = user_info['score']
-                    val['ratio'] = user_info['ratio']
-                    
                 else:
-                    val = dict()
-                    _user_id = user_ids[idx]
-                    try:
-                        _user = User.objects.get(id=_user_id)
-                    except User.DoesNotExist:
+                    _user = missing_users.get(str(user_ids[idx]))
+                    if _user is None:
                         continue
+                    val = dict()
                     val['profile_image'] = \
                         _user.file_dir and _user.file_name_save \
                         and "{}{}/{}".format(
                             settings.CDN, _user.file_dir, _user.file_name_save)
                     val['idRegister'] = _user.id
                     val['nickname'] = _user.nickname
-                    user_info = get_user_rank(
-                        period, _user_id)
-                    val['rank'] = user_info['rank']
-                    val['score'] = user_info['score']
-                    val['ratio'] = user_info['ratio']
-                    
+
+                user_info = user_ranks[idx]
+                val['rank'] = user_info['rank']
+                val['score'] = user_info['score']
+                val['ratio'] = user_info['ratio']
+
                 results.append(val)
-                
-                
+
             # 처음
             if cursor == 1:
                 results = results[:limit]
@@ -2,7 +2,8 @@ from enum import Enum
 
 from django.db.models import F
 
-from models.users import User
+from models.users import User, Wish
+from services.product_cards import service as product_card_service
 
 
 class Sort(Enum):
@@ -27,7 +28,7 @@ class WishService:
         is_commerce = kwargs.get('is_commerce')
 
         wishes = User.objects.get(id=user_id).wishes
-        wishes = wishes.filter(is_display=True).select_related('brand', 'productgoods')
+        wishes = wishes.filter(is_display=True)
 
         if store_id and store_id != 'all':
             stores = store_id.split(",")
@@ -68,17 +69,18 @@ class WishService:
             wishes = wishes.annotate(wish_id=F('wish__id'))
             wishes = wishes.filter(wish_id__lt=cursor)
 
-        results = wishes.all().distinct()[:limit + 1]
-
-        if sort != 'latest':
+        if sort == 'latest':
+            product_ids = wishes.all().distinct().values_list('id', flat=True)[:limit + 1]
+        else:
             cursor = int(cursor or 1)
             offset = (cursor - 1) * limit
-            results = wishes.all()[offset: offset + limit + 1]
+            product_ids = wishes.all().values_list('id', flat=True)[offset: offset + limit + 1]
+
+        results = product_card_service.get_list(product_ids)
 
         if len(results) == limit + 1:
-            results = list(results)
             if sort == 'latest':
-                next_offset = results[-2].wish_set.get(user=user_id, product=results[-2].id).id
+                next_offset = Wish.objects.get(user=user_id, product=results[-2]['id']).id
             else:
                 next_offset = cursor + 1
             del results[-1]
@@ -415,8 +415,49 @@ CELERY_QUEUES = {
     }
 }
 
+# 제품 점수 재계산 요청을 모아서 처리하는 간격 (초)
+PRODUCT_UPDATE_WINDOW = int(conf['CELERY'].get('product_update_window', 30))
+
+# 리뷰 검색 색인 요청을 모아서 처리하는 간격 (초)
+REVIEW_INDEX_WINDOW = int(conf['CELERY'].get('review_index_window', 2))
+
+# 리뷰 좋아요 알림을 모아서 보내는 간격 (초)
+LIKE_NOTIFICATION_WINDOW = int(conf['CELERY'].get('like_notification_window', 10))
+# 푸시 발송 동시 요청 수
+PUSH_MAX_WORKERS = int(conf['CELERY'].get('push_max_workers', 4))
+
+# 제품 랭킹 스냅샷에 저장하는 최대 제품 수
+RANKING_SNAPSHOT_SIZE = int(conf['CELERY'].get('ranking_snapshot_size', 5000))
+# 제품 랭킹 스냅샷 유지 시간 (초)
+RANKING_SNAPSHOT_EXPIRE = int(conf['CELERY'].get('ranking_snapshot_expire', 60 * 60 * 3))
+# 주기적으로 다시 만드는 많이 조회된 랭킹 스냅샷 수
+RANKING_SNAPSHOT_TOP_KEYS = int(conf['CELERY'].get('ranking_snapshot_top_keys', 1000))
+# 주간 랭킹 교체(this_week -> last_week)를 이 서버에서 실행할지
+# 외부 랭킹 배치의 주간 교체를 중단한 후에만 켠다. (둘 다 실행되면 지난주 랭킹이 지워진다.)
+RANKING_ROLLOVER_ENABLED = conf['CELERY'].get('ranking_rollover_enabled', 'false').lower() == 'true'
+
+# 네이버 정보 갱신 중복 방지 시간 (초)
+NAVER_REFRESH_LOCK_TIMEOUT = int(conf['CELERY'].get('naver_refresh_lock_timeout', 600))
+# 네이버 정보를 미리 갱신하는 조회수 상위 제품 수
+NAVER_REFRESH_TOP_PRODUCTS = int(conf['CELERY'].get('naver_refresh_top_products', 500))
+
 # CronTab Initializing
 # minute hour Days Month WeekOfDay , command
 CRONJOBS = [
+    # 검색어 카테고리 색인 갱신 (모든 프로세스)
     ('0 10 * * *', 'scripts.categories.run'),
+    # 제품 평점 구간 카운터 전체 집계
+    ('0 4 * * *', 'scripts.product_scores.run'),
+    # 조회수 상위 제품의 네이버 정보 갱신
+    ('30 */6 * * *', 'scripts.naver.run'),
+    # 이벤트, 이달의 신제품 배너 이미지 크기 확인
+    ('10 * * * *', 'scripts.images.run'),
+    # 좋아요 수 검증
+    ('40 * * * *', 'scripts.likes.run'),
+    # 제품 랭킹 스냅샷 갱신
+    ('20 * * * *', 'scripts.ranking_snapshots.run'),
 ]
+
+# 매주 금요일 18시 이번주 랭킹을 지난주 랭킹으로 교체
+if RANKING_ROLLOVER_ENABLED:
+    CRONJOBS.append(('0 18 * * 5', 'scripts.rankings.rollover'))
@@ -0,0 +1,59 @@
+import logging
+
+from celery import shared_task
+
+from cash_db.redis_utils import get_images_meta, set_image_meta, lock_image_meta
+from db.raw_queries import get_monthly_products_by_main_category
+from libs.images import get_image_meta
+from models.events import Event
+from models.products import MainCategory
+
+logger = logging.getLogger(__name__)
+
+# 같은 이미지의 계산 요청을 막는 시간 (초)
+IMAGE_META_LOCK_TIMEOUT = 600
+
+
+def request_image_meta(url):
+    """
+    이미지 크기 계산 요청 (중복 요청은 무시한다)
+    """
+    if lock_image_meta(url, IMAGE_META_LOCK_TIMEOUT):
+        update_image_meta.delay(url)
+
+
+@shared_task
+def update_image_meta(url):
+    """
+    이미지 크기를 계산해서 저장한다. ETag 가 같으면 다시 읽지 않는다.
+    """
+    stored = get_images_meta([url]).get(url)
+
+    meta = get_image_meta(url, etag=stored.get('etag') if stored else None)
+    if meta:
+        set_image_meta(url, meta)
+
+    return url
+
+
+@shared_task
+def refresh_image_metas():
+    """
+    진행 중인 이벤트와 이달의 신제품 배너 이미지의 크기를 다시 확인한다.
+    """
+    urls = set(Event.objects.ongoing().values_list('event_image', flat=True))
+
+    for category_id in MainCategory.objects.filter(is_display=True).values_list('id', flat=True):
+        for product in get_monthly_products_by_main_category(category_id):
+            if product.get('banner_image'):
+                urls.add(product.get('banner_image_720'))
+
+    for url in urls:
+        if not url:
+            continue
+        try:
+            update_image_meta(url)
+        except Exception as e:
+            logger.error('update_image_meta({}) failed: {}'.format(url, e))
+
+    return len(urls)
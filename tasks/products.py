@@ -1,121 +1,196 @@
+import json
+import logging
+
 from celery import shared_task
-from django.db.models import Case, IntegerField, Sum
-from django.db.models import Q
-from django.db.models import When
+from celery.signals import worker_process_shutdown
+from django.conf import settings
 
+from cash_db.redis_utils import add_product_update, pop_product_updates, lock_naver_refresh, unlock_naver_refresh, \
+    update_job
 from libs.aws.dynamodb import aws_dynamodb_products
+from libs.aws.dynamodb_writer import product_update_buffer
+from libs.elasticsearch.reviews import elasticsearch_reviews
+from libs.openapi.naver import naver_openapi
 from libs.shortcuts import get_object_or_404
 from models.products import Product
-from models.reviews import Review
+from services.product_scores import service as product_score_service
+from services.review_index import service as review_index_service
+
+logger = logging.getLogger(__name__)
+
+
+def request_update_product_info(product_id):
+    """
+    제품 점수 재계산 요청
+    PRODUCT_UPDATE_WINDOW 동안의 요청을 모아서 제품별로 한번만 계산한다.
+    """
+    window = settings.PRODUCT_UPDATE_WINDOW
+    # 처리 task 가 실행되지 않았을 때 예약이 풀리도록 유지 시간은 여유있게 잡는다.
+    if add_product_update(product_id, window * 3):
+        drain_product_info_updates.apply_async(countdown=window)
+
+
+@worker_process_shutdown.connect
+def flush_product_update_buffer(**kwargs):
+    product_update_buffer.flush()
 
 
 @shared_task
-def update_product_info(product_id):
+def update_product_info(product_id, flush=True):
     """
-    제품에 작성된 리뷰를 가지고 점수를 계산한다.
+    제품의 평점 구간별 리뷰 수 카운터를 가지고 점수를 계산한다.
+    flush 가 False 이면 dynamo 업데이트는 버퍼에 모아두고 나중에 한번에 반영한다.
     """
 
     # product score update
     product = get_object_or_404(Product, id=product_id, is_display=True)
 
-    reviews = Review.objects.filter(product=product, is_display=True, state='N', user__is_blinded=0)
-
-    result = reviews.annotate(
-        rating1=Case(When(rating=1, then=1), output_field=IntegerField(), default=0),
-        rating2=Case(When(rating=2, then=1), output_field=IntegerField(), default=0),
-        rating3=Case(When(rating=3, then=1), output_field=IntegerField(), default=0),
-        rating4_1=Case(
-            When(Q(rating=4, user__review_count__lte=1), then=1),
-            output_field=IntegerField(), default=0
-        ),
-        rating4_2=Case(
-            When(Q(rating=4, user__review_count__gt=1, user__review_count__lte=10), then=1),
-            output_field=IntegerField(),
-            default=0
-        ),
-        rating4_3=Case(
-            When(Q(rating=4, user__review_count__gt=10, user__review_count__lt=30), then=1),
-            output_field=IntegerField(),
-            default=0
-        ),
-        rating4_4=Case(
-            When(Q(rating=4, user__review_count__gte=30), then=1),
-            output_field=IntegerField(),
-            default=0
-        ),
-        rating5_1=Case(
-            When(Q(rating=5, user__review_count__lte=1), then=1),
-            output_field=IntegerField(),
-            default=0
-        ),
-        rating5_2=Case(
-            When(Q(rating=5, user__review_count__gt=1, user__review_count__lte=10), then=1),
-            output_field=IntegerField(),
-            default=0
-        ),
-        rating5_3=Case(
-            When(Q(rating=5, user__review_count__gt=10, user__review_count__lt=30), then=1),
-            output_field=IntegerField(),
-            default=0
-        ),
-        rating5_4=Case(
-            When(Q(rating=5, user__review_count__gte=30), then=1),
-            output_field=IntegerField(),
-            default=0
-        ),
-    ).aggregate(
-        Sum('rating1'), Sum('rating2'), Sum('rating3'),
-        Sum('rating4_1'), Sum('rating4_2'), Sum('rating4_3'), Sum('rating4_4'),
-        Sum('rating5_1'), Sum('rating5_2'), Sum('rating5_3'), Sum('rating5_4')
-    )
-
-    rating1 = result['rating1__sum']
-    rating2 = result['rating2__sum']
-    rating3 = result['rating3__sum']
-
-    rating4_1 = result['rating4_1__sum']
-    rating4_2 = result['rating4_2__sum']
-    rating4_3 = result['rating4_3__sum']
-    rating4_4 = result['rating4_4__sum']
-
-    rating5_1 = result['rating5_1__sum']
-    rating5_2 = result['rating5_2__sum']
-    rating5_3 = result['rating5_3__sum']
-    rating5_4 = result['rating5_4__sum']
-
-    # review count
-    review_count = rating1 + rating2 + rating3 + \
-                   rating4_1 + rating4_2 + rating4_3 + rating4_4 + \
-                   rating5_1 + rating5_2 + rating5_3 + rating5_4
-
-    # rating_avg
-    rating_avg = (rating1 * 1.0 + rating2 * 2.0 + rating3 * 3.0 + (
-        rating4_1 + rating4_2 + rating4_3 + rating4_4) * 4.0 + (
-                      rating5_1 + rating5_2 + rating5_3 + rating5_4) * 5) / review_count
-    rating_avg = round(rating_avg, 2)
-
-    # product score
-    converted_sum = rating1 * -20.0 + rating2 * -10.0 + rating3 * -1.0
-    converted_sum += rating4_1 * 0.5 + rating4_2 * 2.5 + rating4_3 * 4.0 + rating4_4 * 5.0
-    converted_sum += rating5_1 * 1.0 + rating5_2 * 5.0 + rating5_3 * 8.0 + rating5_4 * 10.0
-
-    if review_count > 70:
-        score = converted_sum / review_count * 70
-    else:
-        score = converted_sum
-
-    review_count_score = review_count * 0.05 if review_count * 0.05 <= 50.0 else 50.0
-    score += review_count_score
-    score = round(score, 2)
-
-    product.score = score
-    product.review_count = review_count
-    product.rating_avg = rating_avg
+    counters = product_score_service.get_counters(product_id)
+    result = product_score_service.calculate(counters)
+
+    product.score = result['score']
+    product.review_count = result['review_count']
+    product.rating_avg = result['rating_avg']
     product.save()
 
     # dynamo update
     attr_update = {'rating_avg': {'Value': {'N': str(product.rating_avg)}, 'Action': 'PUT'},
                    'review_count': {'Value': {'N': str(product.review_count)}, 'Action': 'PUT'}}
-    aws_dynamodb_products.update(product_id, attr_update)
+    product_update_buffer.add(product_id, attr_update)
+    if flush:
+        product_update_buffer.flush()
+
+    return product_id
+
+
+@shared_task
+def reconcile_product_scores():
+    """
+    평점 구간 카운터를 전체 리뷰 집계와 맞추고 달라진 제품의 점수를 다시 계산한다.
+    """
+    product_ids = product_score_service.reconcile_all()
+    for product_id in product_ids:
+        request_update_product_info(product_id)
+
+    return len(product_ids)
+
+
+@shared_task
+def drain_product_info_updates():
+    """
+    모아둔 제품 점수 재계산 요청을 처리한다.
+    """
+    request_count, product_ids = pop_product_updates()
+
+    updated_count = 0
+    for product_id in product_ids:
+        try:
+            update_product_info(product_id, flush=False)
+            updated_count += 1
+        except Exception as e:
+            logger.error('update_product_info({}) failed: {}'.format(product_id, e))
+
+    flushed = product_update_buffer.flush()
+
+    result = {
+        'request_count': request_count,
+        'product_count': len(product_ids),
+        'updated_count': updated_count,
+        'merged_count': max(request_count - len(product_ids), 0),
+        'dynamodb_failed_count': flushed['failed'],
+    }
+    logger.info('drain_product_info_updates: {}'.format(result))
+
+    return result
 
-    return product_id
\ No newline at end of file
+
+def request_refresh_naver_info(product_id, query=None):
+    """
+    제품의 네이버 블로그/쇼핑 정보 갱신 요청
+    NAVER_REFRESH_LOCK_TIMEOUT 동안 같은 제품은 한번만 갱신한다.
+    """
+    if lock_naver_refresh(product_id, settings.NAVER_REFRESH_LOCK_TIMEOUT):
+        refresh_naver_info.delay(product_id, query)
+        return True
+    return False
+
+
+@shared_task
+def refresh_naver_info(product_id, query=None):
+    """
+    네이버 openapi 로 블로그/쇼핑 정보를 가져와서 dynamo 에 반영한다.
+    """
+    try:
+        if query is None:
+            results = aws_dynamodb_products.get_product(product_id)
+            query = results['brand_title']['S'] + " " + results['product_title']['S']
+
+        blog_info, shop_info = naver_openapi.retrieve(query)
+    except Exception:
+        # 실패하면 다음 요청 때 다시 갱신할 수 있도록 예약을 푼다.
+        unlock_naver_refresh(product_id)
+        raise
+
+    attr_update = {
+        'naver_api_updated_at': {'Value': {'S': naver_openapi.get_current_time()}},
+        'blog_info': {'Value': {'B': json.dumps(blog_info)}},
+        'shop_info': {'Value': {'B': json.dumps(shop_info)}}
+    }
+    product_update_buffer.add(product_id, attr_update)
+    product_update_buffer.flush()
+
+    return product_id
+
+
+@shared_task
+def refresh_popular_naver_info(limit=None):
+    """
+    조회수 상위 제품의 네이버 정보를 오래되기 전에 미리 갱신한다.
+    """
+    limit = limit or settings.NAVER_REFRESH_TOP_PRODUCTS
+
+    product_ids = Product.objects.filter(
+        is_display=True
+    ).order_by(
+        '-read_count'
+    ).values_list('id', flat=True)[:limit]
+
+    requested = 0
+    for product_id in product_ids:
+        if request_refresh_naver_info(product_id):
+            requested += 1
+
+    return requested
+
+
+@shared_task
+def propagate_goods_pricing(job_id, goods, product_batch_size=50, page_size=1000):
+    """
+    제품 구매 정보를 리뷰 문서에 반영한다.
+    제품을 product_batch_size 개씩 나누고 리뷰 문서는 page_size 개씩 읽어서 bulk 로 업데이트한다.
+    :param goods: [{ 'product_id', 'goods_count', 'min_price', 'max_price' }, ...]
+    """
+    update_job(job_id, values={'status': 'running'})
+
+    try:
+        for start in range(0, len(goods), product_batch_size):
+            batch = goods[start:start + product_batch_size]
+            goods_info = {item['product_id']: {
+                'goods_count': item['goods_count'],
+                'min_price': item['min_price'],
+                'max_price': item['max_price']
+            } for item in batch}
+
+            for hits in review_index_service.iter_product_review_hits(goods_info.keys(), page_size):
+                elasticsearch_reviews.bulk(review_index_service.make_goods_actions(hits, goods_info))
+                update_job(job_id, increments={'review_count': len(hits)})
+
+            update_job(job_id, increments={'product_done': len(batch)})
+    except Exception as e:
+        logger.error('propagate_goods_pricing({}) failed: {}'.format(job_id, e))
+        update_job(job_id, values={'status': 'failed', 'error': str(e)})
+        raise
+
+    update_job(job_id, values={'status': 'done'})
+
+    return job_id
@@ -0,0 +1,54 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+
+from cash_db.redis_utils import lock_ranking_snapshot, pop_ranking_snapshot_requests
+from models.products import SubCategory
+from services.ranking_snapshots import service as ranking_snapshot_service
+
+logger = logging.getLogger(__name__)
+
+# 같은 랭킹 스냅샷의 생성 요청을 막는 시간 (초)
+RANKING_SNAPSHOT_LOCK_TIMEOUT = 600
+
+RANK_TERMS = ('all', '3month', '6month')
+
+
+def request_ranking_snapshot(key):
+    """
+    랭킹 스냅샷 생성 요청 (중복 요청은 무시한다)
+    """
+    if lock_ranking_snapshot(key, RANKING_SNAPSHOT_LOCK_TIMEOUT):
+        build_ranking_snapshot.delay(key)
+
+
+@shared_task
+def build_ranking_snapshot(key):
+    return ranking_snapshot_service.build(key)
+
+
+@shared_task
+def refresh_ranking_snapshots(limit=None):
+    """
+    카테고리별 기본 조건 랭킹과 최근 많이 조회된 조건의 랭킹 스냅샷을 다시 만든다.
+    """
+    limit = limit or settings.RANKING_SNAPSHOT_TOP_KEYS
+
+    keys = list()
+    for category_id in SubCategory.objects.filter(is_display=True).values_list('id', flat=True):
+        for rank_term in RANK_TERMS:
+            keys.append(ranking_snapshot_service.make_key('category', category_id, rank_term=rank_term))
+
+    default_keys = set(keys)
+    requested = [key for key in pop_ranking_snapshot_requests(limit) if key not in default_keys]
+
+    built_count = 0
+    for key in keys + requested:
+        try:
+            ranking_snapshot_service.build(key)
+            built_count += 1
+        except Exception as e:
+            logger.error('build_ranking_snapshot({}) failed: {}'.format(key, e))
+
+    return built_count
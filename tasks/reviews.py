@@ -0,0 +1,213 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from celery import shared_task
+from django.conf import settings
+
+from cash_db.redis_utils import add_review_index, pop_review_index, requeue_review_index, count_review_index, \
+    clear_review_index_attempts, get_next_review_index_at, add_like_notification, pop_like_notifications, \
+    requeue_like_notifications
+from libs.aws.utils import send_push_message
+from libs.elasticsearch.reviews import elasticsearch_reviews
+from services.review_index import service as review_index_service
+from services.reviews import service as review_service
+
+logger = logging.getLogger(__name__)
+
+# 색인에 실패한 리뷰를 다시 시도하는 최대 횟수
+REVIEW_INDEX_MAX_ATTEMPTS = 5
+# 색인 재시도 대기 시간 (초, 시도할 때마다 2배)
+REVIEW_INDEX_RETRY_DELAY = 2
+
+
+def request_review_index(*review_ids, countdown=None):
+    """
+    리뷰 검색 색인 요청 (트랜잭션 커밋 후 호출)
+    REVIEW_INDEX_WINDOW 동안의 요청을 모아서 bulk 로 색인한다.
+    """
+    window = settings.REVIEW_INDEX_WINDOW
+    countdown = max(window, countdown or 0)
+    if add_review_index(review_ids, time.time(), countdown * 10):
+        drain_review_index.apply_async(countdown=countdown)
+
+
+def _is_deleted_missing(e):
+    """
+    bulk 실패가 모두 이미 없는 문서의 삭제(404)인지 확인한다.
+    """
+    errors = e.args[1] if len(e.args) > 1 else None
+    if not errors or not isinstance(errors, list):
+        return False
+
+    for error in errors:
+        for op_type, item in error.items():
+            if op_type != 'delete' or item.get('status') != 404:
+                return False
+    return True
+
+
+def _bulk(actions, max_retries=3, retry_delay=0.5):
+    for attempt in range(max_retries + 1):
+        try:
+            elasticsearch_reviews.bulk(actions)
+            return True
+        except Exception as e:
+            if _is_deleted_missing(e):
+                return True
+            if attempt == max_retries:
+                logger.error('review bulk index failed ({}): {}'.format(len(actions), e))
+            else:
+                time.sleep(retry_delay * (2 ** attempt))
+    return False
+
+
+@shared_task
+def drain_review_index(batch_size=500):
+    """
+    모아둔 리뷰 색인 요청을 batch_size 개씩 bulk 로 반영한다.
+    실패한 리뷰는 시도할 때마다 늦춰서 다시 넣고 REVIEW_INDEX_MAX_ATTEMPTS 번 실패하면 버린다.
+    """
+    started_at = time.time()
+    indexed_count = 0
+    failed_count = 0
+    dropped = list()
+    max_lag = 0.0
+    lag_sum = 0.0
+
+    while True:
+        rows = pop_review_index(batch_size, time.time())
+        if not rows:
+            break
+
+        queued_at = dict(rows)
+        failed = list()
+        try:
+            actions = review_index_service.make_actions(list(queued_at.keys()))
+
+            if not _bulk(list(actions.values())):
+                # 한건씩 다시 시도해서 실패한 리뷰만 다시 요청한다.
+                failed = [review_id for review_id, action in actions.items()
+                          if not _bulk([action], max_retries=0)]
+        except Exception as e:
+            # 꺼낸 요청을 잃지 않도록 모두 다시 넣는다.
+            logger.error('drain_review_index failed ({}): {}'.format(len(rows), e))
+            failed = list(queued_at.keys())
+
+        failed_set = set(failed)
+        done = [review_id for review_id in queued_at if review_id not in failed_set]
+        clear_review_index_attempts(done)
+        dropped += requeue_review_index(
+            failed, time.time(), REVIEW_INDEX_RETRY_DELAY, REVIEW_INDEX_MAX_ATTEMPTS)
+        failed_count += len(failed)
+
+        now = time.time()
+        for review_id in done:
+            lag = now - queued_at[review_id]
+            lag_sum += lag
+            max_lag = max(max_lag, lag)
+        indexed_count += len(done)
+
+        if failed or len(rows) < batch_size:
+            break
+
+    if dropped:
+        logger.error('drain_review_index dropped after {} attempts: {}'.format(
+            REVIEW_INDEX_MAX_ATTEMPTS, dropped))
+
+    # 남은 요청(재시도 대기 포함)이 있으면 처리할 시각에 다시 실행한다.
+    next_at = get_next_review_index_at()
+    if next_at is not None:
+        request_review_index(countdown=next_at - time.time())
+
+    elapsed = time.time() - started_at
+    result = {
+        'indexed_count': indexed_count,
+        'failed_count': failed_count,
+        'dropped_count': len(dropped),
+        'pending_count': count_review_index(),
+        'avg_lag': round(lag_sum / indexed_count, 3) if indexed_count else 0,
+        'max_lag': round(max_lag, 3),
+        'docs_per_sec': round(indexed_count / elapsed, 1) if elapsed else 0,
+    }
+    logger.info('drain_review_index: {}'.format(result))
+
+    return result
+
+
+@shared_task
+def reconcile_like_counts():
+    """
+    좋아요 수가 바뀐 유저, 리뷰의 좋아요 수를 실제 데이터와 맞춘다.
+    """
+    fixed_users, fixed_reviews = review_service.reconcile_dirty_like_counts()
+
+    # 검색 문서의 좋아요 수도 다시 반영한다.
+    if fixed_reviews:
+        request_review_index(*fixed_reviews)
+
+    result = {
+        'fixed_user_count': fixed_users,
+        'fixed_review_count': len(fixed_reviews),
+    }
+    logger.info('reconcile_like_counts: {}'.format(result))
+
+    return result
+
+
+def request_like_notification(review_id, register_id, created_at):
+    """
+    리뷰 좋아요 알림 요청 (트랜잭션 커밋 후 호출)
+    LIKE_NOTIFICATION_WINDOW 동안의 좋아요를 리뷰별로 모아서 알림함 메세지와 푸시를 한번에 보낸다.
+    """
+    window = settings.LIKE_NOTIFICATION_WINDOW
+    event = {'register_id': register_id, 'created_at': created_at.timestamp()}
+    if add_like_notification(review_id, event, window * 10):
+        flush_like_notifications.apply_async(countdown=window)
+
+
+def _send_push(push):
+    try:
+        send_push_message(
+            push['text'],
+            link_type=17,
+            link_code=push['product_id'],
+            target_id=push['target_id'],
+        )
+        return True
+    except Exception as e:
+        logger.error('like push failed ({}): {}'.format(push['target_id'], e))
+        return False
+
+
+@shared_task
+def flush_like_notifications():
+    """
+    모아둔 좋아요 알림을 알림함에 반영하고 리뷰별로 푸시를 한번씩 보낸다.
+    """
+    likes = pop_like_notifications()
+    if not likes:
+        return {'review_count': 0, 'like_count': 0, 'push_count': 0}
+
+    try:
+        pushes = review_service.make_like_messages(likes)
+    except Exception:
+        # 알림함에 반영하지 못했으면 꺼낸 좋아요를 다시 넣고 다음에 처리한다.
+        window = settings.LIKE_NOTIFICATION_WINDOW
+        if requeue_like_notifications(likes, window * 10):
+            flush_like_notifications.apply_async(countdown=window)
+        raise
+
+    sent_count = 0
+    if pushes:
+        with ThreadPoolExecutor(max_workers=settings.PUSH_MAX_WORKERS) as executor:
+            sent_count = sum(executor.map(_send_push, pushes))
+
+    result = {
+        'review_count': len(likes),
+        'like_count': sum(len(events) for events in likes.values()),
+        'push_count': sent_count,
+    }
+    logger.info('flush_like_notifications: {}'.format(result))
+
+    return result